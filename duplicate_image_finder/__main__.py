@@ -1,6 +1,14 @@
-from gui.app import App
+import sys
+import time
 
 
 if __name__ == "__main__":
-    app = App()
+    # The finder and its heavy dependencies are imported here, their import time is part of the timing report
+    started = time.perf_counter()
+    if len(sys.argv) > 1:
+        # The command line mode must not import tkinter, so it works on headless machines
+        from cli import main
+        sys.exit(main(import_time=time.perf_counter() - started))
+    from gui.app import App
+    app = App(import_time=time.perf_counter() - started)
     app.run()
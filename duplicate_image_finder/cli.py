@@ -0,0 +1,230 @@
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import Optional, TextIO
+
+from deletion import Action, DeletionEngine, JournalMismatch, default_journal_path, operations_from_groups
+from feature_cache import FeatureCache, default_cache_path
+from features import FeatureExtractor, HashAlgorithm, HashExtractor, HistogramExtractor, NormalizedHistogramExtractor
+from finder import CompareMode, DuplicateFinder, ImageInfo, ImageInfoGroup
+from metrics import ProgressSnapshot, ProgressTracker
+from scan_state import ScanState, default_state_path
+
+FORMATS = ('ndjson', 'json', 'csv')
+FEATURES = ('histogram', 'counts') + tuple(algorithm.name for algorithm in HashAlgorithm)
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+
+class GroupWriter:
+    """Writes groups one by one in a machine readable format instead of building the whole document in memory"""
+
+    def __init__(self, output: TextIO, format: str) -> None:
+        self.output = output
+        self.format = format
+        self._count = 0
+        self._csv = csv.writer(output) if format == 'csv' else None
+
+    def start(self) -> None:
+        if self._csv is not None:
+            self._csv.writerow(['group', 'path', 'checked'])
+        elif self.format == 'json':
+            self.output.write('{"groups": [')
+
+    def write(self, group: ImageInfoGroup) -> None:
+        images = [{'path': str(image.path), 'checked': image.checked} for image in group]
+        if self._csv is not None:
+            for image in images:
+                self._csv.writerow([self._count, image['path'], int(image['checked'])])
+        elif self.format == 'json':
+            self.output.write((',' if self._count > 0 else '') + '\n  ' + json.dumps(images))
+        else:
+            self.output.write(json.dumps({'group': self._count, 'images': images}) + '\n')
+        self._count += 1
+        self.output.flush()
+
+    def finish(self, failed: list[ImageInfo]) -> None:
+        errors = [{'path': str(image.path), 'error': str(image.error)} for image in failed]
+        if self.format == 'json':
+            self.output.write('\n], "failed": ' + json.dumps(errors) + '}\n')
+        elif self.format == 'ndjson':
+            for error in errors:
+                self.output.write(json.dumps({'failed': error['path'], 'error': error['error']}) + '\n')
+        # Failed images are only reported on stderr for csv, it has a single table
+        self.output.flush()
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='duplicate_image_finder', description="Find similar images")
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan = commands.add_parser('scan', help="scan a directory without the GUI")
+    scan.add_argument('path', type=Path, help="directory to scan")
+    scan.add_argument('--threshold', type=float, default=None,
+                      help="difference of similar images as a fraction in [0, 1] (default: 0.05 for histograms, 0.15 "
+                           "for hashes), or in pixels for counts")
+    scan.add_argument('--features', choices=FEATURES, default='histogram',
+                      help="compare normalized color histograms, histograms of pixel counts or perceptual hashes "
+                           "(default: histogram)")
+    scan.add_argument('--workers', type=int, default=None, help="number of decoding workers (default: CPU count)")
+    scan.add_argument('--format', choices=FORMATS, default='ndjson', help="output format (default: ndjson)")
+    scan.add_argument('--output', type=Path, default=None, help="write groups to this file instead of stdout")
+    scan.add_argument('--mode', choices=[mode.name for mode in CompareMode], default=CompareMode.exact.name,
+                      help="how images are compared (default: exact)")
+    scan.add_argument('--processes', action='store_true', help="decode in worker processes instead of threads")
+    scan.add_argument('--decode-size', type=int, default=None,
+                      help="decode JPEG images for histograms at a reduced scale")
+    scan.add_argument('--thumbnails', action='store_true',
+                      help="compute features from embedded EXIF thumbnails where available and verify similar images "
+                           "at full resolution")
+    scan.add_argument('--no-verify', action='store_true',
+                      help="with --thumbnails, do not verify similar images at full resolution")
+    scan.add_argument('--no-exact', action='store_true', help="decode byte-identical files instead of hashing them")
+    scan.add_argument('--no-cache', action='store_true', help="neither use the feature cache nor the scan state")
+    scan.add_argument('--quiet', action='store_true', help="do not print progress and statistics")
+
+    delete = commands.add_parser('delete', help="delete the checked images of groups written by scan")
+    delete.add_argument('groups', type=Path, help="groups in the json, ndjson or csv format of scan")
+    delete.add_argument('--action', choices=[action.name for action in Action], default=Action.delete.name,
+                        help="delete the images, move them to --quarantine, or replace byte-identical images with "
+                             "hard links or reflinks to the kept image of their group (default: delete)")
+    delete.add_argument('--quarantine', type=Path, default=None, help="directory to move images to")
+    delete.add_argument('--workers', type=int, default=None, help="number of concurrent file operations")
+    delete.add_argument('--journal', type=Path, default=None,
+                        help="record finished operations here to resume an interrupted run (default: in the cache "
+                             "directory)")
+    delete.add_argument('--quiet', action='store_true', help="do not print progress and statistics")
+    return parser.parse_args(argv)
+
+
+def read_groups(path: Path) -> list[list[tuple[Path, bool]]]:
+    """Read groups of (path, checked) from a file written by GroupWriter"""
+    with open(path, newline='') as file:
+        text = file.read()
+    if path.suffix.lower() == '.csv' or text.startswith('group,path,checked'):
+        groups: dict[str, list[tuple[Path, bool]]] = {}
+        for row in csv.DictReader(text.splitlines()):
+            groups.setdefault(row['group'], []).append((Path(row['path']), row['checked'] == '1'))
+        return list(groups.values())
+    if text.lstrip().startswith('{"groups"'):
+        return [[(Path(image['path']), image['checked']) for image in group] for group in json.loads(text)['groups']]
+    entries = (json.loads(line) for line in text.splitlines() if line.strip() != '')
+    return [[(Path(image['path']), image['checked']) for image in entry['images']]
+            for entry in entries if 'images' in entry]
+
+
+def scan(args: argparse.Namespace, import_time: float = 0.0) -> int:
+    if args.threshold is not None and args.features != 'counts' and not 0 <= args.threshold <= 1:
+        print("ERROR: threshold must be a fraction in [0, 1]", file=sys.stderr)
+        return 2
+    if not args.path.is_dir():
+        print(f"ERROR: {args.path} is not a directory", file=sys.stderr)
+        return 2
+
+    cache = None if args.no_cache else FeatureCache(default_cache_path())
+    state_path = default_state_path(str(args.path))
+    state = None
+    if not args.no_cache and state_path.exists():
+        try:
+            state = ScanState.load(state_path)
+        except Exception as e:
+            print(f"WARNING: Could not load scan state {state_path}: {e}", file=sys.stderr)
+    extractor: FeatureExtractor
+    if args.features == 'histogram':
+        extractor = NormalizedHistogramExtractor(args.decode_size, args.thumbnails)
+    elif args.features == 'counts':
+        extractor = HistogramExtractor(args.decode_size, args.thumbnails)
+    else:
+        extractor = HashExtractor(HashAlgorithm[args.features], args.thumbnails)
+    finder = DuplicateFinder(mode=CompareMode[args.mode], cache=cache, state=state, workers=args.workers,
+                             processes=args.processes, exact_duplicates=not args.no_exact, extractor=extractor,
+                             verify=not args.no_verify, progress_interval=PROGRESS_INTERVAL)
+    finder.timings.import_time = import_time
+
+    def on_progress(snapshot: ProgressSnapshot):
+        if not args.quiet:
+            print(snapshot.describe(), file=sys.stderr)
+
+    output = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    try:
+        try:
+            (groups, failed) = finder.find(str(args.path), threshold=args.threshold, progress_handler=on_progress)
+        except KeyboardInterrupt:
+            finder.cancel = True
+            print("Cancelled", file=sys.stderr)
+            return 130
+        if finder.state is not None and cache is not None:
+            finder.state.save(state_path)
+        writer = GroupWriter(output, args.format)
+        writer.start()
+        for group in groups:
+            writer.write(group)
+        writer.finish(failed)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if cache is not None:
+            cache.close()
+
+    if not args.quiet:
+        store = finder.store
+        count = len(store)
+        size = sum(max(store.stat(i)[0], 0) for i in range(count))
+        seconds = max(finder.timings.scan_time, 1e-9)
+        print(f"Scanned {count} images ({size / 1e6:.1f} MB) in {seconds:.2f} s: {count / seconds:.1f} images/s, "
+              f"{size / 1e6 / seconds:.1f} MB/s, {len(groups)} groups, {len(failed)} failed", file=sys.stderr)
+        for image in failed:
+            print(f"WARNING: Could not analyze {image.path}: {image.error}", file=sys.stderr)
+        print(f"INFO: {finder.timings.report()}", file=sys.stderr)
+    return 0
+
+
+def delete(args: argparse.Namespace) -> int:
+    action = Action[args.action]
+    if action == Action.quarantine and args.quarantine is None:
+        print("ERROR: --action quarantine needs --quarantine", file=sys.stderr)
+        return 2
+    try:
+        operations = operations_from_groups(read_groups(args.groups))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"ERROR: Could not read groups from {args.groups}: {e}", file=sys.stderr)
+        return 2
+    engine_args = {} if args.workers is None else {'workers': args.workers}
+    engine = DeletionEngine(action, quarantine=args.quarantine,
+                            journal=args.journal if args.journal is not None else default_journal_path(),
+                            **engine_args)
+
+    def on_progress(snapshot: ProgressSnapshot):
+        if not args.quiet:
+            print(snapshot.describe(), file=sys.stderr)
+
+    cancelled = [False]
+    try:
+        result = engine.run(operations, ProgressTracker(on_progress, PROGRESS_INTERVAL), lambda: cancelled[0])
+    except KeyboardInterrupt:
+        cancelled[0] = True
+        print("Cancelled, run again to resume", file=sys.stderr)
+        return 130
+    except JournalMismatch as e:
+        print(f"ERROR: {e}. Finish that run or remove its journal first.", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    for path, error in result.failed:
+        print(f"WARNING: Could not {action.name} {path}: {error}", file=sys.stderr)
+    if not args.quiet:
+        print(f"{len(result.succeeded)} done, {len(result.skipped)} done before, {len(result.failed)} failed",
+              file=sys.stderr)
+    return 1 if len(result.failed) > 0 else 0
+
+
+def main(argv: Optional[list[str]] = None, import_time: float = 0.0) -> int:
+    """Run a command, import_time is the time the entry point took to import the finder for the timing report"""
+    args = parse_args(argv)
+    if args.command == 'scan':
+        return scan(args, import_time)
+    if args.command == 'delete':
+        return delete(args)
+    return 2
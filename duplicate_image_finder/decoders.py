@@ -0,0 +1,258 @@
+import io
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+import numpy as np
+from PIL import Image as PILImage
+
+# Bytes read from the start of a file to detect its format
+HEADER_SIZE = 32
+
+# Opens an image for decoding: (path, open file, draft size, draft mode) -> image with the ratio of full resolution
+# pixels to the pixels of the returned image. The image is loaded while the file is still open.
+Opener = Callable[[Path, BinaryIO, Optional[tuple[int, int]], Optional[str]], tuple[PILImage.Image, float]]
+
+# Opens the embedded thumbnail of an image like an opener or returns None if it has none
+ThumbnailOpener = Callable[[Path, BinaryIO, Optional[str]], Optional[tuple[PILImage.Image, float]]]
+
+
+class UnsupportedFormatError(Exception):
+    """The format of a file is not known or cannot be decoded"""
+
+
+@dataclass
+class Decoder:
+    """Opens the images of one format, detected by magic bytes"""
+    name: str
+    # (offset, magic bytes) of which one has to match the start of a file
+    signatures: tuple[tuple[int, bytes], ...]
+    open: Opener
+    # Formats which cannot be decoded are detected to report a clear error
+    supported: bool = field(default=True)
+    # Opens the small preview which cameras embed in their files, if the format has one
+    thumbnail: Optional[ThumbnailOpener] = field(default=None)
+
+    def matches(self, header: bytes) -> bool:
+        return any(header[offset:offset + len(magic)] == magic for offset, magic in self.signatures)
+
+
+_decoders: list[Decoder] = []
+
+
+def register_decoder(decoder: Decoder) -> None:
+    """Add a decoder, it takes precedence over decoders registered before"""
+    _decoders.insert(0, decoder)
+
+
+def find_decoder(header: bytes) -> Optional[Decoder]:
+    """Get the decoder of a file by the first HEADER_SIZE bytes of it"""
+    return next((decoder for decoder in _decoders if decoder.matches(header)), None)
+
+
+def open_image(path: Path, decode_size: Optional[int] = None, mode: Optional[str] = None,
+               thumbnail: bool = False) -> tuple[PILImage.Image, float]:
+    """Open an image by the decoder of its format and get it with the ratio of full resolution pixels to its pixels
+
+    With decode_size, formats which support it are decoded at a reduced scale as long as both sides stay at least
+    decode_size pixels. mode is a hint for the color mode to decode to, the image still has to be converted. With
+    thumbnail, the embedded thumbnail of the image is opened instead if it has one, which only reads a few KB.
+    """
+    size = (decode_size, decode_size) if decode_size is not None else None
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+        file.seek(0)
+        decoder = find_decoder(header)
+        if decoder is not None and not decoder.supported:
+            raise UnsupportedFormatError(f"{decoder.name} images are not supported")
+        if thumbnail and decoder is not None and decoder.thumbnail is not None:
+            try:
+                opened = decoder.thumbnail(path, file, mode)
+                if opened is not None:
+                    opened[0].load()
+                    return opened
+            except Exception:
+                # Broken thumbnails are ignored, the image itself may still be fine
+                pass
+            file.seek(0)
+        # Unknown signatures are left to Pillow, which detects formats by content as well
+        (image, scale) = (decoder.open if decoder is not None else _open_pillow)(path, file, size, mode)
+        # Decode while the file is open
+        image.load()
+        return (image, scale)
+
+
+def rgb_pixels(image: PILImage.Image) -> np.ndarray:
+    """Get the pixels of an image in any color mode as (height, width, 3) uint8 RGB"""
+    if image.mode in ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I'):
+        # 16 bit grayscale is reduced to its high byte instead of being clipped at 255
+        values = np.asarray(image).astype(np.uint32)
+        gray = (values >> 8 if values.max(initial=0) > 255 else values).astype(np.uint8)
+        return np.repeat(gray[:, :, np.newaxis], 3, axis=2)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+
+def _open_pillow(path: Path, file: BinaryIO, size: Optional[tuple[int, int]],
+                 mode: Optional[str]) -> tuple[PILImage.Image, float]:
+    image = PILImage.open(file)
+    if size is not None and image.format == 'JPEG':
+        full_size = image.size
+        image.draft(mode, size)
+        return (image, (full_size[0] * full_size[1]) / (image.size[0] * image.size[1]))
+    return (image, 1.0)
+
+
+def tiff_previews(file: BinaryIO) -> list[tuple[int, int]]:
+    """Find embedded JPEG previews of a TIFF based file, e.g. of a RAW image, as (offset, length) largest first
+
+    Previews are referenced by the JPEGInterchangeFormat tags or are JPEG compressed single strip images in the IFD
+    chain and its SubIFDs. Raw sensor data is skipped.
+    """
+    file.seek(0)
+    header = file.read(8)
+    if len(header) < 8:
+        return []
+    order = '<' if header[:2] == b'II' else '>'
+    (first,) = struct.unpack(order + 'I', header[4:8])
+    previews = []
+    pending = [first]
+    visited = set()
+    while len(pending) > 0 and len(visited) < 64:
+        offset = pending.pop()
+        if offset == 0 or offset in visited:
+            continue
+        visited.add(offset)
+        file.seek(offset)
+        data = file.read(2)
+        if len(data) < 2:
+            continue
+        (count,) = struct.unpack(order + 'H', data)
+        entries = file.read(12 * count + 4)
+        if len(entries) < 12 * count + 4:
+            continue
+        tags: dict[int, list[int]] = {}
+        for k in range(count):
+            tag, kind, values, value = struct.unpack(order + 'HHII', entries[12 * k:12 * k + 12])
+            if tag == 0x014a and 1 < values <= 64:
+                # Offsets of several SubIFDs are stored elsewhere
+                position = file.tell()
+                file.seek(value)
+                tags[tag] = list(struct.unpack(order + 'I' * values, file.read(4 * values)))
+                file.seek(position)
+            elif kind == 3 and values == 1:
+                # SHORT values are stored in the first bytes of the value field
+                tags[tag] = [struct.unpack(order + 'H', entries[12 * k + 8:12 * k + 10])[0]]
+            else:
+                tags[tag] = [value]
+        pending.extend(tags.get(0x014a, []))
+        (next_ifd,) = struct.unpack(order + 'I', entries[12 * count:])
+        pending.append(next_ifd)
+        if 0x0201 in tags and 0x0202 in tags:
+            previews.append((tags[0x0201][0], tags[0x0202][0]))
+        elif tags.get(0x0103, [0])[0] in (6, 7) and tags.get(0x0106, [0])[0] not in (32803, 34892) \
+                and 0x0111 in tags and 0x0117 in tags:
+            # JPEG compressed image which is not color filter array or linear raw data
+            previews.append((tags[0x0111][0], tags[0x0117][0]))
+    return sorted(previews, key=lambda preview: -preview[1])
+
+
+def _open_embedded_jpeg(file: BinaryIO, offset: int, length: int, size: Optional[tuple[int, int]],
+                        mode: Optional[str]) -> tuple[PILImage.Image, float]:
+    file.seek(offset)
+    data = file.read(length)
+    image = PILImage.open(io.BytesIO(data))
+    if image.format != 'JPEG':
+        raise UnsupportedFormatError("embedded preview is not a JPEG image")
+    if size is not None:
+        image.draft(mode, size)
+    # Previews are counted at their own resolution, the size of the raw image is not known
+    return (image, 1.0)
+
+
+def _open_exif_thumbnail(path: Path, file: BinaryIO, mode: Optional[str]) -> Optional[tuple[PILImage.Image, float]]:
+    # Pillow only reads the markers up to the start of the frame, which include the APP1 segment with the EXIF data
+    image = PILImage.open(file)
+    exif = image.info.get('exif', b'')
+    if image.format != 'JPEG' or not exif.startswith(b'Exif\x00\x00'):
+        return None
+    # The thumbnail is referenced by IFD1, its offset is relative to the start of the TIFF structure
+    tiff = io.BytesIO(exif[6:])
+    try:
+        previews = tiff_previews(tiff)
+    except struct.error:
+        return None
+    if len(previews) == 0:
+        return None
+    (offset, length) = previews[-1]
+    thumbnail, _ = _open_embedded_jpeg(tiff, offset, length, None, mode)
+    thumbnail = crop_to_aspect(thumbnail, image.size)
+    return (thumbnail, (image.size[0] * image.size[1]) / (thumbnail.size[0] * thumbnail.size[1]))
+
+
+def crop_to_aspect(thumbnail: PILImage.Image, size: tuple[int, int]) -> PILImage.Image:
+    """Crop the black bars off a thumbnail which was letterboxed to a fixed size like 160x120"""
+    (width, height) = thumbnail.size
+    if width * size[1] > height * size[0]:
+        cropped = (round(height * size[0] / size[1]), height)
+    else:
+        cropped = (width, round(width * size[1] / size[0]))
+    if abs(cropped[0] - width) <= 1 and abs(cropped[1] - height) <= 1:
+        return thumbnail
+    left = (width - cropped[0]) // 2
+    top = (height - cropped[1]) // 2
+    thumbnail.load()
+    return thumbnail.crop((left, top, left + cropped[0], top + cropped[1]))
+
+
+def _open_tiff_thumbnail(path: Path, file: BinaryIO, mode: Optional[str]) -> Optional[tuple[PILImage.Image, float]]:
+    try:
+        previews = tiff_previews(file)
+    except struct.error:
+        return None
+    if len(previews) == 0:
+        return None
+    # The smallest preview, usually a 160x120 thumbnail in IFD1
+    (offset, length) = previews[-1]
+    return _open_embedded_jpeg(file, offset, length, None, mode)
+
+
+def _open_tiff(path: Path, file: BinaryIO, size: Optional[tuple[int, int]],
+               mode: Optional[str]) -> tuple[PILImage.Image, float]:
+    # Embedded previews are decoded much faster than the full image and are the only decodable part of RAW images
+    try:
+        previews = tiff_previews(file)
+    except struct.error:
+        previews = []
+    for offset, length in previews:
+        try:
+            image, scale = _open_embedded_jpeg(file, offset, length, size, mode)
+            image.load()
+            return (image, scale)
+        except Exception:
+            continue
+    file.seek(0)
+    return _open_pillow(path, file, size, mode)
+
+
+def _open_raf(path: Path, file: BinaryIO, size: Optional[tuple[int, int]],
+              mode: Optional[str]) -> tuple[PILImage.Image, float]:
+    # Fujifilm RAF files store the offset and length of their JPEG preview at fixed positions
+    file.seek(84)
+    offset, length = struct.unpack('>II', file.read(8))
+    return _open_embedded_jpeg(file, offset, length, size, mode)
+
+
+register_decoder(Decoder('BMP', ((0, b'BM'),), _open_pillow))
+register_decoder(Decoder('GIF', ((0, b'GIF87a'), (0, b'GIF89a')), _open_pillow))
+register_decoder(Decoder('WebP', ((8, b'WEBP'),), _open_pillow))
+register_decoder(Decoder('PNG', ((0, b'\x89PNG\r\n\x1a\n'),), _open_pillow))
+register_decoder(Decoder('JPEG', ((0, b'\xff\xd8\xff'),), _open_pillow, thumbnail=_open_exif_thumbnail))
+# Also Canon CR2, Nikon NEF, Sony ARW, Adobe DNG, Olympus ORF and Panasonic RW2 RAW images
+register_decoder(Decoder('TIFF', ((0, b'II*\x00'), (0, b'MM\x00*'), (0, b'IIRO'), (0, b'IIRS'), (0, b'IIU\x00')),
+                         _open_tiff, thumbnail=_open_tiff_thumbnail))
+register_decoder(Decoder('RAF', ((0, b'FUJIFILMCCD-RAW'),), _open_raf))
+register_decoder(Decoder('HEIF', ((4, b'ftypheic'), (4, b'ftypheix'), (4, b'ftypmif1'), (4, b'ftypavif')),
+                         _open_pillow, supported=False))
@@ -0,0 +1,339 @@
+import errno
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import sys
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from feature_cache import default_cache_path
+from metrics import ProgressTracker, Stage
+
+# Files one worker handles in a row before the next directory gets its turn
+DEFAULT_BATCH_SIZE = 64
+
+# Unlinks are mostly round trips on network shares, so more workers than cores help
+DEFAULT_WORKERS = 16
+
+# ioctl of Linux to share the extents of a file with another file on copy-on-write file systems
+FICLONE = 0x40049409
+
+
+class Action(Enum):
+    """What happens to the duplicates"""
+    # Remove the file
+    delete = 0
+    # Move the file into a quarantine directory, keeping its path below it
+    quarantine = 1
+    # Replace the file with a hard link to the kept file of its group, only for byte-identical files
+    hardlink = 2
+    # Replace the file with a copy-on-write clone of the kept file, only for byte-identical files
+    reflink = 3
+
+
+@dataclass
+class Operation:
+    path: Path
+    # Kept file of the group of path, needed for hard links and reflinks
+    source: Optional[Path] = None
+
+
+@dataclass
+class DeletionResult:
+    succeeded: list[Path] = field(default_factory=list)
+    failed: list[tuple[Path, Exception]] = field(default_factory=list)
+    # Done by an earlier, interrupted run according to the journal
+    skipped: list[Path] = field(default_factory=list)
+
+
+class JournalMismatch(ValueError):
+    """A journal of another run exists, it has to be finished or removed first"""
+
+    def __init__(self, path: Path, header: str) -> None:
+        super().__init__(f"journal {path} belongs to another run: {header}")
+        self.path = path
+
+
+def default_journal_path() -> Path:
+    """Location of the journal of the running deletion in the user's cache directory"""
+    return default_cache_path().parent / 'deletion.journal'
+
+
+class Journal:
+    """Append-only record of finished operations, so an interrupted run can resume where it stopped
+
+    The first line describes the run by its action and a digest of its operations, every further line is one
+    finished operation as JSON. Lines are flushed when written, a line torn by a crash is ignored.
+    """
+
+    def __init__(self, path: Path, action: Action, quarantine: Optional[Path] = None,
+                 operations: Iterable[Operation] = ()) -> None:
+        self.path = path
+        header = journal_header(action, quarantine, operations)
+        # Paths which were handled by an earlier run
+        self.done: set[str] = set()
+        if path.exists():
+            with open(path, encoding='utf-8') as file:
+                lines = file.read().splitlines()
+            if len(lines) > 0 and not _is_header(lines[0], header):
+                raise JournalMismatch(path, lines[0])
+            for line in lines[1:]:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('status') == 'done':
+                    self.done.add(entry['path'])
+            self._file = open(path, 'a', encoding='utf-8')
+            if len(lines) == 0:
+                self._write(header)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(path, 'w', encoding='utf-8')
+            self._write(header)
+
+    @staticmethod
+    def matches(path: Path, action: Action, quarantine: Optional[Path] = None,
+                operations: Iterable[Operation] = ()) -> bool:
+        """Check if a journal is missing or belongs to the run of these operations, so the run can resume from it"""
+        try:
+            with open(path, encoding='utf-8') as file:
+                first = file.readline().rstrip('\n')
+        except FileNotFoundError:
+            return True
+        return first == '' or _is_header(first, journal_header(action, quarantine, operations))
+
+    def record(self, path: Path, error: Optional[Exception] = None) -> None:
+        if error is None:
+            self._write({'path': str(path), 'status': 'done'})
+        else:
+            self._write({'path': str(path), 'status': 'failed', 'error': str(error)})
+
+    def _write(self, entry: dict) -> None:
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def close(self, remove: bool = False) -> None:
+        """Close the journal and remove it if the run is complete"""
+        self._file.close()
+        if remove:
+            self.path.unlink()
+
+
+def journal_header(action: Action, quarantine: Optional[Path], operations: Iterable[Operation]) -> dict:
+    """First line of the journal of a run, which identifies the run by a digest of its sorted operations"""
+    digest = hashlib.blake2b(digest_size=16)
+    for operation in sorted(f'{operation.path}\0{operation.source or ""}\n' for operation in operations):
+        digest.update(operation.encode('utf-8', 'surrogateescape'))
+    return {'action': action.name, 'quarantine': None if quarantine is None else str(quarantine),
+            'operations': digest.hexdigest()}
+
+
+def _is_header(line: str, header: dict) -> bool:
+    try:
+        return json.loads(line) == header
+    except json.JSONDecodeError:
+        return False
+
+
+class DeletionEngine:
+    """Deletes, quarantines or links duplicates in parallel
+
+    Operations are grouped by directory, so a worker handles the files of one directory in a row, and the directories
+    are spread over a bounded pool of threads. With a journal, finished operations are recorded and skipped when the
+    interrupted run of the same operations is started again.
+    """
+
+    def __init__(self, action: Action = Action.delete, workers: int = DEFAULT_WORKERS,
+                 quarantine: Optional[Path] = None, journal: Optional[Path] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        if action == Action.quarantine and quarantine is None:
+            raise ValueError("quarantine needs a quarantine directory")
+        self.action = action
+        self.workers = workers
+        self.quarantine = quarantine
+        self.journal = journal
+        self.batch_size = batch_size
+
+    def run(self, operations: Iterable[Operation], progress: Optional[ProgressTracker] = None,
+            is_cancelled: Optional[Callable[[], bool]] = None) -> DeletionResult:
+        """Apply the action to every operation and return what succeeded and what failed"""
+        operations = list(operations)
+        result = DeletionResult()
+        journal = Journal(self.journal, self.action, self.quarantine, operations) if self.journal is not None else None
+        if progress is not None:
+            progress.start(Stage.delete, f"{self.action.name.capitalize()} duplicate images...", len(operations))
+
+        pending = []
+        for operation in operations:
+            if journal is not None and str(operation.path) in journal.done:
+                result.skipped.append(operation.path)
+            else:
+                pending.append(operation)
+        if progress is not None and len(result.skipped) > 0:
+            progress.advance(len(result.skipped))
+
+        complete = False
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                batches = iter(self._batches(pending))
+                running: set[Future] = set()
+
+                def submit() -> bool:
+                    batch = next(batches, None)
+                    if batch is None:
+                        return False
+                    running.add(executor.submit(self._run_batch, batch, is_cancelled))
+                    return True
+
+                # Only a few batches are queued ahead, so cancelling stops quickly
+                while len(running) < 2 * self.workers and submit():
+                    pass
+                while len(running) > 0:
+                    (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.remove(future)
+                        for path, error in future.result():
+                            if journal is not None:
+                                journal.record(path, error)
+                            if error is None:
+                                result.succeeded.append(path)
+                            else:
+                                result.failed.append((path, error))
+                            if progress is not None:
+                                progress.advance()
+                        if is_cancelled is None or not is_cancelled():
+                            submit()
+            complete = len(result.succeeded) + len(result.failed) == len(pending)
+        finally:
+            if journal is not None:
+                # A complete journal is removed, failed files are reported in the result
+                journal.close(remove=complete)
+            if progress is not None:
+                progress.finish()
+        return result
+
+    def can_resume(self, operations: Iterable[Operation]) -> bool:
+        """Check if the journal is missing or belongs to a run of the same operations"""
+        return self.journal is None or Journal.matches(self.journal, self.action, self.quarantine, operations)
+
+    def _batches(self, operations: list[Operation]) -> Iterable[list[Operation]]:
+        by_directory: dict[Path, list[Operation]] = defaultdict(list)
+        for operation in operations:
+            by_directory[operation.path.parent].append(operation)
+        for directory in by_directory.values():
+            for start in range(0, len(directory), self.batch_size):
+                yield directory[start:start + self.batch_size]
+
+    def _run_batch(self, batch: list[Operation],
+                   is_cancelled: Optional[Callable[[], bool]]) -> list[tuple[Path, Optional[Exception]]]:
+        results: list[tuple[Path, Optional[Exception]]] = []
+        for operation in batch:
+            if is_cancelled is not None and is_cancelled():
+                break
+            try:
+                self.apply(operation)
+                results.append((operation.path, None))
+            except Exception as e:
+                results.append((operation.path, e))
+        return results
+
+    def apply(self, operation: Operation) -> None:
+        """Apply the action to one file"""
+        path = operation.path
+        if self.action == Action.delete:
+            os.remove(path)
+        elif self.action == Action.quarantine:
+            assert self.quarantine is not None
+            move_to_quarantine(path, self.quarantine)
+        else:
+            if operation.source is None:
+                raise ValueError(f"no kept file to link {path} to")
+            if self.action == Action.hardlink:
+                replace_with_hardlink(path, operation.source)
+            else:
+                replace_with_reflink(path, operation.source)
+
+
+def quarantine_path(path: Path, quarantine: Path) -> Path:
+    """Location of a file in the quarantine directory, which mirrors its absolute path"""
+    absolute = path.absolute()
+    parts = absolute.parts[1:] if absolute.anchor != '' else absolute.parts
+    drive = absolute.drive.replace(':', '').strip('\\/')
+    return quarantine.joinpath(*([drive] if drive != '' else []), *parts)
+
+
+def move_to_quarantine(path: Path, quarantine: Path) -> Path:
+    """Move a file into the quarantine directory, with a single rename if it is on the same file system"""
+    target = quarantine_path(path, quarantine)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        raise FileExistsError(errno.EEXIST, "already quarantined", str(target))
+    try:
+        os.rename(path, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Another file system, copy and remove
+        shutil.move(str(path), str(target))
+    return target
+
+
+def _check_identical(path: Path, source: Path) -> bool:
+    """Check that path can be replaced by a link to source and return whether it is one already"""
+    if os.path.samefile(path, source):
+        return True
+    if not filecmp.cmp(path, source, shallow=False):
+        raise ValueError(f"{path} is not identical to {source}")
+    return False
+
+
+def replace_with_hardlink(path: Path, source: Path) -> None:
+    """Replace a file with a hard link to a byte-identical file, atomically"""
+    if _check_identical(path, source):
+        return
+    temporary = path.with_name(f'.{path.name}.{os.getpid()}.link')
+    os.link(source, temporary)
+    try:
+        os.replace(temporary, path)
+    except BaseException:
+        temporary.unlink()
+        raise
+
+
+def replace_with_reflink(path: Path, source: Path) -> None:
+    """Replace a file with a copy-on-write clone of a byte-identical file, atomically
+
+    Needs a file system with reflinks like Btrfs or XFS on Linux.
+    """
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are only supported on Linux", str(path))
+    import fcntl
+    if _check_identical(path, source):
+        return
+    temporary = path.with_name(f'.{path.name}.{os.getpid()}.reflink')
+    try:
+        with open(source, 'rb') as source_file, open(temporary, 'wb') as file:
+            fcntl.ioctl(file.fileno(), FICLONE, source_file.fileno())
+        shutil.copystat(path, temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        if temporary.exists():
+            temporary.unlink()
+        raise
+
+
+def operations_from_groups(groups: Iterable[Iterable[tuple[Path, bool]]]) -> list[Operation]:
+    """Operations for the checked images of groups of (path, checked), linked to the first unchecked image"""
+    operations = []
+    for group in groups:
+        group = list(group)
+        source = next((path for path, checked in group if not checked), None)
+        operations.extend(Operation(path, source) for path, checked in group if checked)
+    return operations
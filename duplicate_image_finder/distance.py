@@ -0,0 +1,413 @@
+from enum import Enum
+from typing import Callable, Iterator
+
+import numpy as np
+from numba import jit, prange
+
+DEFAULT_BLOCK_SIZE = 512
+DEFAULT_PIVOTS = 8
+# Adjacent bins summed up by coarse histograms, 16 bins per channel for 256 bin histograms
+DEFAULT_COARSE_GROUP = 16
+
+# (share of work done, row indices, column indices, distances)
+PairBlock = tuple[float, np.ndarray, np.ndarray, np.ndarray]
+
+
+class Metric(Enum):
+    """Distance between feature vectors"""
+    # Sum of absolute differences, e.g. of histogram bins
+    l1 = 0
+    # Number of differing bits of packed uint64 words, e.g. of perceptual hashes
+    hamming = 1
+
+
+def distance(a: np.ndarray, b: np.ndarray, metric: Metric = Metric.l1) -> int:
+    """Distance between two feature vectors"""
+    if metric == Metric.hamming:
+        return int(sum(int(word).bit_count() for word in np.bitwise_xor(a, b).ravel()))
+    return int(np.sum(np.absolute(a.astype(np.int64) - b.astype(np.int64))))
+
+
+def pair_distances(a: np.ndarray, b: np.ndarray, metric: Metric = Metric.l1) -> np.ndarray:
+    """Distances between the rows of two (n, ...) feature arrays as int64"""
+    a = a.reshape(len(a), -1)
+    b = b.reshape(len(b), -1)
+    if metric == Metric.hamming:
+        xor = np.ascontiguousarray(np.bitwise_xor(a, b))
+        return np.unpackbits(xor.view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+    return np.absolute(a.astype(np.int64) - b.astype(np.int64)).sum(axis=1)
+
+
+def iter_l1_pairs(matrix: np.ndarray, threshold: int, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+    """Find all row pairs of a feature matrix with an L1 distance below threshold"""
+    return iter_pairs(matrix, threshold, Metric.l1, block_size)
+
+
+def iter_l1_cross_pairs(a: np.ndarray, b: np.ndarray, threshold: int,
+                        block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+    """Find all pairs of a row of a and a row of b with an L1 distance below threshold"""
+    return iter_cross_pairs(a, b, threshold, Metric.l1, block_size)
+
+
+def iter_pairs(matrix: np.ndarray, threshold: int, metric: Metric = Metric.l1,
+               block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+    """Find all row pairs of a feature matrix with a distance below threshold
+
+    The matrix is compared in tiles of block_size x block_size, so memory only grows with the number of matches.
+    One result is yielded per block of rows.
+    """
+    tile_distances = _TILES[metric]
+    return _iter_tile_pairs(matrix.shape[0], matrix.shape[0], threshold,
+                            lambda rows, cols, out: tile_distances(matrix[rows], matrix[cols], out), True, block_size)
+
+
+def iter_cross_pairs(a: np.ndarray, b: np.ndarray, threshold: int, metric: Metric = Metric.l1,
+                     block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+    """Find all pairs of a row of a and a row of b with a distance below threshold"""
+    tile_distances = _TILES[metric]
+    return _iter_tile_pairs(a.shape[0], b.shape[0], threshold,
+                            lambda rows, cols, out: tile_distances(a[rows], b[cols], out), False, block_size)
+
+
+def coarse_histograms(matrix: np.ndarray, group_size: int = DEFAULT_COARSE_GROUP) -> np.ndarray:
+    """Sum groups of group_size adjacent bins, e.g. (n, 768) histograms to (n, 48) histograms of 16 bins per channel
+
+    By the triangle inequality, the L1 distance of coarse histograms is a lower bound of the full L1 distance.
+    """
+    n = matrix.shape[0]
+    return np.ascontiguousarray(matrix.reshape(n, matrix.shape[1] // group_size, group_size).sum(axis=2, dtype=np.int64))
+
+
+def iter_coarse_pairs(matrix: np.ndarray, threshold: int, group_size: int = DEFAULT_COARSE_GROUP,
+                      block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+    """Find all row pairs of a histogram matrix with an L1 distance below threshold
+
+    Pairs are rejected by the distance of their coarse histograms first and only the remaining pairs are compared
+    at full resolution, until their distance reaches the threshold. The result equals iter_l1_pairs.
+    """
+    coarse = coarse_histograms(matrix, group_size)
+    return _iter_tile_pairs(
+        matrix.shape[0], matrix.shape[0], threshold,
+        lambda rows, cols, out: coarse_l1_tile(matrix[rows], matrix[cols], coarse[rows], coarse[cols], threshold, out),
+        True, block_size)
+
+
+def iter_coarse_cross_pairs(a: np.ndarray, b: np.ndarray, threshold: int, group_size: int = DEFAULT_COARSE_GROUP,
+                            block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+    """Find all pairs of a row of a and a row of b with an L1 distance below threshold like iter_coarse_pairs"""
+    coarse_a = coarse_histograms(a, group_size)
+    coarse_b = coarse_histograms(b, group_size)
+    return _iter_tile_pairs(
+        a.shape[0], b.shape[0], threshold,
+        lambda rows, cols, out: coarse_l1_tile(a[rows], b[cols], coarse_a[rows], coarse_b[cols], threshold, out),
+        False, block_size)
+
+
+def _iter_tile_pairs(n: int, m: int, threshold: int, tile_distances: Callable[[slice, slice, np.ndarray], None],
+                     triangle: bool, block_size: int) -> Iterator[PairBlock]:
+    # Compares rows 0..n-1 with columns 0..m-1, or only the upper triangle of the rows with themselves
+    tile = np.empty((block_size, block_size), dtype=np.int64)
+    for row in range(0, n, block_size):
+        rows = slice(row, min(row + block_size, n))
+        rows_i, rows_j, rows_diff = [], [], []
+        for col in range(row if triangle else 0, m, block_size):
+            cols = slice(col, min(col + block_size, m))
+            out = tile[:rows.stop - rows.start, :cols.stop - cols.start]
+            tile_distances(rows, cols, out)
+            i, j = np.nonzero(out < threshold)
+            if triangle and col == row:
+                # Only keep the upper triangle of diagonal tiles
+                upper = i < j
+                i, j = i[upper], j[upper]
+            rows_i.append(i + row)
+            rows_j.append(j + col)
+            rows_diff.append(out[i, j])
+        if len(rows_i) == 0:
+            continue
+        progress = pairs_progress(rows.stop, n) if triangle else rows.stop / n
+        yield (progress, np.concatenate(rows_i), np.concatenate(rows_j), np.concatenate(rows_diff))
+
+
+def l1_pairs(matrix: np.ndarray, threshold: int,
+             block_size: int = DEFAULT_BLOCK_SIZE) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find all row pairs of a feature matrix with an L1 distance below threshold"""
+    return collect_pairs(iter_l1_pairs(matrix, threshold, block_size))
+
+
+def collect_pairs(blocks: Iterator[PairBlock]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Concatenate the pair blocks of a pair search"""
+    blocks = list(blocks)
+    if len(blocks) == 0:
+        empty = np.empty((0,), dtype=np.intp)
+        return (empty, empty, np.empty((0,), dtype=np.int64))
+    return (np.concatenate([block[1] for block in blocks]),
+            np.concatenate([block[2] for block in blocks]),
+            np.concatenate([block[3] for block in blocks]))
+
+
+def pairs_progress(rows_done: int, total: int) -> float:
+    """Share of pair comparisons done after rows_done rows of the upper triangle"""
+    if total == 0:
+        return 1.0
+    return 1.0 - ((total - rows_done) / total) ** 2
+
+
+class PivotIndex:
+    """Metric index over the rows of a feature matrix for the L1 distance
+
+    Every row stores its distances to a few pivot rows. By the triangle inequality |d(a, p) - d(b, p)| <= d(a, b),
+    so pairs whose pivot distances differ by threshold or more are skipped without computing the full distance.
+    Rows are sorted by their distance to the first pivot, so only a sliding window of rows has to be visited.
+    The bounds are exact: the index finds the same pairs as the exhaustive search.
+    """
+
+    def __init__(self, matrix: np.ndarray, pivots: int = DEFAULT_PIVOTS) -> None:
+        self._matrix = matrix
+        self._pivots = select_pivots(matrix, pivots)
+        self._pivot_distances = np.empty((matrix.shape[0], len(self._pivots)), dtype=np.int64)
+        for k, pivot in enumerate(self._pivots):
+            l1_to_row(matrix, matrix[pivot], self._pivot_distances[:, k])
+        self._order = np.argsort(self._pivot_distances[:, 0], kind='stable') if len(self._pivots) > 0 \
+            else np.arange(matrix.shape[0])
+
+    @property
+    def pivots(self) -> np.ndarray:
+        """Row indices used as pivots"""
+        return self._pivots
+
+    def iter_pairs(self, threshold: int, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[PairBlock]:
+        """Find all row pairs with an L1 distance below threshold"""
+        n = self._matrix.shape[0]
+        if n == 0:
+            return
+        matrix = self._matrix[self._order]
+        pivot_distances = np.ascontiguousarray(self._pivot_distances[self._order])
+        keys = pivot_distances[:, 0]
+        tile = np.empty((block_size, block_size), dtype=np.int64)
+        for row in range(0, n, block_size):
+            row_end = min(row + block_size, n)
+            # Rows beyond the window are too far away from the first pivot
+            window_end = int(np.searchsorted(keys, keys[row_end - 1] + threshold, side='left'))
+            rows_i, rows_j, rows_diff = [], [], []
+            for col in range(row, window_end, block_size):
+                col_end = min(col + block_size, window_end)
+                out = tile[:row_end - row, :col_end - col]
+                pivot_l1_tile(matrix[row:row_end], matrix[col:col_end],
+                              pivot_distances[row:row_end], pivot_distances[col:col_end], threshold, out)
+                i, j = np.nonzero(out < threshold)
+                if col == row:
+                    upper = i < j
+                    i, j = i[upper], j[upper]
+                rows_i.append(i + row)
+                rows_j.append(j + col)
+                rows_diff.append(out[i, j])
+            if len(rows_i) == 0:
+                continue
+            a = self._order[np.concatenate(rows_i)]
+            b = self._order[np.concatenate(rows_j)]
+            yield (row_end / n, np.minimum(a, b), np.maximum(a, b), np.concatenate(rows_diff))
+
+    def pairs(self, threshold: int,
+              block_size: int = DEFAULT_BLOCK_SIZE) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find all row pairs with an L1 distance below threshold"""
+        return collect_pairs(self.iter_pairs(threshold, block_size))
+
+
+class OnlineIndex:
+    """Growable index of feature rows for the L1 distance which can be queried while rows are still added
+
+    With pivots, the first distinct rows added become pivots and queries skip rows by the same triangle inequality
+    bound as PivotIndex. Without pivots every row is compared. Pivots are only used for the L1 metric, Hamming
+    distances of hashes are cheap enough to compare every row.
+    """
+
+    def __init__(self, width: int, pivots: int = 0, capacity: int = 1024, metric: Metric = Metric.l1) -> None:
+        self._size = 0
+        self._metric = metric
+        if metric == Metric.hamming:
+            pivots = 0
+        self._matrix = np.empty((capacity, width), dtype=np.uint64 if metric == Metric.hamming else np.int64)
+        self._pivot_count = pivots
+        self._pivots = np.empty((0, width), dtype=np.int64)
+        self._pivot_distances = np.empty((capacity, pivots), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vector: np.ndarray) -> int:
+        """Add a row and return its id"""
+        if self._size == self._matrix.shape[0]:
+            capacity = 2 * self._matrix.shape[0]
+            self._matrix = np.resize(self._matrix, (capacity, self._matrix.shape[1]))
+            self._pivot_distances = np.resize(self._pivot_distances, (capacity, self._pivot_count))
+        row = self._size
+        self._matrix[row] = vector
+        self._size += 1
+        if self._pivots.shape[0] < self._pivot_count and not (self._pivots == self._matrix[row]).all(axis=1).any():
+            # Rows added before this pivot need their distance to it
+            k = self._pivots.shape[0]
+            self._pivots = np.concatenate([self._pivots, self._matrix[row:row + 1]])
+            l1_to_row(self._matrix[:self._size], self._pivots[k], self._pivot_distances[:self._size, k])
+        if self._pivots.shape[0] > 0:
+            l1_to_row(self._pivots, self._matrix[row], self._pivot_distances[row, :self._pivots.shape[0]])
+        return row
+
+    def query(self, vector: np.ndarray, threshold: int) -> tuple[np.ndarray, np.ndarray]:
+        """Get ids and distances of all rows with a distance to vector below threshold"""
+        vector = vector.astype(self._matrix.dtype)
+        if self._pivots.shape[0] > 0:
+            query_distances = np.empty((self._pivots.shape[0],), dtype=np.int64)
+            l1_to_row(self._pivots, vector, query_distances)
+            bound = np.abs(self._pivot_distances[:self._size, :len(query_distances)] - query_distances).max(axis=1)
+            candidates = np.nonzero(bound < threshold)[0]
+        else:
+            candidates = np.arange(self._size)
+        diffs = np.empty((len(candidates),), dtype=np.int64)
+        if self._metric == Metric.hamming:
+            hamming_to_rows(self._matrix, candidates, vector, diffs)
+        else:
+            l1_to_rows(self._matrix, candidates, vector, threshold, diffs)
+        found = diffs < threshold
+        return (candidates[found], diffs[found])
+
+
+def compile_kernels(dtypes: tuple = (np.int64, np.uint32, np.uint16)) -> None:
+    """Compile all kernels for the array layouts and feature types used by the pair searches"""
+    for dtype in dtypes:
+        matrix = (np.arange(6 * 768, dtype=np.int64).reshape(6, 768) % 7).astype(dtype)
+        l1_pairs(matrix, 1, block_size=4)
+        collect_pairs(iter_l1_cross_pairs(matrix, matrix, 1, block_size=4))
+        collect_pairs(iter_coarse_pairs(matrix, 1, block_size=4))
+        collect_pairs(iter_coarse_cross_pairs(matrix, matrix, 1, block_size=4))
+        PivotIndex(matrix, pivots=2).pairs(1, block_size=4)
+    matrix = np.arange(6 * 768, dtype=np.int64).reshape(6, 768) % 7
+    index = OnlineIndex(matrix.shape[1], pivots=2, capacity=4)
+    for vector in matrix:
+        index.query(vector, 1)
+        index.add(vector)
+    hashes = np.arange(6, dtype=np.uint64).reshape(6, 1)
+    collect_pairs(iter_pairs(hashes, 1, Metric.hamming, block_size=4))
+    collect_pairs(iter_cross_pairs(hashes, hashes, 1, Metric.hamming, block_size=4))
+    index = OnlineIndex(hashes.shape[1], capacity=4, metric=Metric.hamming)
+    for vector in hashes:
+        index.query(vector, 1)
+        index.add(vector)
+
+
+def select_pivots(matrix: np.ndarray, count: int) -> np.ndarray:
+    """Select rows far away from each other as pivots (farthest-first traversal)"""
+    n = matrix.shape[0]
+    count = min(count, n)
+    if count == 0:
+        return np.empty((0,), dtype=np.intp)
+    distances = np.empty((n,), dtype=np.int64)
+    l1_to_row(matrix, matrix[0], distances)
+    pivots = [int(np.argmax(distances))]
+    nearest = np.full((n,), np.iinfo(np.int64).max, dtype=np.int64)
+    while len(pivots) < count:
+        l1_to_row(matrix, matrix[pivots[-1]], distances)
+        np.minimum(nearest, distances, out=nearest)
+        candidate = int(np.argmax(nearest))
+        if nearest[candidate] == 0:
+            break
+        pivots.append(candidate)
+    return np.array(pivots, dtype=np.intp)
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def l1_to_row(matrix, vector, out):
+    for i in prange(matrix.shape[0]):
+        diff = 0
+        for k in range(matrix.shape[1]):
+            diff += abs(np.int64(matrix[i, k]) - np.int64(vector[k]))
+        out[i] = diff
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def l1_to_rows(matrix, rows, vector, threshold, out):
+    for i in prange(rows.shape[0]):
+        diff = 0
+        for k in range(matrix.shape[1]):
+            diff += abs(np.int64(matrix[rows[i], k]) - np.int64(vector[k]))
+            if diff >= threshold:
+                break
+        out[i] = diff
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def pivot_l1_tile(a, b, pivots_a, pivots_b, threshold, out):
+    for i in prange(a.shape[0]):
+        for j in range(b.shape[0]):
+            # Lower bound of the distance from the pivot distances
+            bound = 0
+            for p in range(pivots_a.shape[1]):
+                bound = max(bound, abs(pivots_a[i, p] - pivots_b[j, p]))
+            if bound >= threshold:
+                out[i, j] = threshold
+                continue
+            diff = 0
+            for k in range(a.shape[1]):
+                diff += abs(np.int64(a[i, k]) - np.int64(b[j, k]))
+                if diff >= threshold:
+                    break
+            out[i, j] = diff
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def coarse_l1_tile(a, b, coarse_a, coarse_b, threshold, out):
+    for i in prange(a.shape[0]):
+        for j in range(b.shape[0]):
+            # Lower bound of the distance from the coarse histograms
+            bound = 0
+            for k in range(coarse_a.shape[1]):
+                bound += abs(coarse_a[i, k] - coarse_b[j, k])
+            if bound >= threshold:
+                out[i, j] = bound
+                continue
+            diff = 0
+            for k in range(a.shape[1]):
+                diff += abs(np.int64(a[i, k]) - np.int64(b[j, k]))
+                if diff >= threshold:
+                    break
+            out[i, j] = diff
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def l1_tile(a, b, out):
+    for i in prange(a.shape[0]):
+        for j in range(b.shape[0]):
+            diff = 0
+            for k in range(a.shape[1]):
+                diff += abs(np.int64(a[i, k]) - np.int64(b[j, k]))
+            out[i, j] = diff
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def popcount(x):
+    """Number of set bits of a uint64"""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return np.int64((x * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def hamming_to_rows(matrix, rows, vector, out):
+    for i in prange(rows.shape[0]):
+        diff = 0
+        for k in range(matrix.shape[1]):
+            diff += popcount(matrix[rows[i], k] ^ vector[k])
+        out[i] = diff
+
+
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def hamming_tile(a, b, out):
+    for i in prange(a.shape[0]):
+        for j in range(b.shape[0]):
+            diff = 0
+            for k in range(a.shape[1]):
+                diff += popcount(a[i, k] ^ b[j, k])
+            out[i, j] = diff
+
+
+_TILES = {Metric.l1: l1_tile, Metric.hamming: hamming_tile}
@@ -0,0 +1,69 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Hashable, Optional, Sequence
+
+from feature_cache import file_digest
+
+# Bytes hashed at the start and at the end of a file before its full content is hashed
+DEFAULT_EDGE_SIZE = 4096
+
+
+def edge_digest(path: Path, size: int, edge_size: int = DEFAULT_EDGE_SIZE) -> bytes:
+    """BLAKE2b hash of the first and last edge_size bytes of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        digest.update(file.read(edge_size))
+        if size > edge_size:
+            file.seek(max(size - edge_size, edge_size))
+            digest.update(file.read(edge_size))
+    return digest.digest()
+
+
+def exact_duplicates(paths: Sequence[Path], sizes: Sequence[int], candidates: Optional[Sequence[bool]] = None,
+                     workers: Optional[int] = None, edge_size: int = DEFAULT_EDGE_SIZE) -> list[list[int]]:
+    """Find sets of byte-identical files and return the indices of their paths
+
+    Files are bucketed by size first, so only files sharing their size with another file are read. Within a bucket
+    only the first and last edge_size bytes are hashed, and only files which still collide are hashed completely.
+    With candidates, buckets without any candidate are skipped. Sets are ordered by their first index and indices
+    are ascending within a set. Files which cannot be read are left out.
+    """
+    by_size: dict[int, list[int]] = defaultdict(list)
+    for i, size in enumerate(sizes):
+        # Empty files are not images and stat errors are reported by the histogram stage
+        if size > 0:
+            by_size[size].append(i)
+    buckets = [bucket for bucket in by_size.values()
+               if len(bucket) > 1 and (candidates is None or any(candidates[i] for i in bucket))]
+
+    with ThreadPoolExecutor(max_workers=workers if workers is not None else min(32, (os.cpu_count() or 1) + 4)) \
+            as executor:
+
+        def split(buckets: list[list[int]], key: Callable[[int], Hashable]) -> list[list[int]]:
+            indices = [i for bucket in buckets for i in bucket]
+            keys = dict(zip(indices, executor.map(lambda i: _try(key, i), indices)))
+            result = []
+            for bucket in buckets:
+                by_key: dict[Hashable, list[int]] = defaultdict(list)
+                for i in bucket:
+                    if keys[i] is not None:
+                        by_key[keys[i]].append(i)
+                result.extend(same for same in by_key.values() if len(same) > 1)
+            return result
+
+        buckets = split(buckets, lambda i: edge_digest(paths[i], sizes[i], edge_size))
+        # Files up to two edges long were hashed completely already
+        small = [bucket for bucket in buckets if sizes[bucket[0]] <= 2 * edge_size]
+        large = [bucket for bucket in buckets if sizes[bucket[0]] > 2 * edge_size]
+        buckets = small + split(large, lambda i: file_digest(paths[i]))
+    return sorted(buckets, key=lambda bucket: bucket[0])
+
+
+def _try(key: Callable[[int], Hashable], i: int) -> Optional[Hashable]:
+    try:
+        return key(i)
+    except OSError:
+        return None
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 16
+
+# (row of the path, features or None, error or None)
+Extracted = tuple[int, Optional[np.ndarray], Optional[Exception]]
+
+# Shared state of a worker process, set by _init_worker
+_worker_memory: Optional[SharedMemory] = None
+_worker_array: Optional[np.ndarray] = None
+_worker_cancel = None
+
+
+def _init_worker(name: str, shape: tuple[int, ...], dtype: str, cancel) -> None:
+    global _worker_memory, _worker_array, _worker_cancel
+    _worker_memory = SharedMemory(name=name)
+    _worker_array = np.ndarray(shape, dtype=dtype, buffer=_worker_memory.buf)
+    _worker_cancel = cancel
+
+
+def _extract_chunk(extract: Callable[[Path], np.ndarray], rows: list[int],
+                   paths: list[Path]) -> list[tuple[int, Optional[Exception]]]:
+    assert _worker_array is not None
+    results: list[tuple[int, Optional[Exception]]] = []
+    for row, path in zip(rows, paths):
+        if _worker_cancel is not None and _worker_cancel.is_set():
+            break
+        try:
+            _worker_array[row] = extract(path)
+            results.append((row, None))
+        except Exception as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(str(e))
+            results.append((row, e))
+    return results
+
+
+class ProcessExtractor:
+    """Extracts features of images in worker processes
+
+    Workers write the features straight into one shared memory array with a row per image, so only row numbers and
+    errors are sent back to the parent process instead of pickled features.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+
+    def run(self, paths: list[Path], extract: Callable[[Path], np.ndarray], shape: tuple[int, ...], dtype,
+            is_cancelled: Optional[Callable[[], bool]] = None) -> Iterator[Extracted]:
+        """Yield the features of every path in completion order
+
+        extract must be a module level function, so it can be sent to the worker processes.
+        """
+        if len(paths) == 0:
+            return
+        dtype = np.dtype(dtype)
+        full_shape = (len(paths),) + tuple(shape)
+        memory = SharedMemory(create=True, size=max(int(np.prod(full_shape)) * dtype.itemsize, 1))
+        array = np.ndarray(full_shape, dtype=dtype, buffer=memory.buf)
+        # Forking a process which already runs numba or decoder threads can deadlock the children
+        context = multiprocessing.get_context('spawn')
+        cancel = context.Event()
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                       initargs=(memory.name, full_shape, dtype.str, cancel))
+        try:
+            pending: set[Future] = set()
+            for start in range(0, len(paths), self.chunk_size):
+                rows = list(range(start, min(start + self.chunk_size, len(paths))))
+                pending.add(executor.submit(_extract_chunk, extract, rows, [paths[row] for row in rows]))
+            while len(pending) > 0:
+                if is_cancelled is not None and is_cancelled():
+                    return
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for row, error in future.result():
+                        if error is not None:
+                            yield (row, None, error)
+                        else:
+                            # Copy the row, the shared memory is released after the run
+                            yield (row, np.array(array[row]), None)
+        finally:
+            cancel.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            del array
+            memory.close()
+            memory.unlink()
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+# Identifies the layout of stored features. Rows of another kind are treated as stale.
+HISTOGRAM_KIND = 'rgb256-fixed'
+NORMALIZED_HISTOGRAM_KIND = 'rgb256-norm16'
+
+
+def default_cache_path() -> Path:
+    """Location of the feature cache in the user's cache directory"""
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'duplicate-image-finder' / 'features.sqlite'
+
+
+def file_digest(path: Path) -> bytes:
+    """BLAKE2b hash of the file content"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class FeatureCache:
+    """Persistent SQLite store of image features keyed by path, size and modification time
+
+    A row is only returned while size and mtime of the file are unchanged. With content_hash enabled, a file whose
+    mtime changed but whose content hash still matches is revalidated instead of being decoded again.
+    """
+
+    def __init__(self, path: Union[str, Path], kind: str = HISTOGRAM_KIND, content_hash: bool = False) -> None:
+        self._path = Path(path)
+        self._kind = kind
+        self._content_hash = content_hash
+        self._lock = threading.Lock()
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self._path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS features (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest BLOB,
+                kind TEXT NOT NULL,
+                dtype TEXT NOT NULL,
+                shape TEXT NOT NULL,
+                data BLOB NOT NULL
+            )''')
+        self._connection.commit()
+
+    @property
+    def path(self) -> Path:
+        """Location of the cache database"""
+        return self._path
+
+    def get(self, path: Path, kind: Optional[str] = None) -> Optional[np.ndarray]:
+        """Get cached features of a file or None if there are none or they are stale
+
+        kind overrides the kind of features given to the constructor.
+        """
+        key = str(path.absolute())
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT size, mtime_ns, digest, kind, dtype, shape, data FROM features WHERE path = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        (size, mtime_ns, digest, stored_kind, dtype, shape, data) = row
+        if stored_kind != (kind or self._kind) or size != stat.st_size:
+            self.invalidate(path)
+            return None
+        if mtime_ns != stat.st_mtime_ns:
+            if not self._content_hash or digest is None or digest != file_digest(path):
+                self.invalidate(path)
+                return None
+            with self._lock:
+                self._connection.execute('UPDATE features SET mtime_ns = ? WHERE path = ?', (stat.st_mtime_ns, key))
+        shape = tuple(int(dim) for dim in shape.split(',') if dim != '')
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def put(self, path: Path, features: np.ndarray, kind: Optional[str] = None) -> None:
+        """Store the features of a file"""
+        stat = path.stat()
+        digest = file_digest(path) if self._content_hash else None
+        features = np.ascontiguousarray(features)
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO features (path, size, mtime_ns, digest, kind, dtype, shape, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(path.absolute()), stat.st_size, stat.st_mtime_ns, digest, kind or self._kind, features.dtype.str,
+                 ','.join(str(dim) for dim in features.shape), features.tobytes()))
+
+    def invalidate(self, path: Path) -> None:
+        """Remove the cached features of a file"""
+        with self._lock:
+            self._connection.execute('DELETE FROM features WHERE path = ?', (str(path.absolute()),))
+
+    def prune(self, root: Optional[Path] = None, keep: Optional[Iterable[Path]] = None) -> int:
+        """Remove rows of deleted files and return their count
+
+        Without keep, every row (below root) is checked for its file to exist. With keep, rows below root whose path
+        is not in keep are removed without touching the file system.
+        """
+        prefix = None if root is None else str(root.absolute()).rstrip(os.sep) + os.sep
+        keep_keys = None if keep is None else {str(path.absolute()) for path in keep}
+        with self._lock:
+            keys = [key for (key,) in self._connection.execute('SELECT path FROM features')]
+        removed = []
+        for key in keys:
+            if prefix is not None and not key.startswith(prefix):
+                continue
+            if keep_keys is not None:
+                if key not in keep_keys:
+                    removed.append(key)
+            elif not os.path.exists(key):
+                removed.append(key)
+        with self._lock:
+            self._connection.executemany('DELETE FROM features WHERE path = ?', [(key,) for key in removed])
+            self._connection.commit()
+        return len(removed)
+
+    def commit(self) -> None:
+        """Write pending changes to disk"""
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        """Write pending changes and close the database"""
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM features').fetchone()[0]
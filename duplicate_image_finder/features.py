@@ -0,0 +1,257 @@
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from numba import jit
+from PIL import Image as PILImage
+
+from decoders import open_image, rgb_pixels
+from distance import Metric
+from feature_cache import HISTOGRAM_KIND, NORMALIZED_HISTOGRAM_KIND
+from image_store import HISTOGRAM_SHAPE, Color
+
+# Features of a perceptual hash: one packed 64 bit word
+HASH_SHAPE = (1,)
+
+# Sum of the bins of each channel of a normalized histogram
+NORMALIZED_TOTAL = np.iinfo(np.uint16).max
+
+# Appended to the kind of features computed from embedded thumbnails
+THUMBNAIL_SUFFIX = '+thumb'
+
+
+class FeatureExtractor:
+    """Computes the features images are compared by
+
+    Features of an image are an array of a fixed shape and type and are compared by the metric of the extractor.
+    Extractors are sent to worker processes, so they must be picklable.
+    """
+    # Identifies the features in the feature cache and scan states
+    kind: str
+    shape: tuple[int, ...]
+    dtype: np.dtype
+    metric: Metric
+    # Largest possible distance of two images. If set, thresholds are fractions of it in [0, 1], otherwise distances.
+    max_distance: Optional[int] = None
+    # Threshold of similar images if none is given to the scan
+    default_threshold: float
+    # Features are computed from embedded thumbnails, so similar images have to be verified by the verifier
+    thumbnails: bool = False
+
+    def extract(self, path: Path) -> np.ndarray:
+        """Decode an image and get its features"""
+        raise NotImplementedError
+
+    def distance_threshold(self, threshold: float) -> int:
+        """Convert the threshold of a scan to the distance below which images are similar"""
+        if self.max_distance is None:
+            return int(threshold)
+        if not 0 <= threshold <= 1:
+            raise ValueError(f"threshold must be a fraction in [0, 1], got {threshold}")
+        return int(np.ceil(threshold * self.max_distance))
+
+    def verifier(self) -> Optional['FeatureExtractor']:
+        """Extractor of higher resolution features to verify similar images with, if features are approximate"""
+        return None
+
+
+class HistogramExtractor(FeatureExtractor):
+    """Color histograms of the red, green and blue channels compared by the L1 distance of their pixel counts
+
+    Distances grow with the image size, so thresholds are absolute and images of different sizes do not match.
+    """
+    shape = HISTOGRAM_SHAPE
+    dtype = np.dtype(np.uint32)
+    metric = Metric.l1
+    default_threshold = 10_000_000
+
+    def __init__(self, decode_size: Optional[int] = None, thumbnails: bool = False) -> None:
+        # Decode JPEG images at a reduced scale with sides of at least this size
+        self.decode_size = decode_size
+        self.thumbnails = thumbnails
+
+    @property
+    def kind(self) -> str:
+        kind = HISTOGRAM_KIND if self.decode_size is None else f'{HISTOGRAM_KIND}@{self.decode_size}'
+        return kind + THUMBNAIL_SUFFIX if self.thumbnails else kind
+
+    def extract(self, path: Path) -> np.ndarray:
+        return read_histogram(path, self.decode_size, self.thumbnails)
+
+    def verifier(self) -> Optional[FeatureExtractor]:
+        return HistogramExtractor(self.decode_size) if self.thumbnails else None
+
+
+class NormalizedHistogramExtractor(FeatureExtractor):
+    """Color histograms whose channels are scaled to a fixed total and stored as uint16
+
+    Distances do not depend on the image size, so thresholds are fractions: 0 for equal histograms and 1 for
+    histograms without common colors.
+    """
+    shape = HISTOGRAM_SHAPE
+    dtype = np.dtype(np.uint16)
+    metric = Metric.l1
+    max_distance = 2 * len(Color) * NORMALIZED_TOTAL
+    default_threshold = 0.05
+
+    def __init__(self, decode_size: Optional[int] = None, thumbnails: bool = False) -> None:
+        # Decode JPEG images at a reduced scale with sides of at least this size
+        self.decode_size = decode_size
+        self.thumbnails = thumbnails
+
+    @property
+    def kind(self) -> str:
+        kind = NORMALIZED_HISTOGRAM_KIND if self.decode_size is None \
+            else f'{NORMALIZED_HISTOGRAM_KIND}@{self.decode_size}'
+        return kind + THUMBNAIL_SUFFIX if self.thumbnails else kind
+
+    def extract(self, path: Path) -> np.ndarray:
+        return normalize_histogram(read_histogram(path, self.decode_size, self.thumbnails))
+
+    def verifier(self) -> Optional[FeatureExtractor]:
+        return NormalizedHistogramExtractor(self.decode_size) if self.thumbnails else None
+
+
+class HashAlgorithm(Enum):
+    """Perceptual hash of a downscaled grayscale image"""
+    # Pixels brighter than the mean of an 8x8 image
+    ahash = 0
+    # Pixels brighter than their left neighbour in a 9x8 image
+    dhash = 1
+    # Low frequency DCT coefficients of a 32x32 image above their median
+    phash = 2
+
+
+class HashExtractor(FeatureExtractor):
+    """64 bit perceptual hashes compared by the Hamming distance
+
+    Unlike histograms, hashes keep the spatial layout of an image and distances do not depend on the image size.
+    """
+    shape = HASH_SHAPE
+    dtype = np.dtype(np.uint64)
+    metric = Metric.hamming
+    max_distance = 64
+    default_threshold = 0.15
+
+    def __init__(self, algorithm: HashAlgorithm = HashAlgorithm.dhash, thumbnails: bool = False) -> None:
+        self.algorithm = algorithm
+        self.thumbnails = thumbnails
+
+    @property
+    def kind(self) -> str:
+        return f'{self.algorithm.name}64' + (THUMBNAIL_SUFFIX if self.thumbnails else '')
+
+    def extract(self, path: Path) -> np.ndarray:
+        return image_hash(path, self.algorithm, self.thumbnails).reshape(HASH_SHAPE)
+
+    def verifier(self) -> Optional[FeatureExtractor]:
+        return HashExtractor(self.algorithm) if self.thumbnails else None
+
+
+def read_histogram(path: Path, decode_size: Optional[int] = None, thumbnail: bool = False) -> np.ndarray:
+    """Decode an image and get the (3, 256) color histogram of its channels
+
+    With decode_size, JPEG images are decoded at a reduced scale of 1/2, 1/4 or 1/8 in the DCT domain, as long as
+    both sides stay at least decode_size pixels. Counts are scaled to the full resolution, so thresholds still apply.
+    Palette and grayscale images are counted without converting them to RGB first. With thumbnail, the embedded
+    thumbnail is counted instead if the image has one.
+    """
+    image, scale = open_image(path, decode_size, thumbnail=thumbnail)
+    with image:
+        if image.mode == 'P':
+            histogram = palette_histogram(image)
+        elif image.mode == 'L':
+            counts = np.bincount(np.asarray(image).ravel(), minlength=256).astype(np.intp)
+            histogram = np.repeat(counts[np.newaxis, :], len(Color), axis=0)
+        else:
+            histogram = rgb_histogram(np.ascontiguousarray(rgb_pixels(image)).reshape(-1, len(Color)))
+    if scale != 1:
+        histogram = np.rint(histogram * scale).astype(np.intp)
+    return histogram
+
+
+def normalize_histogram(histogram: np.ndarray) -> np.ndarray:
+    """Scale the bins of every channel of a histogram to sum up to NORMALIZED_TOTAL"""
+    totals = np.maximum(histogram.sum(axis=-1, keepdims=True), 1)
+    return np.rint(histogram * (NORMALIZED_TOTAL / totals)).astype(np.uint16)
+
+
+def palette_histogram(image: PILImage.Image) -> np.ndarray:
+    """(3, 256) color histogram of a palette image from the counts of its palette entries"""
+    counts = np.bincount(np.asarray(image).ravel(), minlength=256)
+    palette = np.frombuffer(image.palette.tobytes(), dtype=np.uint8)
+    if image.palette.mode != 'RGB' or len(palette) < 3:
+        return rgb_histogram(np.ascontiguousarray(rgb_pixels(image)).reshape(-1, len(Color)))
+    palette = palette[:len(palette) // 3 * 3].reshape(-1, 3)
+    # Pixels may refer to entries beyond a short palette, Pillow shows them as black
+    colors = np.zeros((len(counts), 3), dtype=np.intp)
+    colors[:min(len(palette), len(counts))] = palette[:len(counts)]
+    return np.stack([np.bincount(colors[:, c], weights=counts, minlength=256) for c in range(len(Color))]) \
+        .astype(np.intp)
+
+
+def read_image(path: Path, decode_size: Optional[int] = None) -> tuple[np.ndarray, float]:
+    """Decode an image and get its RGB pixels and the ratio of full resolution pixels to decoded pixels"""
+    image, scale = open_image(path, decode_size)
+    with image:
+        return (rgb_pixels(image), scale)
+
+
+def read_thumbnail(path: Path, size: tuple[int, int], embedded: bool = False) -> np.ndarray:
+    """Decode an image as a (height, width) float grayscale thumbnail of the given (width, height)
+
+    JPEG images are decoded at the smallest DCT scale which is still larger than the thumbnail. With embedded, the
+    thumbnail embedded in the image is resized instead if it has one.
+    """
+    image, _ = open_image(path, 2 * max(size), mode='L', thumbnail=embedded)
+    with image:
+        if image.mode != 'L':
+            image = PILImage.fromarray(rgb_pixels(image)).convert('L')
+        return np.asarray(image.resize(size, PILImage.Resampling.LANCZOS), dtype=np.float32)
+
+
+def image_hash(path: Path, algorithm: HashAlgorithm = HashAlgorithm.dhash, embedded: bool = False) -> np.ndarray:
+    """Perceptual hash of an image as uint64"""
+    if algorithm == HashAlgorithm.ahash:
+        return average_hash(read_thumbnail(path, (8, 8), embedded))
+    if algorithm == HashAlgorithm.dhash:
+        return difference_hash(read_thumbnail(path, (9, 8), embedded))
+    return dct_hash(read_thumbnail(path, (32, 32), embedded))
+
+
+def average_hash(pixels: np.ndarray) -> np.ndarray:
+    """Hashes of (..., 8, 8) grayscale thumbnails"""
+    return pack_bits(pixels > pixels.mean(axis=(-2, -1), keepdims=True))
+
+
+def difference_hash(pixels: np.ndarray) -> np.ndarray:
+    """Hashes of (..., 8, 9) grayscale thumbnails"""
+    return pack_bits(pixels[..., 1:] > pixels[..., :-1])
+
+
+def dct_hash(pixels: np.ndarray) -> np.ndarray:
+    """Hashes of (..., 32, 32) grayscale thumbnails"""
+    size = pixels.shape[-1]
+    k = np.arange(size)
+    # Unscaled DCT-II basis, the scale does not change the comparison with the median
+    basis = np.cos(np.pi * (2 * k[np.newaxis, :] + 1) * k[:, np.newaxis] / (2 * size))
+    low = (basis @ pixels @ basis.T)[..., :8, :8]
+    return pack_bits(low > np.median(low, axis=(-2, -1), keepdims=True))
+
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Pack (..., 8, 8) bools into (...) uint64 words"""
+    packed = np.packbits(bits.reshape(bits.shape[:-2] + (64,)), axis=-1)
+    return np.ascontiguousarray(packed).view('>u8')[..., 0].astype(np.uint64)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def rgb_histogram(pixels):
+    """Count the values of the red, green and blue channels of (n, channels) uint8 pixels in fixed 0-255 bins"""
+    histogram = np.zeros((3, 256), dtype=np.intp)
+    for i in range(pixels.shape[0]):
+        histogram[0, pixels[i, 0]] += 1
+        histogram[1, pixels[i, 1]] += 1
+        histogram[2, pixels[i, 2]] += 1
+    return histogram
@@ -1,46 +1,38 @@
-import re
-from dataclasses import dataclass, field
+import threading
+import time
+from dataclasses import dataclass
 from enum import Enum
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from typing import Any, Callable, Literal, Optional
+from typing import Callable, Iterable, Iterator, Literal, Optional
 
-import imageio.v3 as iio
 import numpy as np
-from numba import jit
 
-ProgressHandler = Callable[[int, str], Any]
-
-
-class Color(Enum):
-    red = 0
-    green = 1
-    blue = 2
-
-
-Histogram = np.ndarray
-RgbHistogram = dict[Color, Histogram]
-
-
-@dataclass
-class ImageInfo:
-    path: Path
-    error: Optional[Exception] = field(default=None)
-    histogram: Optional[RgbHistogram] = field(default=None)
-    checked: bool = field(init=False, default=True)
-
-    def __sub__(self, other):
-        if not isinstance(other, ImageInfo):
-            return self - other
-        diff: int = 0
-        if self.histogram is None or other.histogram is None:
-            raise TypeError("histogram must be not None")
-        for color in self.histogram:
-            diff += np.sum(np.absolute(self.histogram[color] - other.histogram[color]))
-        return diff
-
-    def __hash__(self):
-        return hash(self.path)
+from distance import DEFAULT_PIVOTS, Metric, OnlineIndex, PivotIndex
+from distance import compile_kernels as compile_distance_kernels
+from distance import iter_coarse_cross_pairs, iter_coarse_pairs, iter_cross_pairs, iter_pairs, pair_distances
+from exact import exact_duplicates
+from extraction import ProcessExtractor
+from feature_cache import FeatureCache
+from features import FeatureExtractor, NormalizedHistogramExtractor, rgb_histogram
+from grouping import connected_groups, pair_groups
+from image_store import Color, ImageInfo, ImageStore
+from metrics import DEFAULT_INTERVAL, ProgressHandler, ProgressTracker, Stage
+from pipeline import DEFAULT_QUEUE_SIZE, Pipeline
+from scan_state import ScanState
+from scanner import Scanner
+
+_compile_lock = threading.Lock()
+_compiled = False
+
+
+class CompareMode(Enum):
+    """How images are compared with each other"""
+    # Compare every image with every other image
+    exact = 0
+    # Compare only candidates found by a pivot index over the histograms
+    indexed = 1
+    # Compare every image, but reject pairs by the distance of coarse 16 bin histograms first
+    coarse = 2
 
 
 @dataclass
@@ -52,14 +44,66 @@ class Pair:
 
 ImageInfoGroup = dict[ImageInfo, Literal[None]]
 
+# (path, index in the previous scan or None, size, modification time in nanoseconds)
+ScanItem = tuple[Path, Optional[int], int, int]
+
+# (scanned item, features or None, error or None)
+ScanResult = tuple[ScanItem, Optional[np.ndarray], Optional[Exception]]
+
+
+@dataclass
+class Timings:
+    """Durations of the startup and scan phases in seconds"""
+    # Measured by the entry point around the import of the finder and its dependencies
+    import_time: float = 0.0
+    compile_time: float = 0.0
+    scan_time: float = 0.0
+
+    def report(self) -> str:
+        """Human readable timing report"""
+        return f"import: {self.import_time:.2f} s, compile: {self.compile_time:.2f} s, scan: {self.scan_time:.2f} s"
+
 
 class DuplicateFinder:
     """Get image infos and compare them to find similar images"""
 
     # HISTOGRAM_MAX = 1000
 
-    def __init__(self) -> None:
+    def __init__(self, mode: CompareMode = CompareMode.exact, cache: Optional[FeatureCache] = None,
+                 state: Optional[ScanState] = None, scanner: Optional[Scanner] = None, streaming: bool = False,
+                 workers: Optional[int] = None, queue_size: int = DEFAULT_QUEUE_SIZE, processes: bool = False,
+                 decode_size: Optional[int] = None, exact_duplicates: bool = False,
+                 extractor: Optional[FeatureExtractor] = None, verify: bool = True,
+                 progress_interval: float = DEFAULT_INTERVAL) -> None:
         self.cancel = False
+        self.scanner = scanner if scanner is not None else Scanner()
+        self.mode = mode
+        # Compare every image as soon as its features are ready instead of after all images were decoded
+        self.streaming = streaming
+        self.workers = workers
+        self.queue_size = queue_size
+        # Decode images in worker processes instead of threads
+        self.processes = processes
+        # Features images are compared by, normalized color histograms by default
+        self.extractor = extractor if extractor is not None else NormalizedHistogramExtractor(decode_size)
+        # Recompute the distances of similar images with the verifier of the extractor if its features are approximate,
+        # e.g. computed from embedded thumbnails
+        self.verify = verify
+        # Group byte-identical files by their content hash and only decode one file of each set
+        self.exact_duplicates = exact_duplicates
+        self.cache = cache
+        # State of the previous scan. Only new or changed images are compared if set. Updated by find.
+        self.state = state
+        # Images of the last scan
+        self.store = ImageStore()
+        # Progress snapshots are sent at most once per progress_interval seconds
+        self._progress = ProgressTracker(interval=progress_interval)
+        self.timings = Timings()
+
+    @property
+    def feature_kind(self) -> str:
+        """Identifies the kind of features created with the current options"""
+        return self.extractor.kind
 
     @property
     def cancel(self) -> bool:
@@ -70,66 +114,263 @@ class DuplicateFinder:
     def cancel(self, value: bool):
         self._cancel = value
 
-    def find(self, path: str, threshold: int = 10_000_000, progress_handler: Optional[ProgressHandler] = None) -> tuple[list[ImageInfoGroup], list[Path]]:
-        """Find duplicate images"""
+    def find(self, path: str, threshold: Optional[float] = None, progress_handler: Optional[ProgressHandler] = None) -> tuple[list[ImageInfoGroup], list[ImageInfo]]:
+        """Find duplicate images
+
+        threshold is the fraction of the largest distance below which images are similar, or the distance itself for
+        features without a largest distance. It defaults to the one of the feature extractor.
+        """
+        if threshold is None:
+            threshold = self.extractor.default_threshold
         if progress_handler is not None:
-            self._progress_handler = progress_handler
-
-        # Get all file paths
-        def get_paths(path: Path) -> None:
-            for entry in path.rglob('*'):
-                if self.cancel:
-                    return
-
-                if entry.is_file():
-                    if re.match(r'.*\.(jpe?g)$', entry.name, re.I) is not None:
-                        abs_paths.append(entry)
-                elif entry.is_dir():
-                    get_paths(entry)
-
-        abs_paths = []
-        get_paths(Path(path))
-
-        # Get all histograms
-        status = "Creating histograms..."
-        self._progress_handler(0, f"{status} (1/2)")
-
-        with ThreadPool() as pool:
-            total = len(abs_paths)
-            histograms = []
-            failed = []
-            for i, histogram in enumerate(pool.imap_unordered(self.get_histogram, abs_paths)):
-                if self.cancel:
-                    pool.terminate()
-                    return ([], [])
-                self._progress_handler(int(i / total * 100), f"{status} (1/2)")
-                if histogram.error is not None:
-                    failed.append(histogram)
-                elif histogram.histogram is not None:
-                    histograms.append(histogram)
-
-        # Prepare diffs
-        pairs = []
-        for i, a in enumerate(histograms):
-            for b in histograms[i+1:]:
-                pair = Pair(a=a, b=b, diff=None)
-                pairs.append(pair)
-
-        # Get all diffs
-        status = "Comparing files..."
-        self._progress_handler(0, f"{status} (2/2)")
-        diffs = []
-        with ThreadPool() as pool:
-            total = len(pairs)
-            for i, diff in enumerate(pool.imap_unordered(self.get_diff, pairs)):
-                if self.cancel:
-                    pool.terminate()
-                    return ([], [])
-                self._progress_handler(int(i / total * 100), f"{status} (2/2)")
-                if diff.diff is not None and diff.diff < threshold:
-                    diffs.append(diff)
-
-        groups = self.get_groups(diffs)
+            self._progress.handler = progress_handler
+
+        # Compile before the workers start, so they do not race for the first compilation
+        self.timings.compile_time += compile_kernels()
+        started = time.perf_counter()
+        try:
+            return self._find(path, threshold)
+        finally:
+            self.timings.scan_time = time.perf_counter() - started
+
+    def _find(self, path: str, threshold: float) -> tuple[list[ImageInfoGroup], list[ImageInfo]]:
+        limit = self.extractor.distance_threshold(threshold)
+
+        # Reuse features and pairs of images which are unchanged since the previous scan
+        previous = self.state
+        if previous is not None and (previous.threshold != threshold or previous.kind != self.feature_kind):
+            previous = None
+        previous_index = {} if previous is None else {path: i for i, path in enumerate(previous.paths)}
+        abs_paths: list[Path] = []
+
+        # Get all file paths and stream them to the feature stage, with their index in the previous scan if unchanged
+        def get_items() -> Iterator[ScanItem]:
+            for abs_path in self.scanner.scan(Path(path), lambda: self.cancel):
+                abs_paths.append(abs_path)
+                try:
+                    stat = abs_path.stat()
+                    size, mtime_ns = stat.st_size, stat.st_mtime_ns
+                except OSError:
+                    size, mtime_ns = -1, -1
+                i = previous_index.get(str(abs_path.absolute()))
+                if previous is not None and i is not None and (previous.sizes[i], previous.mtimes[i]) == (size, mtime_ns):
+                    yield (abs_path, i, size, mtime_ns)
+                else:
+                    yield (abs_path, None, size, mtime_ns)
+
+        def get_image(item: ScanItem) -> ScanResult:
+            (abs_path, i, _, _) = item
+            if previous is not None and i is not None:
+                return (item, previous.histograms[i], None)
+            try:
+                return (item, self.get_features(abs_path), None)
+            except Exception as e:
+                return (item, None, e)
+
+        # In streaming mode the features of every new image are compared as soon as it is ready. Pairs of unchanged images are
+        # known from the previous scan, so unchanged images are only compared with new ones.
+        kept_index: Optional[OnlineIndex] = None
+        new_index: Optional[OnlineIndex] = None
+        metric = self.extractor.metric
+        if self.streaming:
+            pivots = DEFAULT_PIVOTS if self.mode == CompareMode.indexed else 0
+            width = int(np.prod(self.extractor.shape))
+            kept_index = OnlineIndex(width, pivots=pivots, metric=metric)
+            new_index = OnlineIndex(width, pivots=pivots, metric=metric)
+
+        # Byte-identical copies are grouped with a representative instead of being decoded and compared. The walk has
+        # to finish first, as files are bucketed by size.
+        items: Iterable[ScanItem] = get_items()
+        copies: list[tuple[ScanItem, Path]] = []
+        if self.exact_duplicates:
+            self._progress.start(Stage.exact, "Finding identical files...")
+            items = list(items)
+            if self.cancel:
+                return ([], [])
+            skipped = set()
+            for same in exact_duplicates([item[0] for item in items], [item[2] for item in items],
+                                         [item[1] is None for item in items], workers=self.workers):
+                # Prefer an unchanged file, its features and pairs are known from the previous scan
+                representative = next((i for i in same if items[i][1] is not None), same[0])
+                for i in same:
+                    if i != representative:
+                        copies.append((items[i], items[representative][0]))
+                        skipped.add(i)
+            items = [item for i, item in enumerate(items) if i not in skipped]
+        representatives = {path for _, path in copies}
+        representative_ids: dict[Path, int] = {}
+
+        # Get the features of all images
+        # Copies are not analyzed, they are added with the features of their representative afterwards
+        self._progress.start(Stage.analyze, "Analyzing images... (1/2)", self.scanner.found - len(copies))
+
+        # Images are identified by their index in the store, pairs are collected as blocks of index arrays
+        store = self.store = ImageStore(shape=self.extractor.shape, dtype=self.extractor.dtype, metric=metric)
+        unchanged: list[int] = []
+        kept: list[int] = []
+        new: list[int] = []
+        failed: list[ImageInfo] = []
+        pairs_a: list[np.ndarray] = []
+        pairs_b: list[np.ndarray] = []
+        pairs_diff: list[np.ndarray] = []
+        # Pairs which need no verification: copies and pairs of unchanged images
+        known_a: list[np.ndarray] = []
+        known_b: list[np.ndarray] = []
+        known_diff: list[np.ndarray] = []
+        # Streamed pairs by their row in the online index of new or unchanged images, which are rows of new and kept
+        new_rows: list[np.ndarray] = []
+        new_rows_b: list[np.ndarray] = []
+        new_rows_diff: list[np.ndarray] = []
+        kept_rows: list[np.ndarray] = []
+        kept_rows_b: list[np.ndarray] = []
+        kept_rows_diff: list[np.ndarray] = []
+        if self.processes:
+            results = self._get_images_in_processes(items, get_image)
+        else:
+            results = Pipeline(workers=self.workers, queue_size=self.queue_size).run(
+                items, get_image, lambda: self.cancel)
+        for (abs_path, old_index, size, mtime_ns), features, error in results:
+            if self.cancel:
+                return ([], [])
+            # The total grows while files are still being discovered
+            self._progress.advance(1, max(size, 0) if old_index is None else 0,
+                                   self.scanner.found - len(copies))
+            image = store.add(abs_path, features, error, size, mtime_ns)
+            if abs_path in representatives:
+                representative_ids[abs_path] = image
+            if error is not None:
+                failed.append(store[image])
+                continue
+            if features is None:
+                continue
+            if kept_index is not None and new_index is not None:
+                vector = store.features[image].reshape(-1)
+                rows, rows_diff = new_index.query(vector, limit)
+                new_rows.append(rows)
+                new_rows_b.append(np.full((len(rows),), image, dtype=np.intp))
+                new_rows_diff.append(rows_diff)
+                if old_index is None:
+                    rows, rows_diff = kept_index.query(vector, limit)
+                    kept_rows.append(rows)
+                    kept_rows_b.append(np.full((len(rows),), image, dtype=np.intp))
+                    kept_rows_diff.append(rows_diff)
+                    new_index.add(vector)
+                else:
+                    kept_index.add(vector)
+            if old_index is None:
+                new.append(image)
+            else:
+                kept.append(image)
+                unchanged.append(old_index)
+        if self.cancel:
+            return ([], [])
+        # Index rows are mapped to store ids once, the rows are added in the order of new and kept
+        for rows, rows_b, rows_diff, ids in ((new_rows, new_rows_b, new_rows_diff, new),
+                                             (kept_rows, kept_rows_b, kept_rows_diff, kept)):
+            if len(rows) > 0:
+                pairs_a.append(np.array(ids, dtype=np.intp)[_concatenate(rows, np.intp)])
+                pairs_b.append(_concatenate(rows_b, np.intp))
+                pairs_diff.append(_concatenate(rows_diff, np.int64))
+
+        # Copies share the features of their representative and are paired with it at a diff of 0. They are not
+        # part of the scan state, so they are found again if their representative changes.
+        copy_pairs: list[tuple[int, int]] = []
+        for (abs_path, _, size, mtime_ns), representative in copies:
+            source = representative_ids[representative]
+            image = store.add(abs_path, store.feature(source), store.error(source), size, mtime_ns)
+            if store.error(source) is not None:
+                failed.append(store[image])
+            elif store.feature(source) is not None:
+                copy_pairs.append((source, image))
+        if len(copy_pairs) > 0:
+            copy_ends = np.array(copy_pairs, dtype=np.intp)
+            known_a.append(copy_ends[:, 0])
+            known_b.append(copy_ends[:, 1])
+            known_diff.append(np.zeros((len(copy_pairs),), dtype=np.int64))
+
+        if self.cache is not None:
+            # Forget files which were deleted below the searched path
+            self.cache.prune(root=Path(path), keep=abs_paths)
+
+        kept_ids = np.array(kept, dtype=np.intp)
+        new_ids = np.array(new, dtype=np.intp)
+
+        # Pairs between unchanged images are known from the previous scan
+        if previous is not None:
+            old_to_new = np.full((len(previous.paths),), -1, dtype=np.intp)
+            old_to_new[unchanged] = kept_ids
+            old_a = old_to_new[previous.pairs_a]
+            old_b = old_to_new[previous.pairs_b]
+            valid = (old_a >= 0) & (old_b >= 0)
+            known_a.append(old_a[valid])
+            known_b.append(old_b[valid])
+            known_diff.append(previous.pairs_diff[valid])
+
+        # Get diffs of new images with new images and with unchanged images
+        self._progress.finish()
+        if not self.streaming:
+            new_matrix = store.matrix(new_ids)
+            kept_matrix = store.matrix(kept_ids)
+            # Work is counted in compared pairs
+            new_work = len(new) * (len(new) - 1) / 2
+            cross_work = len(new) * len(kept)
+            self._progress.start(Stage.compare, "Comparing files... (2/2)", new_work + cross_work)
+            # Hamming distances of hashes are cheaper than the pivot bounds, so hashes are always compared exhaustively
+            if self.mode == CompareMode.indexed and metric == Metric.l1:
+                new_blocks = PivotIndex(new_matrix).iter_pairs(limit)
+            elif self.mode == CompareMode.coarse and metric == Metric.l1:
+                new_blocks = iter_coarse_pairs(new_matrix, limit)
+            else:
+                new_blocks = iter_pairs(new_matrix, limit, metric)
+            if self.mode == CompareMode.coarse and metric == Metric.l1:
+                cross_blocks = iter_coarse_cross_pairs(new_matrix, kept_matrix, limit)
+            else:
+                cross_blocks = iter_cross_pairs(new_matrix, kept_matrix, limit, metric)
+            steps = [(new_blocks, new_ids, new_ids, 0, new_work),
+                     (cross_blocks, new_ids, kept_ids, new_work, cross_work)]
+            for blocks, ids_i, ids_j, work_before, work in steps:
+                for done, rows_i, rows_j, rows_diff in blocks:
+                    if self.cancel:
+                        return ([], [])
+                    self._progress.update(work_before + done * work)
+                    pairs_a.append(ids_i[rows_i])
+                    pairs_b.append(ids_j[rows_j])
+                    pairs_diff.append(rows_diff)
+
+            self._progress.finish()
+
+        a = _concatenate(pairs_a, np.intp)
+        b = _concatenate(pairs_b, np.intp)
+        diff = _concatenate(pairs_diff, np.int64)
+        verifier = self.extractor.verifier()
+        if self.verify and verifier is not None and len(a) > 0:
+            (a, b, diff) = self._verify(a, b, verifier.distance_threshold(threshold), verifier)
+            if self.cancel:
+                return ([], [])
+        a = np.concatenate([a, _concatenate(known_a, np.intp)])
+        b = np.concatenate([b, _concatenate(known_b, np.intp)])
+        diff = np.concatenate([diff, _concatenate(known_diff, np.int64)])
+
+        # Rows of the state are the images with features in store order
+        valid_ids = np.sort(np.concatenate([kept_ids, new_ids]))
+        store_to_state = np.full((len(store),), -1, dtype=np.intp)
+        store_to_state[valid_ids] = np.arange(len(valid_ids))
+        stats = np.array([store.stat(i) for i in valid_ids.tolist()], dtype=np.int64).reshape(-1, 2)
+        state_a = store_to_state[a]
+        state_b = store_to_state[b]
+        in_state = (state_a >= 0) & (state_b >= 0)
+        self.state = ScanState(
+            threshold=threshold,
+            paths=[str(store.path(i).absolute()) for i in valid_ids.tolist()],
+            sizes=stats[:, 0].copy(),
+            mtimes=stats[:, 1].copy(),
+            histograms=store.matrix(valid_ids),
+            pairs_a=state_a[in_state],
+            pairs_b=state_b[in_state],
+            pairs_diff=diff[in_state],
+            kind=self.feature_kind)
+
+        groups = [dict.fromkeys(store[i] for i in group) for group in pair_groups(a, b)]
 
         # Set checked on first image of each group
         for group in groups:
@@ -138,18 +379,78 @@ class DuplicateFinder:
 
         return (groups, failed)
 
-    def get_histogram(self, path: Path) -> ImageInfo:
-        """Get color histgram of each channel of an image"""
-        try:
-            image = iio.imread(uri=path.absolute())
-        except Exception as e:
-            return ImageInfo(path=path, error=e)
-        color_histogram: RgbHistogram = {}
-        for color in list(Color):
-            histogram, bin_edges = numba_histogram(image[:, :, color.value], bins=256)
-            # histogram = histogram * DuplicateFinder.HISTOGRAM_MAX / histogram.max()
-            color_histogram[color] = histogram
-        return ImageInfo(path=path, histogram=color_histogram)
+    def _verify(self, a: np.ndarray, b: np.ndarray, limit: int,
+                verifier: FeatureExtractor) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Recompute the distances of candidate pairs with the features of the verifier and keep the similar ones
+
+        Only images of candidate pairs are decoded again, pairs with an image which cannot be decoded are dropped.
+        """
+        store = self.store
+        ids = np.unique(np.concatenate([a, b]))
+        features = np.zeros((len(ids),) + verifier.shape, dtype=verifier.dtype)
+        store_to_row = np.full((len(store),), -1, dtype=np.intp)
+        self._progress.start(Stage.verify, "Verifying similar images...", len(ids))
+
+        # The cache holds one kind of features per file, so verified features are not cached. Verified pairs are kept
+        # in the scan state instead.
+        def get_row(row: int) -> tuple[int, Optional[np.ndarray]]:
+            try:
+                return (row, verifier.extract(store.path(int(ids[row]))))
+            except Exception:
+                return (row, None)
+
+        results = Pipeline(workers=self.workers, queue_size=self.queue_size).run(
+            range(len(ids)), get_row, lambda: self.cancel)
+        for row, vector in results:
+            if self.cancel:
+                break
+            self._progress.advance()
+            if vector is not None:
+                features[row] = vector
+                store_to_row[ids[row]] = row
+        self._progress.finish()
+        rows_a = store_to_row[a]
+        rows_b = store_to_row[b]
+        decoded = (rows_a >= 0) & (rows_b >= 0)
+        diff = pair_distances(features[rows_a[decoded]], features[rows_b[decoded]], verifier.metric)
+        similar = diff < limit
+        return (a[decoded][similar], b[decoded][similar], diff[similar])
+
+    def _get_images_in_processes(self, items: Iterable[ScanItem],
+                                 get_image: Callable[[ScanItem], ScanResult]) -> Iterator[ScanResult]:
+        """Get images like get_image, but decode new images in worker processes"""
+        # Process pools need the total number of images, so the walk is finished first
+        new_items = []
+        for item in items:
+            (abs_path, old_index, _, _) = item
+            cached = None
+            if self.cache is not None and old_index is None:
+                cached = self.cache.get(abs_path, self.feature_kind)
+            if old_index is not None:
+                yield get_image(item)
+            elif cached is not None:
+                yield (item, cached, None)
+            else:
+                new_items.append(item)
+
+        extractor = ProcessExtractor(workers=self.workers)
+        new_paths = [item[0] for item in new_items]
+        for row, features, error in extractor.run(new_paths, self.extractor.extract, self.extractor.shape,
+                                                  self.extractor.dtype, lambda: self.cancel):
+            if features is not None and self.cache is not None:
+                self.cache.put(new_paths[row], features, self.feature_kind)
+            yield (new_items[row], features, error)
+
+    def get_features(self, path: Path) -> np.ndarray:
+        """Get the features of an image from the cache or by decoding it"""
+        if self.cache is not None:
+            cached = self.cache.get(path, self.feature_kind)
+            if cached is not None:
+                return cached
+        features = self.extractor.extract(path)
+        if self.cache is not None:
+            self.cache.put(path, features, self.feature_kind)
+        return features
 
     def get_diff(self, pair: Pair) -> Pair:
         """Calculate difference between two images"""
@@ -157,71 +458,41 @@ class DuplicateFinder:
         return pair
 
     def get_groups(self, pairs: list[Pair]) -> list[ImageInfoGroup]:
-        """Create groups of similar images"""
-        groups: list[ImageInfoGroup] = []
-        for pair in pairs:
-            pair_in_groups = []
-
-            # Search items in all groups
-            for i, group in enumerate(groups):
-                if pair.a in group or pair.b in group:
-                    pair_in_groups.append(i)
-
-            # If matching items were found in multiple groups, merge those groups
-            if len(pair_in_groups) > 1:
-                for group_id in reversed(pair_in_groups[1:]):
-                    groups[pair_in_groups[0]].update(groups[group_id])
-                    del groups[group_id]
-
-            # Add items to the groups
-            if len(pair_in_groups) > 0:
-                groups[pair_in_groups[0]].update([(pair.a, None), (pair.b, None)])
-            else:
-                groups.append(dict.fromkeys([pair.a, pair.b]))
-
-        return groups
-
-
-@jit(nopython=True)
-def get_bin_edges(a, bins):
-    bin_edges = np.zeros((bins+1,), dtype=np.float64)
-    a_min = a.min()
-    a_max = a.max()
-    delta = (a_max - a_min) / bins
-    for i in range(bin_edges.shape[0]):
-        bin_edges[i] = a_min + i * delta
-
-    bin_edges[-1] = a_max  # Avoid roundoff error on last point
-    return bin_edges
-
-
-@jit(nopython=True)
-def compute_bin(x, bin_edges):
-    # assuming uniform bins for now
-    n = bin_edges.shape[0] - 1
-    a_min = bin_edges[0]
-    a_max = bin_edges[-1]
-
-    # special case to mirror NumPy behavior for last bin
-    if x == a_max:
-        return n - 1  # a_max always in last bin
-
-    bin = int(n * (x - a_min) / (a_max - a_min))
-
-    if bin < 0 or bin >= n:
-        return None
-    else:
-        return bin
-
-
-@jit(nopython=True)
-def numba_histogram(a, bins):
-    hist = np.zeros((bins,), dtype=np.intp)
-    bin_edges = get_bin_edges(a, bins)
-
-    for x in a.flat:
-        bin = compute_bin(x, bin_edges)
-        if bin is not None:
-            hist[int(bin)] += 1
-
-    return hist, bin_edges
+        """Create groups of similar images
+
+        Groups are ordered by the first pair they appear in and images by their first appearance in the pairs.
+        """
+        # Number images in the order they appear in the pairs
+        ids: dict[ImageInfo, int] = {}
+        images: list[ImageInfo] = []
+        a = np.empty((len(pairs),), dtype=np.intp)
+        b = np.empty((len(pairs),), dtype=np.intp)
+        for k, pair in enumerate(pairs):
+            for image, ends in ((pair.a, a), (pair.b, b)):
+                i = ids.get(image)
+                if i is None:
+                    i = ids[image] = len(images)
+                    images.append(image)
+                ends[k] = i
+        return [dict.fromkeys(images[i] for i in group) for group in connected_groups(len(images), a, b)]
+
+
+def _concatenate(blocks: list[np.ndarray], dtype) -> np.ndarray:
+    return np.concatenate(blocks).astype(dtype) if len(blocks) > 0 else np.empty((0,), dtype=dtype)
+
+
+def compile_kernels() -> float:
+    """Compile all numba kernels once and return the seconds it took
+
+    Kernels are cached on disk, so only the first run after an update pays for the compilation.
+    """
+    global _compiled
+    with _compile_lock:
+        if _compiled:
+            return 0.0
+        started = time.perf_counter()
+        rgb_histogram(np.zeros((1, len(Color)), dtype=np.uint8))
+        compile_distance_kernels()
+        connected_groups(2, np.zeros((1,), dtype=np.intp), np.ones((1,), dtype=np.intp))
+        _compiled = True
+        return time.perf_counter() - started
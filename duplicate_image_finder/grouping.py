@@ -0,0 +1,59 @@
+import numpy as np
+from numba import jit
+
+
+def connected_groups(count: int, a: np.ndarray, b: np.ndarray) -> list[list[int]]:
+    """Group the ids 0..count-1 connected by the pairs (a[k], b[k])
+
+    Groups are ordered by their smallest id and ids are ascending within a group. Ids without pairs are left out.
+    """
+    labels = union_find(count, np.asarray(a, dtype=np.intp), np.asarray(b, dtype=np.intp))
+    # Skip ids which are alone in their group
+    ids = np.flatnonzero(np.bincount(labels, minlength=count)[labels] > 1)
+    ids = ids[np.argsort(labels[ids], kind='stable')]
+    bounds = [0] + (np.flatnonzero(np.diff(labels[ids])) + 1).tolist() + [len(ids)]
+    ordered = ids.tolist()
+    return [ordered[start:end] for start, end in zip(bounds[:-1], bounds[1:])] if len(ordered) > 0 else []
+
+
+def pair_groups(a: np.ndarray, b: np.ndarray) -> list[list[int]]:
+    """Group the ids connected by the pairs (a[k], b[k])
+
+    Groups are ordered by the first pair they appear in and ids by their first appearance in the pairs.
+    """
+    # Number the ids in the order they appear in the pairs
+    ends = np.stack([np.asarray(a, dtype=np.intp), np.asarray(b, dtype=np.intp)], axis=1).ravel()
+    ids, first, inverse = np.unique(ends, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    numbers = np.empty((len(ids),), dtype=np.intp)
+    numbers[order] = np.arange(len(ids))
+    numbered = numbers[inverse.ravel()]
+    ordered = ids[order].tolist()
+    groups = connected_groups(len(ids), numbered[0::2], numbered[1::2])
+    return [[ordered[i] for i in group] for group in groups]
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def find_root(parent, i):
+    # Path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def union_find(count, a, b):
+    """Get the smallest id of the group of every id"""
+    parent = np.arange(count)
+    for k in range(a.shape[0]):
+        root_a = find_root(parent, a[k])
+        root_b = find_root(parent, b[k])
+        # The smaller id becomes the root, so roots order groups by their first id
+        if root_a < root_b:
+            parent[root_b] = root_a
+        elif root_b < root_a:
+            parent[root_a] = root_b
+    for i in range(count):
+        parent[i] = find_root(parent, i)
+    return parent
@@ -2,6 +2,10 @@ from .windows.main import MainWindow
 
 
 class App:
+    def __init__(self, import_time: float = 0.0) -> None:
+        # Seconds the entry point took to import the finder
+        self.import_time = import_time
+
     def run(self):
-        main_window = MainWindow()
+        main_window = MainWindow(import_time=self.import_time)
         main_window.run()
@@ -1,59 +1,276 @@
+# Allow Type without quotes
+from __future__ import annotations
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from enum import Enum
 from pathlib import Path
-from typing import Optional
+from typing import Any, Hashable, Optional
 
-from PIL import ExifTags, Image
+from feature_cache import default_cache_path
+from PIL import ExifTags, Image, ImageOps
 from PIL.ImageTk import PhotoImage
 
+ORIENTATION_TAG = next(tag for tag, name in ExifTags.TAGS.items() if name == 'Orientation')
+
+
+# Raw RGB pixels of a decoded thumbnail and its (width, height)
+ThumbnailBuffer = tuple[bytes, tuple[int, int]]
+
+# (path, (width, height)) of a thumbnail
+ThumbnailKey = tuple[Path, tuple[int, int]]
+
+# Thumbnails up to this width and height are list thumbnails, larger ones are previews
+THUMBNAIL_MAX_SIZE = 256
+
+# Bytes of decoded thumbnails kept in memory per size class
+DEFAULT_BUDGETS = {
+    'thumbnail': 64 * 1024 * 1024,
+    'preview': 128 * 1024 * 1024,
+}
+
+# Bytes of the thumbnail files on disk after pruning
+DEFAULT_DISK_BUDGET = 512 * 1024 * 1024
+
+
+class SizeClass(Enum):
+    """Pool of a thumbnail size, so large previews do not evict the small thumbnails of the list"""
+    thumbnail = 0
+    preview = 1
+
+    @staticmethod
+    def of(size: tuple[int, int]) -> SizeClass:
+        return SizeClass.thumbnail if max(size) <= THUMBNAIL_MAX_SIZE else SizeClass.preview
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests > 0 else 0.0
+
+    def report(self) -> str:
+        return f"{self.hit_rate:.0%} hits of {self.hits + self.misses}, {self.entries} entries, " \
+               f"{self.bytes / 1e6:.1f} MB, {self.evictions} evicted"
+
+
+class LruCache:
+    """Least recently used cache bounded by the bytes of its values instead of their count
+
+    Hits move an entry to the end, so frequently shown thumbnails stay. Thread-safe.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return entry[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """Add a value of size bytes and evict the least recently used values beyond the budget"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._stats.bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._stats.bytes += size
+            while self._stats.bytes > self.max_bytes:
+                (_, (_, evicted)) = self._entries.popitem(last=False)
+                self._stats.bytes -= evicted
+                self._stats.evictions += 1
 
-class Cache:
-    def __init__(self, max_len: int = 20) -> None:
-        self._cache = {}
-        self._max_len = max_len
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return replace(self._stats, entries=len(self._entries))
 
-    def add(self, key, value):
-        self._cache[key] = value
-        if len(self._cache) > self._max_len:
-            self._cache.pop(next(iter(self._cache)))
 
-    def get(self, key):
-        return self._cache.get(key)
+class DiskThumbnailStore:
+    """Thumbnails stored as JPEG files, keyed by path, size and modification time of the image and thumbnail size
 
+    A changed image gets a new key, so stale thumbnails are never shown. They are removed by prune.
+    """
 
-image_cache: Optional[Cache] = None
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_DISK_BUDGET) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, path: Path, size: tuple[int, int]) -> Optional[Path]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        key = f'{path.absolute()}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size[0]}x{size[1]}'
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+        return self.directory / digest[:2] / f'{digest}.jpg'
+
+    def get(self, path: Path, size: tuple[int, int]) -> Optional[Image.Image]:
+        file = self._file(path, size)
+        try:
+            if file is not None:
+                with Image.open(file) as image:
+                    image.load()
+                    # Recently shown thumbnails are kept by prune
+                    os.utime(file)
+                    self.hits += 1
+                    return image.convert('RGB') if image.mode != 'RGB' else image
+        except Exception:
+            pass
+        self.misses += 1
+        return None
+
+    def put(self, path: Path, size: tuple[int, int], image: Image.Image) -> None:
+        file = self._file(path, size)
+        if file is None:
+            return
+        try:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # Written under another name first, so readers never see a partial file
+            temporary = file.with_suffix(f'.{threading.get_ident()}.tmp')
+            image.save(temporary, format='JPEG', quality=90)
+            os.replace(temporary, file)
+        except OSError as e:
+            print(f"WARNING: Could not store thumbnail of {path}: {e}", file=sys.stderr)
+
+    def prune(self) -> int:
+        """Remove the least recently used thumbnails beyond max_bytes and return their count"""
+        files = []
+        for file in self.directory.glob('*/*.jpg'):
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        files.sort(reverse=True)
+        total = 0
+        removed = 0
+        for _, size, file in files:
+            total += size
+            if total > self.max_bytes:
+                try:
+                    file.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class ThumbnailCache:
+    """Decoded thumbnails in memory with a pool per size class, backed by an optional DiskThumbnailStore"""
+
+    def __init__(self, budgets: Optional[dict[str, int]] = None, disk: Optional[DiskThumbnailStore] = None) -> None:
+        budgets = budgets if budgets is not None else DEFAULT_BUDGETS
+        self._pools = {size_class: LruCache(budgets[size_class.name]) for size_class in SizeClass}
+        self.disk = disk
+
+    def get(self, key: ThumbnailKey) -> Optional[ThumbnailBuffer]:
+        """Get a thumbnail from memory"""
+        return self._pools[SizeClass.of(key[1])].get(key)
+
+    def __contains__(self, key: ThumbnailKey) -> bool:
+        return key in self._pools[SizeClass.of(key[1])]
+
+    def load(self, key: ThumbnailKey) -> ThumbnailBuffer:
+        """Get a thumbnail from memory, from disk or by decoding the image. Safe to call from any thread."""
+        buffer = self.get(key)
+        if buffer is not None:
+            return buffer
+        (path, size) = key
+        image = self.disk.get(path, size) if self.disk is not None else None
+        if image is None:
+            image = decode_thumbnail(path, size)
+            if self.disk is not None:
+                self.disk.put(path, size, image)
+        buffer = (image.tobytes(), image.size)
+        self._pools[SizeClass.of(size)].put(key, buffer, len(buffer[0]))
+        return buffer
+
+    def stats(self) -> dict[SizeClass, CacheStats]:
+        return {size_class: pool.stats() for size_class, pool in self._pools.items()}
+
+    def report(self) -> str:
+        """Human readable statistics of the pools and of the disk store"""
+        parts = [f"{size_class.name}s: {stats.report()}" for size_class, stats in self.stats().items()]
+        if self.disk is not None:
+            parts.append(f"disk: {self.disk.hits} hits, {self.disk.misses} misses")
+        return "; ".join(parts)
+
+
+def default_thumbnail_path() -> Path:
+    """Location of the thumbnail store next to the feature cache"""
+    return default_cache_path().parent / 'thumbnails'
+
+
+_thumbnail_cache: Optional[ThumbnailCache] = None
+
+
+def thumbnail_cache() -> ThumbnailCache:
+    """Cache shared by all windows, so reopened results show their thumbnails from memory"""
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        disk = DiskThumbnailStore(default_thumbnail_path())
+        _thumbnail_cache = ThumbnailCache(disk=disk)
+        # Pruning lists every stored thumbnail, so it does not delay the first thumbnails
+        threading.Thread(target=disk.prune, daemon=True).start()
+    return _thumbnail_cache
 
 
 def load_image(path: Path, width: Optional[int] = None, height: Optional[int] = None) -> PhotoImage:
+    """Load an image fit into width and height on the Tk main thread, blocking until it is decoded"""
     if width is not None and height is None:
         height = width
     elif width is None and height is not None:
         width = height
+    if width is None or height is None:
+        return PhotoImage(decode_thumbnail(path))
+    (data, size) = thumbnail_cache().load((path, (width, height)))
+    return PhotoImage(Image.frombuffer('RGB', size, data, 'raw', 'RGB', 0, 1))
+
+
+def decode_thumbnail(path: Path, size: Optional[tuple[int, int]] = None) -> Image.Image:
+    """Decode an image rotated according to its EXIF orientation and fit into size as RGB
 
-    global image_cache
-    if image_cache is None:
-        image_cache = Cache()
-    cache_key = f'{path};{width}x{height}'
-
-    photo_image = image_cache.get(cache_key)
-    if photo_image is not None:
-        return photo_image
-
-    image = Image.open(path)
-    if width is not None and height is not None:
-        image.thumbnail((width, height), Image.BICUBIC)
-
-    # Rotate image according to EXIF data
-    orientation = 0
-    for orientation in ExifTags.TAGS.keys():
-        if ExifTags.TAGS[orientation] == 'Orientation':
-            break
-    exif = image.getexif()
-    if exif[orientation] == 3:
-        image = image.rotate(180, expand=True)
-    elif exif[orientation] == 6:
-        image = image.rotate(270, expand=True)
-    elif exif[orientation] == 8:
-        image = image.rotate(90, expand=True)
-
-    photo_image = PhotoImage(image)
-    image_cache.add(cache_key, photo_image)
-    return photo_image
+    JPEG images are decoded at a reduced DCT scale and then reduced by whole factors before the final resampling,
+    so large photos are not decoded at full resolution. Safe to call from any thread.
+    """
+    with Image.open(path) as image:
+        if size is not None:
+            # Orientations 5 to 8 swap width and height
+            orientation = image.getexif().get(ORIENTATION_TAG, 1)
+            draft_size = (size[1], size[0]) if orientation in (5, 6, 7, 8) else size
+            image.draft('RGB', draft_size)
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if size is not None:
+            image.thumbnail(size, Image.BICUBIC, reducing_gap=2.0)
+        image.load()
+        return image
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from typing import Iterator, Sequence
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Cell:
+    """Position of a group title or of an image in the list"""
+    group: int
+    # Index of the image in its group or TITLE
+    index: int
+    x: int
+    y: int
+
+
+# Index of the title cell of a group
+TITLE = -1
+
+
+class GroupLayout:
+    """Positions of the titles and images of groups wrapped into rows of a fixed number of columns
+
+    Only the group offsets are stored, so the layout of any number of groups is computed at once and cells of a
+    visible range are found by a binary search.
+    """
+
+    def __init__(self, sizes: Sequence[int], columns: int, cell_width: int, cell_height: int,
+                 title_height: int) -> None:
+        self.columns = max(columns, 1)
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.title_height = title_height
+        self.sizes = np.asarray(sizes, dtype=np.int64).reshape(-1)
+        rows = -(-self.sizes // self.columns)
+        heights = title_height + rows * cell_height
+        # Top of every group and the total height at the end
+        self.tops = np.concatenate([[0], np.cumsum(heights)])
+
+    @property
+    def height(self) -> int:
+        return int(self.tops[-1])
+
+    def group_at(self, y: int) -> int:
+        """Index of the group at a height, clipped to the existing groups"""
+        return int(np.clip(np.searchsorted(self.tops, y, side='right') - 1, 0, max(len(self.sizes) - 1, 0)))
+
+    def visible(self, top: int, bottom: int) -> Iterator[Cell]:
+        """Cells which intersect the range from top to bottom"""
+        if len(self.sizes) == 0:
+            return
+        for group in range(self.group_at(top), len(self.sizes)):
+            group_top = int(self.tops[group])
+            if group_top >= bottom:
+                return
+            if group_top + self.title_height > top:
+                yield Cell(group, TITLE, 0, group_top)
+            first_top = group_top + self.title_height
+            # Rows of the group within the range
+            first_row = max((top - first_top) // self.cell_height, 0)
+            last_row = (bottom - 1 - first_top) // self.cell_height
+            for row in range(first_row, last_row + 1):
+                for column in range(self.columns):
+                    index = row * self.columns + column
+                    if index >= self.sizes[group]:
+                        break
+                    yield Cell(group, index, column * self.cell_width, first_top + row * self.cell_height)
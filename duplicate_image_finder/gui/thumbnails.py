@@ -0,0 +1,191 @@
+import itertools
+import os
+import sys
+import threading
+from pathlib import Path
+from queue import Empty, PriorityQueue, Queue
+from tkinter import TclError
+from typing import Callable, Iterable, Optional
+
+from PIL import Image
+from PIL.ImageTk import PhotoImage
+
+from .graphics import ThumbnailBuffer, ThumbnailCache, ThumbnailKey, thumbnail_cache
+
+# Requests of visible images are decoded before prefetched ones
+PRIORITY_VISIBLE = 0
+PRIORITY_PREFETCH = 1
+
+# Milliseconds between two checks for decoded thumbnails on the Tk main thread
+POLL_INTERVAL = 30
+
+# Decoded thumbnails which are turned into PhotoImages per check, so the main thread stays responsive
+MAX_PER_POLL = 16
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class ThumbnailLoader:
+    """Decodes and resizes thumbnails in background threads into raw RGB buffers of a ThumbnailCache
+
+    Requests are decoded by priority, so visible images go before prefetched ones. Finished thumbnails are collected
+    with poll. Nothing here touches Tk, so it can run without a display.
+    """
+
+    def __init__(self, cache: ThumbnailCache, workers: int = DEFAULT_WORKERS) -> None:
+        self.cache = cache
+        self._requests: PriorityQueue = PriorityQueue()
+        self._done: Queue = Queue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        # Keys which are queued or being decoded by their priority
+        self._pending: dict[ThumbnailKey, int] = {}
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def request(self, key: ThumbnailKey, priority: int = PRIORITY_VISIBLE) -> bool:
+        """Queue a thumbnail for decoding, unless it is decoded or queued already. Returns if it was queued."""
+        with self._lock:
+            if key in self.cache:
+                if priority == PRIORITY_VISIBLE:
+                    buffer = self.cache.get(key)
+                    if buffer is not None:
+                        # Shown or prefetched before, report it as done again
+                        self._done.put((key, buffer))
+                        return False
+                else:
+                    return False
+            if key in self._pending and self._pending[key] <= priority:
+                return False
+            # Prefetched images which become visible are queued again with the higher priority
+            self._pending[key] = priority
+        self._requests.put((priority, next(self._order), key))
+        return True
+
+    def discard(self, key: ThumbnailKey) -> None:
+        """Drop the queued request of a key, e.g. of an image scrolled out of view. A running decode still finishes."""
+        with self._lock:
+            # The queue entry stays and is skipped by the workers
+            self._pending.pop(key, None)
+
+    def cancel(self) -> None:
+        """Drop all queued requests, e.g. when other groups are shown. Running decodes still finish."""
+        while True:
+            try:
+                (_, _, key) = self._requests.get_nowait()
+            except Empty:
+                break
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def poll(self, limit: int = MAX_PER_POLL) -> list[tuple[ThumbnailKey, ThumbnailBuffer]]:
+        """Get up to limit thumbnails which were decoded since the last poll"""
+        keys = []
+        while len(keys) < limit:
+            try:
+                keys.append(self._done.get_nowait())
+            except Empty:
+                break
+        return keys
+
+    def close(self) -> None:
+        self._closed = True
+        self.cancel()
+        for _ in self._threads:
+            self._requests.put((-1, next(self._order), None))
+
+    def _work(self) -> None:
+        while not self._closed:
+            (_, _, key) = self._requests.get()
+            if key is None:
+                return
+            with self._lock:
+                # Cancelled or decoded by a request of higher priority
+                if key not in self._pending:
+                    continue
+            try:
+                buffer: Optional[ThumbnailBuffer] = self.cache.load(key)
+            except Exception as e:
+                print(f"WARNING: Could not load thumbnail of {key[0]}: {e}", file=sys.stderr)
+                buffer = None
+            with self._lock:
+                self._pending.pop(key, None)
+            if buffer is not None:
+                self._done.put((key, buffer))
+
+
+class ThumbnailService:
+    """Shows thumbnails without blocking the Tk main thread
+
+    Images are decoded by a ThumbnailLoader, the main thread only turns finished buffers into PhotoImages and passes
+    them to the callbacks of their requests. Until then, callers show a placeholder.
+    """
+
+    def __init__(self, widget, workers: int = DEFAULT_WORKERS, cache: Optional[ThumbnailCache] = None) -> None:
+        # Any widget, used to schedule polls on the main thread
+        self._widget = widget
+        self._loader = ThumbnailLoader(cache if cache is not None else thumbnail_cache(), workers)
+        self._callbacks: dict[ThumbnailKey, list[Callable[[PhotoImage], None]]] = {}
+        self._placeholders: dict[tuple[int, int], PhotoImage] = {}
+        self._closed = False
+        self._widget.after(POLL_INTERVAL, self._poll)
+
+    def placeholder(self, size: tuple[int, int]) -> PhotoImage:
+        """Empty image of a thumbnail size"""
+        placeholder = self._placeholders.get(size)
+        if placeholder is None:
+            placeholder = self._placeholders[size] = PhotoImage(Image.new('RGB', size, '#d9d9d9'))
+        return placeholder
+
+    def request(self, path: Path, size: tuple[int, int], callback: Callable[[PhotoImage], None]) -> None:
+        """Decode a thumbnail in the background and pass it to callback on the main thread"""
+        key = (path, size)
+        self._callbacks.setdefault(key, []).append(callback)
+        self._loader.request(key, PRIORITY_VISIBLE)
+
+    def prefetch(self, paths: Iterable[Path], size: tuple[int, int]) -> None:
+        """Decode thumbnails which are likely requested next, e.g. of the next page"""
+        for path in paths:
+            self._loader.request((path, size), PRIORITY_PREFETCH)
+
+    def release(self, path: Path, size: tuple[int, int]) -> None:
+        """Forget the request of an image which is no longer shown, so visible images are not decoded after it"""
+        key = (path, size)
+        self._callbacks.pop(key, None)
+        self._loader.discard(key)
+
+    def cancel(self) -> None:
+        """Forget all requests which were not shown yet"""
+        self._callbacks.clear()
+        self._loader.cancel()
+
+    @property
+    def cache(self) -> ThumbnailCache:
+        return self._loader.cache
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._callbacks.clear()
+        self._loader.close()
+        print(f"INFO: Thumbnail cache: {self.cache.report()}", file=sys.stderr)
+
+    def _poll(self) -> None:
+        if self._closed:
+            return
+        for key, (data, size) in self._loader.poll():
+            callbacks = self._callbacks.pop(key, None)
+            if callbacks is None:
+                # Prefetched, the buffer is kept in the cache until it is requested
+                continue
+            photo_image = PhotoImage(Image.frombuffer('RGB', size, data, 'raw', 'RGB', 0, 1))
+            for callback in callbacks:
+                callback(photo_image)
+        try:
+            self._widget.after(POLL_INTERVAL, self._poll)
+        except TclError:
+            # The window was closed
+            self.close()
@@ -1,15 +1,19 @@
 # Allow Type without quotes
 from __future__ import annotations
 
-from tkinter import IntVar
+from tkinter import IntVar, TclError
 from tkinter.ttk import Checkbutton, Frame, Label, Style
-from typing import Callable
+from typing import Callable, Optional
 
 from finder import ImageInfo
+from PIL.ImageTk import PhotoImage
 
-from ..graphics import load_image
+from ..thumbnails import ThumbnailService
 from .base import Widget
 
+# Largest width and height of thumbnails in the list
+THUMBNAIL_SIZE = (128, 128)
+
 
 class Image(Widget):
     """An image that can be checked"""
@@ -19,9 +23,11 @@ class Image(Widget):
                                                             None],
             on_leave: Callable[[ImageInfo],
                                None],
+            thumbnails: ThumbnailService,
             parent) -> None:
         super().__init__(parent, "image.ui", "imageFrame", Frame)
 
+        self._thumbnails = thumbnails
         self._on_enter = on_enter
         self._on_leave = on_leave
 
@@ -39,8 +45,19 @@ class Image(Widget):
     @image_info.setter
     def image_info(self, value: ImageInfo):
         self._image_info = value
-        self._image = load_image(self._image_info.path, width=128)
-        self._label.configure(image=self._image)
+        # Show a placeholder until the thumbnail was decoded in the background
+        self._set_image(self._thumbnails.placeholder(THUMBNAIL_SIZE))
+        self._thumbnails.request(value.path, THUMBNAIL_SIZE, lambda image: self._set_image(image, value))
+
+    def _set_image(self, image: PhotoImage, image_info: Optional[ImageInfo] = None):
+        if image_info is not None and image_info is not self._image_info:
+            return
+        try:
+            self._label.configure(image=image)
+        except TclError:
+            # The widget was destroyed before its thumbnail was ready
+            return
+        self._image = image
         self._label.image = self._image  # type: ignore
 
     @property
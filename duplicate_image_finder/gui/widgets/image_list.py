@@ -1,47 +1,171 @@
-from tkinter import END, Text
+from tkinter import Canvas
 from tkinter.ttk import Label, Scrollbar, Style
-from typing import Callable
+from typing import Callable, Optional, Union
 
 from finder import ImageInfo, ImageInfoGroup
 
+from ..layout import TITLE, Cell, GroupLayout
+from ..thumbnails import ThumbnailService
 from .base import Widget
-from .image import Image
+from .image import THUMBNAIL_SIZE, Image
+
+# Size of an image with its checkbox and padding
+CELL_WIDTH = THUMBNAIL_SIZE[0] + 8
+CELL_HEIGHT = THUMBNAIL_SIZE[1] + 32
+TITLE_HEIGHT = 28
+
+# Pixels per step of the mouse wheel
+SCROLL_STEP = CELL_HEIGHT // 2
 
 
 class ImageList(Widget):
-    def __init__(self, parent, on_enter: Callable[[ImageInfo], None], on_leave: Callable[[ImageInfo], None]) -> None:
-        super().__init__(parent, None, None, Text)
+    """Scrollable list of image groups which only creates widgets for the visible images
+
+    Widgets of images which are scrolled out of view are reused for the images scrolled into view, so memory and
+    redraw time do not depend on the number of groups.
+    """
+
+    def __init__(self, parent, on_enter: Callable[[ImageInfo], None], on_leave: Callable[[ImageInfo], None],
+                 thumbnails: ThumbnailService) -> None:
+        super().__init__(parent, None, None, Canvas)
+        self._thumbnails = thumbnails
         self._on_enter = on_enter
         self._on_leave = on_leave
         background = Style().lookup('TFrame', 'background')
-        self._widget: Text = Text(master=parent, background=background, cursor='arrow', wrap='char', borderwidth=0)
-        self._widget.pack(expand=True, fill='both', side='left')
-        self._scrollbar = Scrollbar(master=parent, command=self._widget.yview)
-        self._widget.configure(yscrollcommand=self._scrollbar.set)
+        self._widget: Canvas = Canvas(master=parent, background=background, borderwidth=0, highlightthickness=0)
+        self._scrollbar = Scrollbar(master=parent, command=self._on_scrollbar)
         self._scrollbar.pack(side='right', fill='y')
+        self._widget.pack(expand=True, fill='both', side='left')
+        self._widget.bind('<Configure>', self._on_configure)
+        # Wheel events go to the widget under the pointer, which is usually an image. Every widget of the window has
+        # the window in its bind tags.
+        toplevel = self._widget.winfo_toplevel()
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            toplevel.bind(sequence, self._on_wheel, add='+')
+
+        self._groups: list[ImageInfoGroup] = []
+        self._images: list[list[ImageInfo]] = []
+        self._layout = GroupLayout([], 1, CELL_WIDTH, CELL_HEIGHT, TITLE_HEIGHT)
+        self._top = 0
+        # Shown cells by (group, index) with their widget and canvas item
+        self._shown: dict[tuple[int, int], tuple[Union[Image, Label], int]] = {}
+        # Hidden widgets with their canvas items, reused for cells scrolled into view
+        self._free_images: list[tuple[Image, int]] = []
+        self._free_titles: list[tuple[Label, int]] = []
+        self._update_pending = False
 
-    def add_group(self, group: ImageInfoGroup, title: str):
-        self.widget.configure(state='normal')
+    @property
+    def groups(self) -> list[ImageInfoGroup]:
+        return self._groups
 
-        # Add group label
-        label = Label(master=self.widget, text=title)
+    @groups.setter
+    def groups(self, groups: list[ImageInfoGroup]):
+        self._groups = groups
+        self._images = [list(group) for group in groups]
+        self._top = 0
+        # Thumbnails of the previous groups are not shown anymore
+        self._thumbnails.cancel()
+        self._relayout()
 
-        self.widget.window_create(END, window=label)
-        self.widget.insert(END, '\n')
+    def clear(self):
+        self.groups = []
 
-        # Add images of group
-        for image_info in group:
-            image = Image(image_info, parent=self.widget, on_enter=self._on_enter, on_leave=self._on_leave)
-            self.widget.window_create(END, window=image.widget)
-        self.widget.insert(END, '\n')
+    def _relayout(self):
+        width = max(self.widget.winfo_width(), CELL_WIDTH)
+        self._layout = GroupLayout([len(images) for images in self._images], width // CELL_WIDTH, CELL_WIDTH,
+                                   CELL_HEIGHT, TITLE_HEIGHT)
+        # Positions changed, so every cell is placed again
+        for key in list(self._shown):
+            self._release(key)
+        self._scroll_to(self._top)
 
-        self.widget.configure(state='disabled')
+    def _scroll_to(self, top: int):
+        view_height = max(self.widget.winfo_height(), 1)
+        self._top = max(min(top, self._layout.height - view_height), 0)
+        self.widget.configure(scrollregion=(0, 0, CELL_WIDTH * self._layout.columns, max(self._layout.height, 1)))
+        self.widget.yview_moveto(self._top / max(self._layout.height, 1))
+        if self._layout.height > 0:
+            self._scrollbar.set(self._top / self._layout.height, (self._top + view_height) / self._layout.height)
+        else:
+            self._scrollbar.set(0, 1)
+        self._schedule_update()
 
-    def clear(self):
-        self.widget.configure(state='normal')
-        self.widget.delete('1.0', END)
-        children = self.widget.winfo_children()
-        for child in children:
-            print("clear")
-            child.pack_forget()
-        self.widget.configure(state='disabled')
+    def _schedule_update(self):
+        # Many scroll events arrive per frame, the cells are placed once when Tk is idle
+        if not self._update_pending:
+            self._update_pending = True
+            self.widget.after_idle(self._update)
+
+    def _update(self):
+        self._update_pending = False
+        view_height = max(self.widget.winfo_height(), 1)
+        visible = {(cell.group, cell.index): cell
+                   for cell in self._layout.visible(self._top, self._top + view_height)}
+        for key in [key for key in self._shown if key not in visible]:
+            self._release(key)
+        for key, cell in visible.items():
+            if key not in self._shown:
+                self._show(cell)
+
+        # Decode the thumbnails of the next screen in the background
+        below = self._layout.visible(self._top + view_height, self._top + 2 * view_height)
+        self._thumbnails.prefetch((self._images[cell.group][cell.index].path for cell in below
+                                   if cell.index != TITLE), THUMBNAIL_SIZE)
+
+    def _show(self, cell: Cell):
+        if cell.index == TITLE:
+            if len(self._free_titles) > 0:
+                (title, item) = self._free_titles.pop()
+            else:
+                title = Label(master=self.widget)
+                item = self.widget.create_window(0, 0, window=title, anchor='nw')
+            title.configure(text=f"Group {cell.group + 1} ({len(self._images[cell.group])} images)")
+            self.widget.coords(item, cell.x + 4, cell.y + 4)
+            self._shown[(cell.group, cell.index)] = (title, item)
+            return
+
+        image_info = self._images[cell.group][cell.index]
+        if len(self._free_images) > 0:
+            (image, item) = self._free_images.pop()
+            image.image_info = image_info
+            image.checked = image_info.checked
+        else:
+            image = Image(image_info, parent=self.widget, on_enter=self._on_enter, on_leave=self._on_leave,
+                          thumbnails=self._thumbnails)
+            item = self.widget.create_window(0, 0, window=image.widget, anchor='nw')
+        self.widget.coords(item, cell.x + 4, cell.y)
+        self._shown[(cell.group, cell.index)] = (image, item)
+
+    def _release(self, key: tuple[int, int]):
+        (widget, item) = self._shown.pop(key)
+        # Window items cannot be hidden on every Tk version, so they are moved out of the scroll region instead
+        self.widget.coords(item, -2 * CELL_WIDTH, -2 * CELL_HEIGHT)
+        if isinstance(widget, Label):
+            self._free_titles.append((widget, item))
+        else:
+            # Images scrolled into view are decoded first instead of after every image scrolled by
+            self._thumbnails.release(widget.image_info.path, THUMBNAIL_SIZE)
+            self._free_images.append((widget, item))
+
+    def _on_configure(self, event=None):
+        if event is not None and max(event.width, CELL_WIDTH) // CELL_WIDTH != self._layout.columns:
+            self._relayout()
+        else:
+            self._scroll_to(self._top)
+
+    def _on_scrollbar(self, command: str, value: str, unit: Optional[str] = None):
+        view_height = max(self.widget.winfo_height(), 1)
+        if command == 'moveto':
+            self._scroll_to(int(float(value) * self._layout.height))
+        elif command == 'scroll':
+            step = view_height if unit == 'pages' else SCROLL_STEP
+            self._scroll_to(self._top + int(value) * step)
+
+    def _on_wheel(self, event):
+        if getattr(event, 'num', None) == 4:
+            steps = -1
+        elif getattr(event, 'num', None) == 5:
+            steps = 1
+        else:
+            steps = -1 if event.delta > 0 else 1
+        self._scroll_to(self._top + steps * SCROLL_STEP)
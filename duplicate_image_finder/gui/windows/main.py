@@ -1,4 +1,3 @@
-import os
 import sys
 import tkinter as tk
 from concurrent.futures import ThreadPoolExecutor
@@ -8,10 +7,14 @@ from queue import Queue
 from tkinter import filedialog, messagebox
 from tkinter.ttk import Frame, Label
 
+from deletion import Action, DeletionEngine, JournalMismatch, Operation, default_journal_path
+from feature_cache import FeatureCache, default_cache_path
 from finder import DuplicateFinder, ImageInfoGroup
+from metrics import ProgressSnapshot, ProgressTracker
+from scan_state import ScanState, default_state_path
 
 from .base import Window
-from .progress import ProgressMessage, ProgressWindow
+from .progress import ProgressWindow
 from .selection import SelectionWindow
 
 
@@ -24,8 +27,10 @@ class Step(Enum):
 class MainWindow(Window):
     """Main program window"""
 
-    def __init__(self, parent=None) -> None:
+    def __init__(self, parent=None, import_time: float = 0.0) -> None:
         super().__init__(parent, "main_window.ui", "main_window")
+        # Seconds the entry point took to import the finder, for the timing report
+        self._import_time = import_time
         self._frame_open: Frame = self._builder.get_object("frameOpen")
         self._frame_select: Frame = self._builder.get_object("frameSelect")
         self._frame_delete: Frame = self._builder.get_object("frameDelete")
@@ -36,7 +41,7 @@ class MainWindow(Window):
 
         self.step = Step.Open
         self.directory = ''
-        self._queue: Queue[ProgressMessage]
+        self._queue: Queue[ProgressSnapshot]
         self._groups = []
         self._failed = []
         self.groups = []
@@ -107,15 +112,24 @@ class MainWindow(Window):
             return
 
         self._queue = Queue()
-        finder = DuplicateFinder()
+        cache = FeatureCache(default_cache_path())
+        state_path = default_state_path(self.directory)
+        state = None
+        if state_path.exists():
+            try:
+                state = ScanState.load(state_path)
+            except Exception as e:
+                print(f"WARNING: Could not load scan state {state_path}: {e}", file=sys.stderr)
+        finder = DuplicateFinder(cache=cache, state=state, exact_duplicates=True)
+        finder.timings.import_time = self._import_time
 
         def on_cancel():
             finder.cancel = True
 
         self._progress_window = ProgressWindow(self._queue, cancel_handler=on_cancel, parent=self.widget)
 
-        def on_progress(value, status):
-            self._queue.put(ProgressMessage(status=status, value=value))
+        def on_progress(snapshot: ProgressSnapshot):
+            self._queue.put(snapshot)
 
         def progress_loop():
             self._progress_window.process()
@@ -125,7 +139,13 @@ class MainWindow(Window):
                 self._progress_window.widget.destroy()
 
         def find_runner():
-            (groups, failed) = finder.find(self.directory, progress_handler=on_progress)
+            try:
+                (groups, failed) = finder.find(self.directory, progress_handler=on_progress)
+                if not finder.cancel and finder.state is not None:
+                    finder.state.save(state_path)
+            finally:
+                cache.close()
+            print(f"INFO: {finder.timings.report()}", file=sys.stderr)
             self._progress_running = False
             return (groups, failed)
 
@@ -166,8 +186,19 @@ class MainWindow(Window):
             for image in group:
                 if image.checked:
                     delete_paths.append(image.path)
-
-        self._queue: Queue[ProgressMessage] = Queue()
+        operations = [Operation(path) for path in delete_paths]
+
+        # A journal of the same selection resumes the interrupted deletion, one of another run is in the way
+        engine = DeletionEngine(Action.delete, journal=default_journal_path())
+        if not engine.can_resume(operations):
+            if not messagebox.askokcancel(
+                    "Unfinished run",
+                    "An interrupted run on other images left a journal behind. Discard the journal and delete the "
+                    "selected images?"):
+                return
+            default_journal_path().unlink(missing_ok=True)
+
+        self._queue: Queue[ProgressSnapshot] = Queue()
         self._cancel = False
 
         def on_cancel():
@@ -175,8 +206,7 @@ class MainWindow(Window):
 
         self._progress_window = ProgressWindow(self._queue, cancel_handler=on_cancel, parent=self.widget)
 
-        def on_progress(value, status):
-            self._queue.put(ProgressMessage(value=value, status=status))
+        tracker = ProgressTracker(self._queue.put)
 
         def progress_loop():
             self._progress_window.process()
@@ -187,21 +217,17 @@ class MainWindow(Window):
                 messagebox.showinfo("Success", "Duplicate images were removed.")
 
         def remove_runner():
-            total = len(delete_paths)
-            succeeded = []
-            failed = []
-            for i, path in enumerate(delete_paths):
-                try:
-                    if self._cancel:
-                        return (succeeded, failed)
-                    os.remove(path)
-                    succeeded.append(path)
-                except Exception as e:
-                    print(f"WARNING: Could not remove {path}: {e}", file=sys.stderr)
-                    failed.append(path)
-                on_progress(i / total * 100, "Removing duplicate images...")
-            self._progress_running = False
-            return (succeeded, failed)
+            try:
+                result = engine.run(operations, tracker, lambda: self._cancel)
+            except JournalMismatch as e:
+                # Another run started in between
+                print(f"WARNING: {e}", file=sys.stderr)
+                return ([], delete_paths)
+            finally:
+                self._progress_running = False
+            for path, error in result.failed:
+                print(f"WARNING: Could not remove {path}: {error}", file=sys.stderr)
+            return (result.succeeded + result.skipped, [path for path, _ in result.failed])
 
         self._progress_running = True
         with ThreadPoolExecutor(max_workers=1) as executor:
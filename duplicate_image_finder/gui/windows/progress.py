@@ -1,22 +1,17 @@
 import queue
-from dataclasses import dataclass
 from queue import Queue
 from tkinter.ttk import Button, Label, Progressbar
 from typing import Callable
 
-from .base import Window
-
+from metrics import ProgressSnapshot
 
-@dataclass
-class ProgressMessage:
-    status: str
-    value: int
+from .base import Window
 
 
 class ProgressWindow(Window):
     """Window to shop a process progress"""
 
-    def __init__(self, queue: Queue[ProgressMessage], cancel_handler: Callable, parent=None) -> None:
+    def __init__(self, queue: Queue[ProgressSnapshot], cancel_handler: Callable, parent=None) -> None:
         super().__init__(parent, "progress_window.ui", "windowMain")
 
         self._queue = queue
@@ -54,9 +49,8 @@ class ProgressWindow(Window):
                 break
         if msg is None:
             return
-        if msg.status is not None:
-            self._label_status.configure(text=msg.status)
-        self._progressbar.configure(value=msg.value)
+        self._label_status.configure(text=msg.describe())
+        self._progressbar.configure(value=msg.percent)
 
     def on_cancel(self, event=None):
         if self._cancel_handler is not None:
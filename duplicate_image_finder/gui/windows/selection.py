@@ -1,15 +1,14 @@
 # Allow Type without quotes
 from __future__ import annotations
 
-from math import ceil
-from tkinter import StringVar
-from tkinter.ttk import Entry, Frame, Label, Panedwindow
+from tkinter.ttk import Frame, Label, Panedwindow
 # Allow type checking without importing
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 from finder import ImageInfo
+from PIL.ImageTk import PhotoImage
 
-from ..graphics import load_image
+from ..thumbnails import ThumbnailService
 from ..widgets.image_list import ImageList
 from .base import Window
 
@@ -20,44 +19,25 @@ if TYPE_CHECKING:
 class SelectionWindow(Window):
     """Image selection window"""
 
-    GROUPS_PER_PAGE = 10
-
     def __init__(self, groups: list[ImageInfoGroup], parent=None):
         super().__init__(parent, "selection_window.ui", "mainWindow")
         self._cancel = False
         self._groups_frame: Frame = self._builder.get_object("container")
-        self._page_entry: Entry = self._builder.get_object("pageEntry")
-        self._page_string = StringVar()
-        self._page_entry.configure(textvariable=self._page_string)
+        self._groups_label: Label = self._builder.get_object("groupsLabel")
         self._paned_window: Panedwindow = self._builder.get_object("panedwindow1")
         self._image_preview: Label = self._builder.get_object("image_preview_label")
-        self._image_list = ImageList(parent=self._groups_frame,
-                                     on_enter=self.on_image_enter, on_leave=self.on_image_leave)
-        self._page_total_label: Label = self._builder.get_object("totalPagesLabel")
+        # Image under the mouse pointer, its preview is shown once it is decoded
+        self._preview_info: Optional[ImageInfo] = None
+        self._thumbnails = ThumbnailService(self.widget)
+        self._image_list = ImageList(parent=self._groups_frame, on_enter=self.on_image_enter,
+                                     on_leave=self.on_image_leave, thumbnails=self._thumbnails)
 
         # Modal window
         if parent is not None:
             self.widget.grab_set()
 
-        self._page = 0
         self.groups = groups
         self.parent = parent
-        self.page = 0
-
-        self.widget.bind("<Return>", self.on_page_change)
-
-    @property
-    def page(self) -> int:
-        return self._page
-
-    @page.setter
-    def page(self, page: int):
-        if not self.validate_page(page):
-            return
-        self._page = page
-        self._page_string.set(str(page + 1))
-        self.load_images()
-        # TODO redraw
 
     @property
     def groups(self):
@@ -66,11 +46,12 @@ class SelectionWindow(Window):
     @groups.setter
     def groups(self, value):
         self._groups = value
-        total = str(ceil(len(self._groups) / self.GROUPS_PER_PAGE))
-        self._page_total_label.configure(text=total)
-        self.load_images()
+        images = sum(len(group) for group in value)
+        self._groups_label.configure(text=f"{len(value)} groups with {images} images")
+        self._image_list.groups = value
 
     def on_ok(self, event=None):
+        self._thumbnails.close()
         self.widget.destroy()
 
     def on_image_enter(self, image_info: ImageInfo):
@@ -78,36 +59,16 @@ class SelectionWindow(Window):
         height = self._image_preview.winfo_height()
         if width <= 0 or height <= 0:
             return
-        image = load_image(image_info.path, width=width, height=height)
-        self._image_preview.configure(image=image)
+        self._preview_info = image_info
 
-    def on_image_leave(self, event=None):
-        self._image_preview.configure(image='')
+        def show(image: PhotoImage):
+            # The pointer may have moved on while the preview was decoded
+            if self._preview_info is image_info:
+                self._image_preview.configure(image=image)
+                self._image_preview.image = image  # type: ignore
 
-    def on_page_validate(self, page: str):
-        return str.isdigit(page) and self.validate_page(int(page) - 1) or page == ''
+        self._thumbnails.request(image_info.path, (width, height), show)
 
-    def on_page_prev(self, event=None):
-        self.page -= 1
-
-    def on_page_next(self, event=None):
-        self.page += 1
-
-    def on_page_change(self, event=None):
-        page = self._page_entry.get()
-        if page == '':
-            page = 0
-        self.page = int(page) - 1
-
-    def validate_page(self, value: int) -> bool:
-        return value >= 0 and value < ceil(len(self.groups) / self.GROUPS_PER_PAGE)
-
-    def load_images(self):
-        # Clear old image groups
-        self._image_list.clear()
-
-        # Create new image group for page
-        start_group = self.page * self.GROUPS_PER_PAGE
-        end_group = start_group + self.GROUPS_PER_PAGE
-        for i, group in enumerate(self.groups[start_group:end_group]):
-            self._image_list.add_group(group, title=f"Group {1 + i + self.page * self.GROUPS_PER_PAGE}")
+    def on_image_leave(self, event=None):
+        self._preview_info = None
+        self._image_preview.configure(image='')
@@ -0,0 +1,218 @@
+from enum import Enum
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from distance import Metric, distance
+
+
+class Color(Enum):
+    red = 0
+    green = 1
+    blue = 2
+
+
+Histogram = np.ndarray
+RgbHistogram = dict[Color, Histogram]
+
+HISTOGRAM_SHAPE = (len(Color), 256)
+
+
+class BitArray:
+    """Growable array of flags stored as bits"""
+
+    def __init__(self, size: int = 0) -> None:
+        self._data = np.zeros(((size + 7) // 8,), dtype=np.uint8)
+
+    def __getitem__(self, index: int) -> bool:
+        return bool(self._data[index >> 3] >> (index & 7) & 1)
+
+    def __setitem__(self, index: int, value: bool) -> None:
+        if value:
+            self._data[index >> 3] |= np.uint8(1 << (index & 7))
+        else:
+            self._data[index >> 3] &= np.uint8(~(1 << (index & 7)) & 0xff)
+
+    def resize(self, size: int) -> None:
+        """Grow or shrink to hold size bits, new bits are cleared"""
+        data = np.zeros(((size + 7) // 8,), dtype=np.uint8)
+        count = min(len(data), len(self._data))
+        data[:count] = self._data[:count]
+        self._data = data
+
+    def to_bools(self, size: int) -> np.ndarray:
+        """Get the first size bits as a bool array"""
+        return np.unpackbits(self._data, bitorder='little')[:size].astype(bool)
+
+
+class ImageInfo:
+    """View onto one image of an ImageStore"""
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'ImageStore', index: int) -> None:
+        self._store = store
+        self._index = index
+
+    @property
+    def store(self) -> 'ImageStore':
+        return self._store
+
+    @property
+    def index(self) -> int:
+        """Row of the image in its store"""
+        return self._index
+
+    @property
+    def path(self) -> Path:
+        return self._store.path(self._index)
+
+    @property
+    def error(self) -> Optional[Exception]:
+        return self._store.error(self._index)
+
+    @property
+    def features(self) -> Optional[np.ndarray]:
+        return self._store.feature(self._index)
+
+    @property
+    def histogram(self) -> Optional[RgbHistogram]:
+        """Histograms by color if the store holds histograms"""
+        row = self._store.feature(self._index)
+        if row is None or row.shape != HISTOGRAM_SHAPE:
+            return None
+        return dict(zip(Color, row))
+
+    @property
+    def checked(self) -> bool:
+        return self._store.checked(self._index)
+
+    @checked.setter
+    def checked(self, value: bool):
+        self._store.set_checked(self._index, value)
+
+    def __sub__(self, other):
+        if not isinstance(other, ImageInfo):
+            return NotImplemented
+        a = self._store.feature(self._index)
+        b = other._store.feature(other._index)
+        if a is None or b is None:
+            raise TypeError("features must be not None")
+        return distance(a, b, self._store.metric)
+
+    def __eq__(self, other):
+        return isinstance(other, ImageInfo) and other._store is self._store and other._index == self._index
+
+    def __hash__(self):
+        return hash((id(self._store), self._index))
+
+    def __repr__(self):
+        return f"ImageInfo(path={self.path!r}, error={self.error!r})"
+
+
+class ImageStore:
+    """Columnar storage of scanned images
+
+    Paths are kept in one list, file sizes and modification times in one array, features in a single contiguous
+    block, by default uint32 (n, 3, 256) histograms, and the flags as bits. ImageInfo objects are created on access
+    as views onto a row.
+    """
+
+    def __init__(self, capacity: int = 1024, shape: tuple[int, ...] = HISTOGRAM_SHAPE, dtype=np.uint32,
+                 metric: Metric = Metric.l1) -> None:
+        capacity = max(capacity, 1)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.metric = metric
+        self._paths: list[str] = []
+        self._stats = np.full((capacity, 2), -1, dtype=np.int64)
+        self._features = np.zeros((capacity,) + self.shape, dtype=self.dtype)
+        self._has_features = BitArray(capacity)
+        self._checked = BitArray(capacity)
+        self._errors: dict[int, Exception] = {}
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __getitem__(self, index: int) -> ImageInfo:
+        if index < 0 or index >= len(self._paths):
+            raise IndexError(index)
+        return ImageInfo(self, index)
+
+    def __iter__(self) -> Iterator[ImageInfo]:
+        return (ImageInfo(self, index) for index in range(len(self._paths)))
+
+    @property
+    def features(self) -> np.ndarray:
+        """Features of all images, rows of images without features are zero"""
+        return self._features[:len(self._paths)]
+
+    @property
+    def histograms(self) -> np.ndarray:
+        """(n, 3, 256) histograms of all images if the store holds histograms"""
+        return self.features
+
+    def add(self, path: Path, features: Optional[np.ndarray] = None, error: Optional[Exception] = None,
+            size: int = -1, mtime_ns: int = -1) -> int:
+        """Add an image and return its index"""
+        index = len(self._paths)
+        if index == self._features.shape[0]:
+            self._grow(2 * index)
+        self._paths.append(str(path))
+        self._stats[index] = (size, mtime_ns)
+        self._checked[index] = True
+        if features is not None:
+            self._features[index] = np.asarray(features).reshape(self.shape)
+            self._has_features[index] = True
+        if error is not None:
+            self._errors[index] = error
+        return index
+
+    def path(self, index: int) -> Path:
+        return Path(self._paths[index])
+
+    def stat(self, index: int) -> tuple[int, int]:
+        """Size and modification time in nanoseconds of the file when it was scanned"""
+        size, mtime_ns = self._stats[index]
+        return (int(size), int(mtime_ns))
+
+    def error(self, index: int) -> Optional[Exception]:
+        return self._errors.get(index)
+
+    def feature(self, index: int) -> Optional[np.ndarray]:
+        """View of the features of an image"""
+        if not self._has_features[index]:
+            return None
+        return self._features[index]
+
+    def histogram(self, index: int) -> Optional[np.ndarray]:
+        """(3, 256) histogram view of an image if the store holds histograms"""
+        return self.feature(index)
+
+    def checked(self, index: int) -> bool:
+        return self._checked[index]
+
+    def set_checked(self, index: int, value: bool) -> None:
+        self._checked[index] = value
+
+    def matrix(self, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """(n, width) feature matrix of the given images, e.g. (n, 768) for histograms
+
+        A view without copying is returned if ids are all images in order, otherwise the rows are gathered.
+        """
+        count = len(self._paths)
+        flat = self._features[:count].reshape(count, int(np.prod(self.shape)))
+        if ids is None or (len(ids) == count and np.array_equal(ids, np.arange(count))):
+            return flat
+        return flat[np.asarray(ids, dtype=np.intp)]
+
+    def _grow(self, capacity: int) -> None:
+        stats = np.full((capacity, 2), -1, dtype=np.int64)
+        stats[:len(self._stats)] = self._stats
+        self._stats = stats
+        features = np.zeros((capacity,) + self.shape, dtype=self.dtype)
+        features[:len(self._features)] = self._features
+        self._features = features
+        self._has_features.resize(capacity)
+        self._checked.resize(capacity)
@@ -0,0 +1,153 @@
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Optional
+
+# Seconds between two snapshots sent to the progress handler
+DEFAULT_INTERVAL = 0.2
+
+
+class Stage(Enum):
+    """Stages of a scan or of the deletion of images"""
+    # Finding byte-identical files
+    exact = 0
+    # Decoding images and computing their features
+    analyze = 1
+    # Comparing the features of images
+    compare = 2
+    # Decoding similar images again to verify them
+    verify = 3
+    # Deleting images
+    delete = 4
+
+
+# Unit of the items counted in a stage
+UNITS = {
+    Stage.exact: 'files',
+    Stage.analyze: 'images',
+    Stage.compare: 'pairs',
+    Stage.verify: 'images',
+    Stage.delete: 'files',
+}
+
+
+@dataclass(frozen=True)
+class ProgressSnapshot:
+    """Counters of the current stage at one point in time"""
+    stage: Stage
+    status: str
+    # Items done and the total number of items known so far, which may still grow while files are discovered
+    done: float
+    total: float
+    bytes_done: int
+    # Seconds since the stage started
+    elapsed: float
+
+    @property
+    def percent(self) -> int:
+        if self.total <= 0:
+            return 0
+        return min(int(self.done / self.total * 100), 100)
+
+    @property
+    def items_per_second(self) -> float:
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until the stage is done or None if nothing is done yet"""
+        rate = self.items_per_second
+        if rate <= 0 or self.total <= 0:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def describe(self) -> str:
+        """Human readable status line with percentage, throughput and ETA"""
+        parts = [f"{self.status} {self.percent}%"]
+        if self.done > 0:
+            parts.append(f"{self.items_per_second:,.0f} {UNITS[self.stage]}/s")
+        if self.bytes_done > 0:
+            parts.append(f"{self.bytes_per_second / 1e6:.1f} MB/s")
+        eta = self.eta
+        if eta is not None:
+            parts.append(f"ETA {format_duration(eta)}")
+        return ", ".join(parts)
+
+
+ProgressHandler = Callable[[ProgressSnapshot], Any]
+
+
+class ProgressTracker:
+    """Aggregates the counters of a running stage and sends snapshots of them to a handler at most once per interval
+
+    Counting is a few additions and a clock read, so it can be done for every image or block of pairs. The tracker is
+    used by the thread running the scan and is not thread-safe.
+    """
+
+    def __init__(self, handler: Optional[ProgressHandler] = None, interval: float = DEFAULT_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.handler = handler
+        self.interval = interval
+        self._clock = clock
+        self._stage = Stage.analyze
+        self._status = ''
+        self._done = 0.0
+        self._total = 0.0
+        self._bytes = 0
+        self._started = clock()
+        # No snapshot is due before this time
+        self._next = self._started
+        # Number of snapshots sent to the handler
+        self.emitted = 0
+
+    def start(self, stage: Stage, status: str, total: float = 0) -> None:
+        """Start a stage, its first snapshot is sent immediately"""
+        self._stage = stage
+        self._status = status
+        self._done = 0.0
+        self._total = total
+        self._bytes = 0
+        self._started = self._clock()
+        self._emit(self._started)
+
+    def advance(self, items: float = 1, bytes: int = 0, total: Optional[float] = None) -> None:
+        """Count done items and bytes, and update the total if given"""
+        self._done += items
+        self._bytes += bytes
+        if total is not None:
+            self._total = total
+        now = self._clock()
+        if now >= self._next:
+            self._emit(now)
+
+    def update(self, done: float, total: Optional[float] = None) -> None:
+        """Set the number of done items, e.g. from the share of work done"""
+        self.advance(done - self._done, total=total)
+
+    def finish(self) -> None:
+        """Send a final snapshot of the stage regardless of the interval"""
+        self._emit(self._clock())
+
+    def snapshot(self) -> ProgressSnapshot:
+        return ProgressSnapshot(stage=self._stage, status=self._status, done=self._done, total=self._total,
+                                bytes_done=self._bytes, elapsed=self._clock() - self._started)
+
+    def _emit(self, now: float) -> None:
+        self._next = now + self.interval
+        if self.handler is not None:
+            self.emitted += 1
+            self.handler(self.snapshot())
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as h:mm:ss or m:ss"""
+    seconds = int(round(seconds))
+    (hours, rest) = divmod(seconds, 3600)
+    (minutes, seconds) = divmod(rest, 60)
+    if hours > 0:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
@@ -0,0 +1,101 @@
+import os
+import threading
+from queue import Empty, Full, Queue
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+DEFAULT_QUEUE_SIZE = 64
+
+# Marks the end of the input queue for a worker and the end of a worker in the output queue
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+
+class Pipeline:
+    """Runs a function on items of an iterator in worker threads with bounded queues between the stages
+
+    A feeder thread pulls items from the source (e.g. a directory walk) into the input queue, the workers put their
+    results into the output queue and the caller consumes the results in completion order. A full queue blocks the
+    stage in front of it, so memory is bounded by the queue sizes and not by the number of items.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.queue_size = queue_size
+
+    def run(self, source: Iterable[T], work: Callable[[T], R],
+            is_cancelled: Optional[Callable[[], bool]] = None) -> Iterator[R]:
+        """Yield work(item) for every item of source in completion order"""
+        inputs: Queue = Queue(maxsize=self.queue_size)
+        outputs: Queue = Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def stopped() -> bool:
+            return stop.is_set() or (is_cancelled is not None and is_cancelled())
+
+        def put(queue: Queue, item) -> bool:
+            while not stopped():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def feed():
+            try:
+                for item in source:
+                    if not put(inputs, item):
+                        return
+            except BaseException as e:
+                put(outputs, _Failure(e))
+            for _ in range(self.workers):
+                if not put(inputs, _DONE):
+                    return
+
+        def process():
+            while not stopped():
+                try:
+                    item = inputs.get(timeout=0.1)
+                except Empty:
+                    continue
+                if item is _DONE:
+                    put(outputs, _DONE)
+                    return
+                try:
+                    result = work(item)
+                except BaseException as e:
+                    result = _Failure(e)
+                if not put(outputs, result):
+                    return
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        threads = [threading.Thread(target=process, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            running = self.workers
+            while running > 0 and not stopped():
+                try:
+                    result = outputs.get(timeout=0.1)
+                except Empty:
+                    continue
+                if result is _DONE:
+                    running -= 1
+                elif isinstance(result, _Failure):
+                    raise result.exception
+                else:
+                    yield result
+        finally:
+            # The feeder is not joined, it stops with the next item or when the source notices the cancellation
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,54 @@
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+from feature_cache import HISTOGRAM_KIND, default_cache_path
+
+
+def default_state_path(directory: Union[str, Path]) -> Path:
+    """Location of the saved scan state of a directory in the user's cache directory"""
+    key = hashlib.blake2b(str(Path(directory).absolute()).encode(), digest_size=8).hexdigest()
+    return default_cache_path().parent / 'states' / f'{key}.npz'
+
+
+@dataclass
+class ScanState:
+    """Result of a scan which allows the next scan to only compare new or changed images
+
+    The matched pairs are kept instead of the groups, so removing an image that connected two parts of a group splits
+    the group exactly like a full scan would.
+    """
+    threshold: float
+    paths: list[str]
+    sizes: np.ndarray
+    mtimes: np.ndarray
+    # (n, width) features of the images in the order of paths, e.g. (n, 768) histograms
+    histograms: np.ndarray
+    # Indices into paths and distances of all pairs below threshold
+    pairs_a: np.ndarray
+    pairs_b: np.ndarray
+    pairs_diff: np.ndarray
+    kind: str = HISTOGRAM_KIND
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Write the state to a file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so an interrupted save does not destroy the previous state
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, threshold=self.threshold, kind=self.kind, paths=np.array(self.paths, dtype=str),
+                     sizes=self.sizes, mtimes=self.mtimes, histograms=self.histograms,
+                     pairs_a=self.pairs_a, pairs_b=self.pairs_b, pairs_diff=self.pairs_diff)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'ScanState':
+        """Read a state written by save"""
+        with np.load(path) as data:
+            return cls(threshold=float(data['threshold']), kind=str(data['kind']), paths=data['paths'].tolist(),
+                       sizes=data['sizes'], mtimes=data['mtimes'], histograms=data['histograms'],
+                       pairs_a=data['pairs_a'], pairs_b=data['pairs_b'], pairs_diff=data['pairs_diff'])
@@ -0,0 +1,87 @@
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+# Files are decoded by their content, the patterns only select which files are looked at
+DEFAULT_INCLUDE = ('*.jpg', '*.jpeg', '*.jpe', '*.jfif', '*.png', '*.gif', '*.webp', '*.bmp', '*.tif', '*.tiff',
+                   '*.dng', '*.cr2', '*.nef', '*.nrw', '*.arw', '*.orf', '*.rw2', '*.pef', '*.srw', '*.raf',
+                   '*.heic', '*.heif', '*.avif')
+
+
+class Scanner:
+    """Iterative directory walker which yields image files as soon as they are found
+
+    Every file and directory is only visited once, identified by device and inode, so hard links, bind mounts and
+    symbolic link loops neither produce duplicate paths nor endless walks. Patterns are matched case-insensitively
+    against the file name and against the path relative to the root.
+    """
+
+    def __init__(self, include: Iterable[str] = DEFAULT_INCLUDE, exclude: Iterable[str] = (),
+                 follow_symlinks: bool = False) -> None:
+        self.include = tuple(pattern.lower() for pattern in include)
+        self.exclude = tuple(pattern.lower() for pattern in exclude)
+        self.follow_symlinks = follow_symlinks
+        self._found = 0
+
+    @property
+    def found(self) -> int:
+        """Number of files found by the running or last scan"""
+        return self._found
+
+    def scan(self, root: Path, is_cancelled: Optional[Callable[[], bool]] = None) -> Iterator[Path]:
+        """Walk root and yield matching files"""
+        self._found = 0
+        visited: set[tuple[int, int]] = set()
+        try:
+            stat = root.stat()
+        except OSError:
+            return
+        visited.add((stat.st_dev, stat.st_ino))
+        stack = [root]
+        while len(stack) > 0:
+            if is_cancelled is not None and is_cancelled():
+                return
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            subdirectories = []
+            for entry in entries:
+                try:
+                    if entry.is_symlink() and not self.follow_symlinks:
+                        continue
+                    is_dir = entry.is_dir()
+                    if not is_dir and not entry.is_file():
+                        continue
+                    relative = Path(entry.path).relative_to(root).as_posix().lower()
+                    if self._matches(entry.name.lower(), relative, self.exclude):
+                        continue
+                    if not is_dir and not self._matches(entry.name.lower(), relative, self.include):
+                        continue
+                    # Follows links if enabled, otherwise symbolic links were skipped above
+                    stat = entry.stat()
+                    if stat.st_ino == 0:
+                        # On Windows, DirEntry.stat leaves the device and file id empty, a full stat has them
+                        stat = os.stat(entry.path)
+                except OSError:
+                    continue
+                # File systems without file ids cannot be checked for links
+                if stat.st_ino != 0:
+                    key = (stat.st_dev, stat.st_ino)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                if is_dir:
+                    subdirectories.append(Path(entry.path))
+                else:
+                    self._found += 1
+                    yield Path(entry.path)
+            # Visit subdirectories in directory order
+            stack.extend(reversed(subdirectories))
+
+    @staticmethod
+    def _matches(name: str, relative: str, patterns: tuple[str, ...]) -> bool:
+        return any(fnmatch(name, pattern) or fnmatch(relative, pattern) for pattern in patterns)
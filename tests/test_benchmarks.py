@@ -0,0 +1,204 @@
+"""Benchmarks of every stage of DuplicateFinder.find on a synthetic corpus of near-duplicate JPEG images
+
+The corpus has 1000 images by default, DIF_BENCHMARK_IMAGES selects other sizes, e.g. 1000,10000,100000. Corpora are
+generated offline and deterministically, in a temporary directory or in DIF_BENCHMARK_CORPUS to reuse them.
+
+Recall and precision of the duplicates found are checked against tests/benchmark_baseline.json, set
+DIF_BENCHMARK_UPDATE_BASELINE=1 to rewrite it. Timings are compared with pytest-benchmark, see the README.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from distance import PivotIndex, collect_pairs, iter_coarse_pairs, iter_pairs
+from features import NormalizedHistogramExtractor, normalize_histogram, read_image, rgb_histogram
+from finder import CompareMode, DuplicateFinder, Pair
+from grouping import pair_groups
+from image_store import Color, ImageStore
+from scanner import Scanner
+
+CORPUS_VERSION = 1
+image_size = (256, 192)
+# Images per directory of the corpus
+directory_size = 1000
+sizes = [int(size) for size in os.environ.get('DIF_BENCHMARK_IMAGES', '1000').split(',')]
+# Histograms are benchmarked on this many decoded images, the pixels of large corpora do not fit into memory
+histogram_sample = 1000
+# The exhaustive comparison is quadratic and takes hours at 100k images
+exhaustive_limit = 10_000
+# The histograms of the small synthetic images are coarser than those of photos. Near-duplicates are at most 0.09
+# apart, other images at least 0.12 at 3000 images and closer in larger corpora.
+threshold = 0.1
+# Recall and precision may drop this much below the baseline
+quality_tolerance = 0.01
+baseline_path = Path(__file__).parent / 'benchmark_baseline.json'
+
+
+def rounds(size):
+    return max(3000 // size, 1)
+
+
+def near_duplicate(image, kind, rng):
+    """Copy of an image which is resized, re-encoded at a lower quality or shifted in color"""
+    if kind == 0:
+        scale = rng.uniform(0.5, 0.9)
+        return image.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR), 90
+    if kind == 1:
+        return image, int(rng.integers(50, 76))
+    shift = rng.integers(-2, 3, (1, 1, len(Color)))
+    return Image.fromarray(np.clip(np.asarray(image).astype(np.int16) + shift, 0, 255).astype(np.uint8)), 90
+
+
+def write_corpus(path, size):
+    """Write size images, every other original with a near-duplicate, and return the groups of duplicate names"""
+    rng = np.random.default_rng(size)
+    groups = []
+    count = 0
+    while count < size:
+        directory = f"{count // directory_size:03}"
+        (path / directory).mkdir(exist_ok=True)
+        base = Image.fromarray(rng.integers(0, 256, (3, 4, 3), dtype=np.uint8)).resize(image_size, Image.BICUBIC)
+        pixels = np.asarray(base).astype(np.int16) + rng.integers(-10, 11, (image_size[1], image_size[0], 3))
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        name = f"{directory}/{count}.jpg"
+        image.save(path / name, quality=90)
+        count += 1
+        if count % 3 == 1 and count < size:
+            (copy, quality) = near_duplicate(image, count // 3 % 3, rng)
+            copy_name = f"{directory}/{count - 1}_copy.jpg"
+            copy.save(path / copy_name, quality=quality)
+            groups.append([name, copy_name])
+            count += 1
+    return groups
+
+
+@pytest.fixture(scope="module", params=sizes, ids=lambda size: f"{size}_images")
+def corpus(request, tmp_path_factory):
+    """Directory of the corpus and the groups of duplicate paths"""
+    size = request.param
+    root = os.environ.get('DIF_BENCHMARK_CORPUS')
+    path = Path(root) / str(size) if root is not None else tmp_path_factory.mktemp(f"corpus{size}")
+    manifest_path = path / 'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else None
+    if manifest is None or manifest['version'] != CORPUS_VERSION:
+        path.mkdir(parents=True, exist_ok=True)
+        manifest = {'version': CORPUS_VERSION, 'groups': write_corpus(path, size)}
+        manifest_path.write_text(json.dumps(manifest))
+    groups = [{(path / name).absolute() for name in group} for group in manifest['groups']]
+    return (path, size, groups)
+
+
+@pytest.fixture(scope="module")
+def paths(corpus):
+    (path, _, _) = corpus
+    return sorted(Scanner().scan(path))
+
+
+@pytest.fixture(scope="module")
+def features(paths):
+    extractor = NormalizedHistogramExtractor()
+    matrix = np.stack([extractor.extract(path).reshape(-1) for path in paths])
+    return (matrix, extractor.distance_threshold(threshold))
+
+
+def duplicate_pairs(groups):
+    return {frozenset((a, b)) for group in groups for a in group for b in group if a < b}
+
+
+def test_discovery(benchmark, corpus):
+    (path, size, _) = corpus
+    found = benchmark.pedantic(lambda: sum(1 for _ in Scanner().scan(path)), rounds=rounds(size))
+    benchmark.extra_info['images'] = size
+    assert found == size
+
+
+def test_decoding(benchmark, corpus, paths):
+    (_, size, _) = corpus
+
+    def decode():
+        # Pixels are dropped right away, all of them do not fit into memory
+        for path in paths:
+            read_image(path)
+
+    benchmark.pedantic(decode, rounds=rounds(size))
+    benchmark.extra_info['images'] = size
+
+
+def test_histograms(benchmark, paths):
+    sample = [np.ascontiguousarray(read_image(path)[0]).reshape(-1, len(Color)) for path in paths[:histogram_sample]]
+    histograms = benchmark(lambda: [normalize_histogram(rgb_histogram(pixels)) for pixels in sample])
+    benchmark.extra_info['images'] = len(sample)
+    assert histograms[0].shape == (len(Color), 256)
+
+
+@pytest.mark.parametrize("mode", list(CompareMode))
+def test_comparison(benchmark, corpus, features, mode):
+    (_, size, _) = corpus
+    (matrix, limit) = features
+    if mode == CompareMode.exact and size > exhaustive_limit:
+        pytest.skip(f"exhaustive comparison of more than {exhaustive_limit} images")
+    if mode == CompareMode.indexed:
+        compare = lambda: PivotIndex(matrix).pairs(limit)
+    elif mode == CompareMode.coarse:
+        compare = lambda: collect_pairs(iter_coarse_pairs(matrix, limit))
+    else:
+        compare = lambda: collect_pairs(iter_pairs(matrix, limit))
+    (a, _, _) = benchmark.pedantic(compare, rounds=rounds(size))
+    benchmark.extra_info['images'] = size
+    benchmark.extra_info['pairs'] = len(a)
+
+
+@pytest.fixture(scope="module")
+def pairs(paths, features):
+    (matrix, limit) = features
+    store = ImageStore(capacity=len(paths), shape=matrix.shape[1:], dtype=matrix.dtype)
+    for path, row in zip(paths, matrix):
+        store.add(path, row)
+    (a, b, diff) = PivotIndex(matrix).pairs(limit)
+    return (store, a, b, diff)
+
+
+def test_get_groups(benchmark, pairs):
+    (store, a, b, diff) = pairs
+    finder = DuplicateFinder()
+    image_pairs = [Pair(store[i], store[j], d) for i, j, d in zip(a.tolist(), b.tolist(), diff.tolist())]
+    groups = benchmark(finder.get_groups, image_pairs)
+    benchmark.extra_info['pairs'] = len(image_pairs)
+    assert sum(len(group) for group in groups) <= len(store)
+
+
+def test_pair_groups(benchmark, pairs):
+    (_, a, b, _) = pairs
+    groups = benchmark(pair_groups, a, b)
+    benchmark.extra_info['pairs'] = len(a)
+    assert len(groups) <= len(a)
+
+
+def test_find_quality(benchmark, corpus):
+    """Time the whole scan and check recall and precision of the found duplicates against the baseline"""
+    (path, size, expected) = corpus
+    # A new finder per round, the state of a previous scan would skip every unchanged image
+    find = lambda: DuplicateFinder(mode=CompareMode.indexed).find(str(path), threshold)
+    (groups, failed) = benchmark.pedantic(find, rounds=rounds(size))
+    assert failed == []
+
+    expected_pairs = duplicate_pairs(expected)
+    found_pairs = duplicate_pairs([{image.path.absolute() for image in group} for group in groups])
+    correct = len(found_pairs & expected_pairs)
+    quality = {'recall': round(correct / max(len(expected_pairs), 1), 4),
+               'precision': round(correct / max(len(found_pairs), 1), 4)}
+    benchmark.extra_info.update(quality, images=size)
+
+    baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if os.environ.get('DIF_BENCHMARK_UPDATE_BASELINE') == '1':
+        baselines[str(size)] = quality
+        baseline_path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+    baseline = baselines.get(str(size))
+    if baseline is None:
+        pytest.skip(f"no baseline for {size} images")
+    for measure, value in quality.items():
+        assert value >= baseline[measure] - quality_tolerance, f"{measure} dropped from {baseline[measure]} to {value}"
@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import cli
+from cli import main
+from test_scan_state import threshold, write_corpus
+
+
+def test_scan_ndjson(tmp_path, capsys):
+    write_corpus(tmp_path, 9)
+    assert main(['scan', str(tmp_path), '--threshold', str(threshold), '--no-cache']) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    groups = sorted(sorted(image['path'].rsplit('/', 1)[-1] for image in line['images']) for line in lines)
+    assert groups == [['0.jpg', '0_copy.jpg'], ['3.jpg', '3_copy.jpg'], ['6.jpg', '6_copy.jpg']]
+    assert all(sum(not image['checked'] for image in line['images']) == 1 for line in lines)
+
+
+def test_scan_empty_directory(tmp_path, capsys):
+    assert main(['scan', str(tmp_path), '--no-cache', '--quiet']) == 0
+    assert capsys.readouterr().out == ''
+
+
+def test_scan_json_and_csv(tmp_path, capsys):
+    write_corpus(tmp_path, 4)
+    output = tmp_path.parent / "groups.json"
+    assert main(['scan', str(tmp_path), '--threshold', str(threshold), '--no-cache', '--quiet',
+                 '--format', 'json', '--output', str(output)]) == 0
+    document = json.loads(output.read_text())
+    assert len(document['groups']) == 2 and document['failed'] == []
+
+    assert main(['scan', str(tmp_path), '--threshold', str(threshold), '--no-cache', '--quiet', '--format', 'csv']) == 0
+    rows = capsys.readouterr().out.splitlines()
+    assert rows[0] == 'group,path,checked' and len(rows) == 5
+
+
+def test_cli_does_not_import_tkinter():
+    code = "import sys, cli; assert 'tkinter' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], cwd=Path(cli.__file__).parent, check=True)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from distance import l1_pairs
+from features import read_histogram
+
+num_originals = 12
+image_size = (1600, 1200)
+decode_sizes = [None, 400, 150]
+# Decoding at 1/8 scale averages away the pixel noise, which shifts near-duplicates apart under a tight threshold
+lossless_decode_sizes = [None, 400]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    """Detailed photos with a recompressed and slightly brightened copy of each"""
+    path = tmp_path_factory.mktemp("decode")
+    rng = np.random.default_rng(3)
+    paths = []
+    for k in range(num_originals):
+        base = Image.fromarray(rng.integers(0, 256, (9, 12, 3), dtype=np.uint8)).resize(image_size, Image.BICUBIC)
+        pixels = np.asarray(base).astype(np.int16) + rng.integers(-10, 11, (image_size[1], image_size[0], 3))
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        image.save(path / f"{k}.jpg", quality=92)
+        Image.fromarray(np.clip(pixels + 3, 0, 255).astype(np.uint8)).save(path / f"{k}_copy.jpg", quality=75)
+        paths += [path / f"{k}.jpg", path / f"{k}_copy.jpg"]
+    return paths
+
+
+def test_reduced_decode_accuracy(corpus):
+    """Measure histogram error and duplicate recall of reduced decoding compared with full decoding"""
+    histograms = {size: np.stack([read_histogram(path, size).reshape(-1) for path in corpus])
+                  for size in decode_sizes}
+    full = histograms[None]
+    duplicates = {(2 * k, 2 * k + 1) for k in range(num_originals)}
+
+    # Threshold halfway between the farthest duplicates and the nearest other images of the full decode
+    diffs = np.abs(full[:, None, :] - full[None, :, :]).sum(axis=2)
+    duplicate_max = max(diffs[pair] for pair in duplicates)
+    others_min = min(diffs[i, j] for i in range(len(corpus)) for j in range(i + 1, len(corpus))
+                     if (i, j) not in duplicates)
+    assert duplicate_max < others_min
+    threshold = (duplicate_max + others_min) // 2
+
+    for size in decode_sizes:
+        error = np.mean(np.abs(histograms[size] - full).sum(axis=1) / (2 * full.sum(axis=1)))
+        found = set(zip(*(ids.tolist() for ids in l1_pairs(histograms[size], threshold)[:2])))
+        recall = len(found & duplicates) / len(duplicates)
+        precision = len(found & duplicates) / max(len(found), 1)
+        measured = f"decode_size={size}: histogram error {error:.2%}, recall {recall:.2%}, precision {precision:.2%}"
+        assert error < 0.05, measured
+        if size in lossless_decode_sizes:
+            assert recall == 1.0, measured
+            assert precision == 1.0, measured
+
+
+@pytest.mark.parametrize("decode_size", decode_sizes)
+def test_decode_histogram(benchmark, corpus, decode_size):
+    benchmark(read_histogram, corpus[0], decode_size)
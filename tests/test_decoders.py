@@ -0,0 +1,131 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from decoders import UnsupportedFormatError, open_image, tiff_previews
+from features import (NORMALIZED_TOTAL, HashExtractor, NormalizedHistogramExtractor, normalize_histogram,
+                      read_histogram, rgb_histogram)
+from finder import DuplicateFinder
+
+
+def photo(seed=0, size=(64, 48)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize(size, Image.BILINEAR)
+
+
+def reference_histogram(image):
+    return rgb_histogram(np.asarray(image.convert('RGB')).reshape(-1, 3))
+
+
+def test_color_modes(tmp_path):
+    image = photo()
+    image.quantize(64).save(tmp_path / "palette.png")
+    image.convert('L').save(tmp_path / "gray.jpg")
+    image.convert('CMYK').save(tmp_path / "cmyk.jpg")
+    image.convert('RGBA').save(tmp_path / "rgba.png")
+    Image.fromarray((np.asarray(image.convert('L')).astype(np.uint16) * 257)).save(tmp_path / "gray16.png")
+    # Formats are detected by content, not by extension
+    image.save(tmp_path / "png.jpg", format='PNG')
+
+    for name in ["palette.png", "gray.jpg", "rgba.png", "png.jpg"]:
+        with Image.open(tmp_path / name) as expected:
+            assert np.array_equal(read_histogram(tmp_path / name), reference_histogram(expected)), name
+    for name in ["cmyk.jpg", "gray16.png"]:
+        histogram = read_histogram(tmp_path / name)
+        assert histogram.shape == (3, 256) and np.all(histogram.sum(axis=1) == 64 * 48), name
+    with Image.open(tmp_path / "gray16.png") as gray16:
+        assert gray16.mode.startswith('I')
+        assert np.array_equal(read_histogram(tmp_path / "gray16.png")[0], np.bincount(
+            np.asarray(image.convert('L')).ravel(), minlength=256))
+
+
+def write_tiff_with_preview(path, preview: bytes, order='<'):
+    """Minimal TIFF whose first IFD only references a JPEG preview, like the thumbnail IFD of RAW files"""
+    magic = b'II*\x00' if order == '<' else b'MM\x00*'
+    entries = [(0x0201, 4, 1, 8 + 2 + 2 * 12 + 4), (0x0202, 4, 1, len(preview))]
+    ifd = struct.pack(order + 'H', len(entries))
+    ifd += b''.join(struct.pack(order + 'HHII', *entry) for entry in entries) + struct.pack(order + 'I', 0)
+    path.write_bytes(magic + struct.pack(order + 'I', 8) + ifd + preview)
+
+
+@pytest.mark.parametrize("order", ['<', '>'])
+def test_raw_preview(tmp_path, order):
+    photo().save(tmp_path / "preview.jpg", quality=90)
+    preview = (tmp_path / "preview.jpg").read_bytes()
+    write_tiff_with_preview(tmp_path / "image.nef", preview, order)
+    with open(tmp_path / "image.nef", 'rb') as file:
+        assert tiff_previews(file) == [(38, len(preview))]
+    assert np.array_equal(read_histogram(tmp_path / "image.nef"), read_histogram(tmp_path / "preview.jpg"))
+
+    # Fujifilm RAF
+    header = b'FUJIFILMCCD-RAW 0201FF383501'.ljust(84, b'\x00') + struct.pack('>II', 100, len(preview))
+    (tmp_path / "image.raf").write_bytes(header.ljust(100, b'\x00') + preview)
+    assert np.array_equal(read_histogram(tmp_path / "image.raf"), read_histogram(tmp_path / "preview.jpg"))
+
+
+def test_undecodable_files_are_reported(tmp_path):
+    photo().save(tmp_path / "good.jpg")
+    (tmp_path / "broken.jpg").write_bytes(b'\xff\xd8\xff' + b'\x00' * 100)
+    (tmp_path / "image.heic").write_bytes(b'\x00\x00\x00\x18ftypheic' + b'\x00' * 100)
+    with pytest.raises(UnsupportedFormatError):
+        open_image(tmp_path / "image.heic")
+
+    (groups, failed) = DuplicateFinder().find(str(tmp_path))
+    assert sorted(image.path.name for image in failed) == ["broken.jpg", "image.heic"]
+    assert all(image.error is not None for image in failed)
+
+
+def exif_with_thumbnail(thumbnail: Image.Image) -> bytes:
+    """EXIF data of a camera JPEG: an empty IFD0 and an IFD1 referencing a JPEG thumbnail"""
+    data = io.BytesIO()
+    thumbnail.save(data, format='JPEG', quality=90)
+    ifd1 = 8 + 6
+    entries = [(0x0201, 4, 1, ifd1 + 2 + 2 * 12 + 4), (0x0202, 4, 1, len(data.getvalue()))]
+    tiff = b'II*\x00' + struct.pack('<I', 8) + struct.pack('<HI', 0, ifd1)
+    tiff += struct.pack('<H', len(entries)) + b''.join(struct.pack('<HHII', *entry) for entry in entries)
+    return b'Exif\x00\x00' + tiff + struct.pack('<I', 0) + data.getvalue()
+
+
+def test_exif_thumbnail(tmp_path):
+    image = photo(size=(600, 400))
+    # Cameras letterbox thumbnails of 3:2 images to 160x120
+    letterboxed = Image.new('RGB', (160, 120))
+    letterboxed.paste(image.resize((160, 107)), (0, 6))
+    image.save(tmp_path / "camera.jpg", exif=exif_with_thumbnail(letterboxed))
+
+    thumbnail, scale = open_image(tmp_path / "camera.jpg", thumbnail=True)
+    assert thumbnail.size == (160, 107)
+    assert scale == pytest.approx(600 * 400 / (160 * 107))
+    assert open_image(tmp_path / "camera.jpg")[0].size == (600, 400)
+    # Images without a thumbnail are decoded
+    image.save(tmp_path / "plain.jpg")
+    assert open_image(tmp_path / "plain.jpg", thumbnail=True)[0].size == (600, 400)
+
+    # The black bars are not counted
+    histogram = normalize_histogram(read_histogram(tmp_path / "camera.jpg", thumbnail=True))
+    full = normalize_histogram(read_histogram(tmp_path / "camera.jpg"))
+    assert np.abs(histogram.astype(np.int64) - full).sum() < 0.1 * 6 * NORMALIZED_TOTAL
+
+
+def test_thumbnail_candidates_are_verified(tmp_path):
+    first = photo(1, (480, 320))
+    other = photo(2, (480, 320))
+    first.save(tmp_path / "first.jpg", exif=exif_with_thumbnail(first.resize((160, 107))))
+    first.save(tmp_path / "first_copy.jpg", quality=80, exif=exif_with_thumbnail(first.resize((160, 107))))
+    # An edited image whose thumbnail was not updated
+    other.save(tmp_path / "edited.jpg", exif=exif_with_thumbnail(first.resize((160, 107))))
+
+    def find(extractor, verify=True):
+        finder = DuplicateFinder(extractor=extractor, verify=verify)
+        (groups, failed) = finder.find(str(tmp_path), threshold=0.1)
+        assert failed == []
+        return sorted(sorted(image.path.name for image in group) for group in groups)
+
+    assert find(NormalizedHistogramExtractor()) == [["first.jpg", "first_copy.jpg"]]
+    assert find(NormalizedHistogramExtractor(thumbnails=True), verify=False) == \
+        [["edited.jpg", "first.jpg", "first_copy.jpg"]]
+    assert find(NormalizedHistogramExtractor(thumbnails=True)) == [["first.jpg", "first_copy.jpg"]]
+    assert find(HashExtractor(thumbnails=True)) == [["first.jpg", "first_copy.jpg"]]
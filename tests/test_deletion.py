@@ -0,0 +1,154 @@
+import json
+import os
+
+import pytest
+
+from cli import main
+from deletion import (Action, DeletionEngine, Journal, JournalMismatch, Operation, journal_header,
+                      operations_from_groups, quarantine_path, replace_with_reflink)
+from metrics import ProgressTracker
+
+
+def write_files(tmp_path, count, directories=4):
+    paths = []
+    for k in range(count):
+        directory = tmp_path / f"d{k % directories}"
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{k}.jpg"
+        path.write_bytes(b'image' * 10)
+        paths.append(path)
+    return paths
+
+
+def test_delete(tmp_path):
+    paths = write_files(tmp_path, 300)
+    snapshots = []
+    engine = DeletionEngine(workers=4, batch_size=16)
+    result = engine.run([Operation(path) for path in paths] + [Operation(tmp_path / "missing.jpg")],
+                        ProgressTracker(snapshots.append))
+    assert sorted(result.succeeded) == sorted(paths)
+    assert [path for path, _ in result.failed] == [tmp_path / "missing.jpg"]
+    assert not any(path.exists() for path in paths)
+    assert snapshots[-1].done == 301
+
+
+def test_quarantine(tmp_path):
+    paths = write_files(tmp_path / "photos", 3)
+    quarantine = tmp_path / "quarantine"
+    result = DeletionEngine(Action.quarantine, quarantine=quarantine).run(Operation(path) for path in paths)
+    assert len(result.succeeded) == 3
+    for path in paths:
+        assert not path.exists()
+        assert quarantine_path(path, quarantine).read_bytes() == b'image' * 10
+    assert str(quarantine_path(paths[0], quarantine)).startswith(str(quarantine))
+    with pytest.raises(ValueError):
+        DeletionEngine(Action.quarantine)
+
+
+def test_hardlink(tmp_path):
+    (kept, copy, other) = (tmp_path / "kept.jpg", tmp_path / "copy.jpg", tmp_path / "other.jpg")
+    kept.write_bytes(b'same')
+    copy.write_bytes(b'same')
+    other.write_bytes(b'diff')
+    result = DeletionEngine(Action.hardlink).run([Operation(copy, kept), Operation(other, kept)])
+    assert result.succeeded == [copy]
+    assert os.path.samefile(kept, copy)
+    # Files with another content are never replaced
+    assert [path for path, _ in result.failed] == [other]
+    assert other.read_bytes() == b'diff'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["copy.jpg", "kept.jpg", "other.jpg"]
+
+
+def test_reflink(tmp_path):
+    (kept, copy) = (tmp_path / "kept.jpg", tmp_path / "copy.jpg")
+    kept.write_bytes(b'same')
+    copy.write_bytes(b'same')
+    try:
+        replace_with_reflink(copy, kept)
+    except OSError:
+        # The file system of the tests has no reflinks, the copy stays untouched
+        assert copy.read_bytes() == b'same'
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["copy.jpg", "kept.jpg"]
+    else:
+        assert copy.read_bytes() == b'same' and not os.path.samefile(kept, copy)
+
+
+def test_resume_from_journal(tmp_path):
+    paths = write_files(tmp_path / "photos", 10)
+    journal = tmp_path / "deletion.journal"
+    # An interrupted run which deleted the first four files
+    interrupted = Journal(journal, Action.delete, operations=[Operation(path) for path in paths])
+    for path in paths[:4]:
+        path.unlink()
+        interrupted.record(path)
+    interrupted.close()
+    with open(journal, 'a') as file:
+        file.write('{"path": "torn')
+
+    with pytest.raises(JournalMismatch):
+        DeletionEngine(Action.hardlink, journal=journal).run([])
+    # A run of other files with the same action does not skip the files of the journal
+    other = [Operation(path) for path in paths[:5]]
+    assert not DeletionEngine(journal=journal).can_resume(other)
+    with pytest.raises(JournalMismatch):
+        DeletionEngine(journal=journal).run(other)
+    # The order of the operations does not matter
+    assert DeletionEngine(journal=journal).can_resume(Operation(path) for path in reversed(paths))
+    result = DeletionEngine(journal=journal).run(Operation(path) for path in paths)
+    assert result.skipped == paths[:4]
+    assert sorted(result.succeeded) == sorted(paths[4:])
+    assert result.failed == []
+    # Complete runs remove their journal
+    assert not journal.exists()
+
+
+def test_cancel(tmp_path):
+    paths = write_files(tmp_path, 200, directories=1)
+    journal = tmp_path / "deletion.journal"
+    cancelled = []
+
+    def is_cancelled():
+        return len(cancelled) > 0
+
+    def on_progress(snapshot):
+        if snapshot.done >= 10:
+            cancelled.append(True)
+
+    result = DeletionEngine(workers=1, batch_size=10, journal=journal).run(
+        (Operation(path) for path in paths), ProgressTracker(on_progress, interval=0), is_cancelled)
+    assert 10 <= len(result.succeeded) < 200
+    # The journal is kept for the next run
+    lines = journal.read_text().splitlines()
+    assert json.loads(lines[0]) == journal_header(Action.delete, None, [Operation(path) for path in paths])
+    assert len(lines) == 1 + len(result.succeeded)
+
+
+def test_operations_from_groups(tmp_path):
+    groups = [[(tmp_path / "a", False), (tmp_path / "b", True), (tmp_path / "c", True)], [(tmp_path / "d", True)]]
+    assert operations_from_groups(groups) == [Operation(tmp_path / "b", tmp_path / "a"),
+                                              Operation(tmp_path / "c", tmp_path / "a"),
+                                              Operation(tmp_path / "d", None)]
+
+
+@pytest.mark.parametrize("format", ['ndjson', 'json', 'csv'])
+def test_cli_delete(tmp_path, format):
+    (kept, copy) = (tmp_path / "kept.jpg", tmp_path / "copy.jpg")
+    kept.write_bytes(b'same')
+    copy.write_bytes(b'same')
+    images = [{'path': str(kept), 'checked': False}, {'path': str(copy), 'checked': True}]
+    groups = tmp_path / f"groups.{format}"
+    if format == 'ndjson':
+        groups.write_text(json.dumps({'group': 0, 'images': images}) + '\n')
+    elif format == 'json':
+        groups.write_text(json.dumps({'groups': [images], 'failed': []}))
+    else:
+        groups.write_text(f"group,path,checked\n0,{kept},0\n0,{copy},1\n")
+    journal = tmp_path / "deletion.journal"
+    assert main(['delete', str(groups), '--action', 'hardlink', '--journal', str(journal), '--quiet']) == 0
+    assert os.path.samefile(kept, copy)
+    assert main(['delete', str(groups), '--action', 'quarantine', '--quiet']) == 2
+
+    # An interrupted run of other groups keeps its journal
+    Journal(journal, Action.delete, operations=[Operation(tmp_path / "other.jpg")]).close()
+    assert main(['delete', str(groups), '--action', 'delete', '--journal', str(journal), '--quiet']) == 2
+    assert copy.exists() and journal.exists()
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from distance import (OnlineIndex, PivotIndex, coarse_histograms, collect_pairs, iter_coarse_cross_pairs,
+                      iter_coarse_pairs, iter_l1_cross_pairs, l1_pairs)
+from features import normalize_histogram, rgb_histogram
+from finder import CompareMode, DuplicateFinder
+
+num_images = 2_000
+num_originals = 500
+threshold = 20_000
+
+
+def corpus_generator(seed=0):
+    """Histograms of originals and noisy near-duplicates of some of them"""
+    rng = np.random.default_rng(seed)
+    originals = rng.multinomial(200_000, rng.dirichlet(np.ones(768) * 0.3, size=num_originals).mean(axis=0),
+                                size=num_originals)
+    originals += rng.integers(0, 2_000, size=originals.shape)
+    copies = originals[rng.integers(0, num_originals, size=num_images - num_originals)]
+    copies = copies + rng.integers(-15, 16, size=copies.shape)
+    return np.concatenate([originals, np.maximum(copies, 0)]).astype(np.int64)
+
+
+def photo_corpus_generator(count=num_images, seed=0):
+    """Normalized histograms of smooth photo-like images, a quarter of them noisy copies"""
+    rng = np.random.default_rng(seed)
+    histograms = []
+    originals = []
+    for k in range(count):
+        if k % 4 == 3:
+            pixels = originals[rng.integers(0, len(originals))].astype(np.int16) + rng.integers(-1, 2, (120, 160, 3))
+            pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+        else:
+            # Photos differ in their palette, not only in noise
+            palette = rng.dirichlet(np.ones(3)) * rng.uniform(60, 255)
+            base = rng.integers(0, 256, (6, 8, 3)) * palette / 255 + rng.uniform(0, 255 - palette.max())
+            pixels = np.asarray(Image.fromarray(base.astype(np.uint8)).resize((160, 120), Image.BILINEAR))
+            # Texture
+            pixels = np.clip(pixels + rng.integers(-8, 9, pixels.shape), 0, 255).astype(np.uint8)
+            originals.append(pixels)
+        histograms.append(normalize_histogram(rgb_histogram(pixels.reshape(-1, 3))).reshape(-1))
+    return np.stack(histograms)
+
+
+def as_set(pairs):
+    return set(zip(pairs[0].tolist(), pairs[1].tolist()))
+
+
+def test_l1_pairs_matches_brute_force():
+    matrix = corpus_generator()[:300]
+    diffs = np.abs(matrix[:, None, :] - matrix[None, :, :]).sum(axis=2)
+    i, j = np.nonzero(np.triu(diffs < threshold, k=1))
+    pairs = l1_pairs(matrix, threshold, block_size=64)
+    assert as_set(pairs) == set(zip(i.tolist(), j.tolist()))
+    assert np.array_equal(pairs[2], diffs[pairs[0], pairs[1]])
+
+
+def test_coarse_pairs_match_exhaustive():
+    matrix = corpus_generator()[:600]
+    expected = l1_pairs(matrix, threshold, block_size=64)
+    pairs = collect_pairs(iter_coarse_pairs(matrix, threshold, block_size=64))
+    assert as_set(pairs) == as_set(expected)
+    assert np.array_equal(pairs[2], expected[2])
+    cross = collect_pairs(iter_coarse_cross_pairs(matrix[:200], matrix[200:], threshold, block_size=64))
+    assert as_set(cross) == as_set(collect_pairs(iter_l1_cross_pairs(matrix[:200], matrix[200:], threshold)))
+
+
+def test_pivot_index_recall():
+    matrix = corpus_generator()
+    expected = as_set(l1_pairs(matrix, threshold))
+    found = as_set(PivotIndex(matrix).pairs(threshold, block_size=128))
+    assert len(expected) > 0
+    recall = len(expected & found) / len(expected)
+    assert recall == 1.0
+    assert found <= expected
+
+
+@pytest.mark.parametrize("pivots", [0, 4])
+def test_online_index_matches_exhaustive(pivots):
+    matrix = corpus_generator()[:1_000]
+    expected = as_set(l1_pairs(matrix, threshold))
+    index = OnlineIndex(matrix.shape[1], pivots=pivots, capacity=16)
+    found = set()
+    for row, vector in enumerate(matrix):
+        ids, diffs = index.query(vector, threshold)
+        found.update((int(i), row) for i in ids)
+        assert index.add(vector) == row
+    assert found == expected
+
+
+def test_find_indexed_matches_exact(tmp_path):
+    rng = np.random.default_rng(1)
+    for k in range(40):
+        image = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize((160, 120), Image.BILINEAR)
+        image.save(tmp_path / f"{k}.jpg", quality=95)
+        if k % 4 == 0:
+            image.save(tmp_path / f"{k}_copy.jpg", quality=85)
+
+    def find(mode, streaming=False, processes=False):
+        finder = DuplicateFinder(mode=mode, streaming=streaming, processes=processes, workers=2)
+        groups, failed = finder.find(str(tmp_path), threshold=0.1)
+        assert failed == []
+        return sorted(sorted(image.path.name for image in group) for group in groups)
+
+    expected = find(CompareMode.exact)
+    assert len(expected) > 0
+    assert find(CompareMode.indexed) == expected
+    assert find(CompareMode.coarse) == expected
+    assert find(CompareMode.exact, streaming=True) == expected
+    assert find(CompareMode.indexed, streaming=True) == expected
+    assert find(CompareMode.exact, processes=True) == expected
+
+
+def test_exact_l1_pairs(benchmark):
+    matrix = corpus_generator()
+    benchmark(l1_pairs, matrix, threshold)
+
+
+def test_indexed_l1_pairs(benchmark):
+    matrix = corpus_generator()
+    benchmark(lambda: PivotIndex(matrix).pairs(threshold))
+
+
+def test_coarse_prune_rate():
+    """Measure how many pairs of photo-like histograms the coarse bound rejects"""
+    matrix = photo_corpus_generator()
+    limit = int(0.05 * 6 * 65535)
+    coarse = coarse_histograms(matrix)
+    bounds = np.abs(coarse[:, None, :] - coarse[None, :, :]).sum(axis=2)
+    i, j = np.triu_indices(len(matrix), k=1)
+    prune_rate = np.mean(bounds[i, j] >= limit)
+    assert prune_rate > 0.9, f"coarse bound prunes only {prune_rate:.2%} of {len(i)} pairs"
+    expected = as_set(l1_pairs(matrix, limit))
+    assert len(expected) > 0
+    assert as_set(collect_pairs(iter_coarse_pairs(matrix, limit))) == expected
+
+
+@pytest.mark.parametrize("coarse", [False, True])
+def test_photo_l1_pairs(benchmark, coarse):
+    matrix = photo_corpus_generator()
+    limit = int(0.05 * 6 * 65535)
+    if coarse:
+        benchmark(lambda: collect_pairs(iter_coarse_pairs(matrix, limit)))
+    else:
+        benchmark(l1_pairs, matrix, limit)
@@ -0,0 +1,57 @@
+import os
+import shutil
+
+import pytest
+
+from exact import exact_duplicates
+from finder import DuplicateFinder
+from scan_state import ScanState
+from test_scan_state import group_names, threshold, write_corpus
+
+
+def test_exact_duplicates(tmp_path):
+    contents = {
+        'a': b'x' * 10_000,
+        'a_copy': b'x' * 10_000,
+        # Same size and edges, different middle
+        'a_middle': b'x' * 5_000 + b'y' + b'x' * 4_999,
+        'b': b'small',
+        'b_copy': b'small',
+        'c': b'other',
+        'empty': b'',
+        'empty_copy': b'',
+    }
+    for name, content in contents.items():
+        (tmp_path / name).write_bytes(content)
+    paths = [tmp_path / name for name in contents]
+    sizes = [len(content) for content in contents.values()]
+
+    assert exact_duplicates(paths, sizes, edge_size=1024) == [[0, 1], [3, 4]]
+    # Buckets without candidates are not read
+    assert exact_duplicates(paths, sizes, candidates=[False] * 3 + [True] + [False] * 4) == [[3, 4]]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_find_with_exact_duplicates(tmp_path, streaming):
+    write_corpus(tmp_path, 12)
+    for k in (1, 4):
+        shutil.copy(tmp_path / f"{k}.jpg", tmp_path / f"{k}_exact.jpg")
+    shutil.copy(tmp_path / "0.jpg", tmp_path / "0_exact.jpg")
+
+    finder = DuplicateFinder(exact_duplicates=True, streaming=streaming)
+    (groups, failed) = finder.find(str(tmp_path), threshold=threshold)
+    (full_groups, _) = DuplicateFinder().find(str(tmp_path), threshold=threshold)
+    assert failed == []
+    assert group_names(groups) == group_names(full_groups)
+    assert ["1.jpg", "1_exact.jpg"] in group_names(groups)
+    # Copies are not decoded and not part of the state
+    assert len(finder.state.paths) == len(list(tmp_path.iterdir())) - 3
+
+    # Removing a representative keeps its copy in its groups
+    finder.state.save(tmp_path.parent / "state.npz")
+    os.remove(tmp_path / "0.jpg")
+    incremental = DuplicateFinder(state=ScanState.load(tmp_path.parent / "state.npz"), exact_duplicates=True)
+    (groups, _) = incremental.find(str(tmp_path), threshold=threshold)
+    (full_groups, _) = DuplicateFinder().find(str(tmp_path), threshold=threshold)
+    assert group_names(groups) == group_names(full_groups)
+    assert ["0_copy.jpg", "0_exact.jpg"] in group_names(groups)
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+from feature_cache import FeatureCache
+
+
+def test_feature_cache_invalidation(tmp_path):
+    image = tmp_path / "images" / "a.jpg"
+    image.parent.mkdir()
+    image.write_bytes(b"abc")
+    features = np.arange(768, dtype=np.int64).reshape(3, 256)
+
+    with FeatureCache(tmp_path / "cache.sqlite") as cache:
+        assert cache.get(image) is None
+        cache.put(image, features)
+        assert np.array_equal(cache.get(image), features)
+
+        # Changed modification time makes the row stale
+        os.utime(image, ns=(0, 0))
+        assert cache.get(image) is None
+        assert len(cache) == 0
+
+
+def test_feature_cache_content_hash_and_prune(tmp_path):
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"abc")
+    features = np.ones((3, 256), dtype=np.int64)
+
+    with FeatureCache(tmp_path / "cache.sqlite", content_hash=True) as cache:
+        cache.put(image, features)
+        os.utime(image, ns=(0, 0))
+        assert np.array_equal(cache.get(image), features)
+
+        image.unlink()
+        assert cache.prune() == 1
+        assert len(cache) == 0
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from distance import Metric, collect_pairs, iter_pairs
+from features import (NORMALIZED_TOTAL, HashAlgorithm, HashExtractor, HistogramExtractor, NormalizedHistogramExtractor,
+                      average_hash, dct_hash, difference_hash, pack_bits)
+from finder import DuplicateFinder
+from test_scan_state import group_names, write_corpus
+
+num_rows = 4_000
+
+
+def test_pack_bits():
+    bits = np.zeros((2, 8, 8), dtype=bool)
+    bits[0, 0, 0] = True
+    bits[1, 7, 7] = True
+    assert pack_bits(bits).tolist() == [1 << 63, 1]
+
+
+def test_hashes_of_gradients():
+    gradient = np.tile(np.arange(9, dtype=np.float32), (8, 1))
+    assert difference_hash(gradient) == np.uint64(2 ** 64 - 1)
+    assert difference_hash(gradient[:, ::-1]) == 0
+    assert bin(int(average_hash(gradient[:, :8]))).count('1') == 32
+    # Stacks of thumbnails are hashed at once
+    stack = np.random.default_rng(0).random((5, 32, 32))
+    assert dct_hash(stack).shape == (5,)
+    assert dct_hash(stack)[3] == dct_hash(stack[3])
+
+
+@pytest.mark.parametrize("algorithm", list(HashAlgorithm))
+@pytest.mark.parametrize("streaming", [False, True])
+def test_find_with_hashes(tmp_path, algorithm, streaming):
+    write_corpus(tmp_path, 12)
+    finder = DuplicateFinder(extractor=HashExtractor(algorithm), streaming=streaming)
+    (groups, failed) = finder.find(str(tmp_path))
+    assert failed == []
+    for k in (0, 3, 6, 9):
+        assert any({f"{k}.jpg", f"{k}_copy.jpg"} <= set(group) for group in group_names(groups))
+    assert finder.state.kind == f"{algorithm.name}64"
+    assert finder.state.histograms.dtype == np.uint64
+
+
+def hashes_generator(count=num_rows, seed=0):
+    return np.random.default_rng(seed).integers(0, 2 ** 63, size=(count, 1), dtype=np.uint64)
+
+
+def test_hamming_pairs(benchmark):
+    hashes = hashes_generator()
+    (a, _, diff) = benchmark(lambda: collect_pairs(iter_pairs(hashes, 12, Metric.hamming)))
+    assert np.all(diff < 12)
+
+
+def test_l1_pairs_of_histograms(benchmark):
+    matrix = np.random.default_rng(0).integers(0, 1000, size=(num_rows, 768)).astype(np.uint32)
+    benchmark.pedantic(lambda: collect_pairs(iter_pairs(matrix, 1000, Metric.l1)), rounds=3)
+
+
+def test_normalized_histograms_match_resized_copies(tmp_path):
+    image = Image.fromarray(np.random.default_rng(3).integers(0, 256, (6, 8, 3), dtype=np.uint8))
+    image.resize((1600, 1200), Image.BILINEAR).save(tmp_path / "large.jpg", quality=95)
+    image.resize((160, 120), Image.BILINEAR).save(tmp_path / "small.jpg", quality=95)
+
+    (groups, _) = DuplicateFinder().find(str(tmp_path), threshold=0.1)
+    assert group_names(groups) == [["large.jpg", "small.jpg"]]
+    (groups, _) = DuplicateFinder(extractor=HistogramExtractor()).find(str(tmp_path), threshold=100_000)
+    assert groups == []
+
+    histogram = NormalizedHistogramExtractor().extract(tmp_path / "large.jpg")
+    assert histogram.dtype == np.uint16
+    assert np.all(np.abs(histogram.sum(axis=1).astype(np.int64) - NORMALIZED_TOTAL) < 256)
+    with pytest.raises(ValueError):
+        DuplicateFinder().find(str(tmp_path), threshold=2)
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import numpy as np
+
+from finder import DuplicateFinder, Pair
+from grouping import connected_groups, pair_groups
+from image_store import ImageStore
+
+num_pairs = 1_000_000
+num_ids = 1_500_000
+
+
+def pairs_generator(count=num_pairs, ids=num_ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(0, ids, size=count), rng.integers(0, ids, size=count))
+
+
+def linear_get_groups(pairs):
+    """The former linear group search of DuplicateFinder.get_groups"""
+    groups = []
+    for pair in pairs:
+        pair_in_groups = []
+        for i, group in enumerate(groups):
+            if pair.a in group or pair.b in group:
+                pair_in_groups.append(i)
+        if len(pair_in_groups) > 1:
+            for group_id in reversed(pair_in_groups[1:]):
+                groups[pair_in_groups[0]].update(groups[group_id])
+                del groups[group_id]
+        if len(pair_in_groups) > 0:
+            groups[pair_in_groups[0]].update([(pair.a, None), (pair.b, None)])
+        else:
+            groups.append(dict.fromkeys([pair.a, pair.b]))
+    return groups
+
+
+def test_get_groups_matches_linear_search():
+    store = ImageStore()
+    images = [store[store.add(Path(f"{i}.jpg"))] for i in range(300)]
+    a, b = pairs_generator(count=250, ids=len(images), seed=1)
+    pairs = [Pair(a=images[i], b=images[j], diff=0) for i, j in zip(a.tolist(), b.tolist()) if i != j]
+
+    groups = DuplicateFinder().get_groups(pairs)
+    expected = linear_get_groups(pairs)
+    assert [set(group) for group in groups] == [set(group) for group in expected]
+    # The first image of each group stays unchecked, so it must not change
+    assert [next(iter(group)) for group in groups] == [next(iter(group)) for group in expected]
+
+
+def test_pair_groups_order():
+    assert pair_groups(np.array([9, 4, 2]), np.array([4, 7, 8])) == [[9, 4, 7], [2, 8]]
+
+
+def test_connected_groups_order():
+    groups = connected_groups(7, np.array([5, 1, 3]), np.array([6, 3, 0]))
+    assert groups == [[0, 1, 3], [5, 6]]
+    assert connected_groups(3, np.array([], dtype=np.intp), np.array([], dtype=np.intp)) == []
+
+
+def test_connected_groups(benchmark):
+    a, b = pairs_generator()
+    groups = benchmark(connected_groups, num_ids, a, b)
+    assert sum(len(group) for group in groups) <= num_ids
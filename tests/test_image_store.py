@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import numpy as np
+
+from image_store import Color, ImageStore
+
+
+def test_image_store_views():
+    store = ImageStore(capacity=2)
+    histograms = np.arange(4 * 768, dtype=np.uint32).reshape(4, 3, 256)
+    for i, histogram in enumerate(histograms):
+        store.add(Path(f"{i}.jpg"), histogram, size=i, mtime_ns=10 * i)
+    failed = store.add(Path("broken.jpg"), error=ValueError("broken"))
+
+    assert len(store) == 5
+    assert np.array_equal(store.histograms[:4], histograms)
+    assert store.matrix().shape == (5, 768)
+    assert np.shares_memory(store.matrix(), store.histograms)
+    assert np.array_equal(store.matrix(np.array([2, 0])), histograms[[2, 0]].reshape(2, -1))
+    assert store.stat(3) == (3, 30)
+
+    image = store[1]
+    assert image.path == Path("1.jpg")
+    assert np.array_equal(image.histogram[Color.green], histograms[1, 1])
+    assert image - store[0] == 768 * 768
+    assert store[failed].histogram is None
+    assert isinstance(store[failed].error, ValueError)
+
+    assert image.checked
+    image.checked = False
+    assert not store[1].checked and store[0].checked and store[2].checked
+    assert store[1] == image and hash(store[1]) == hash(image)
+
+
+def test_empty_image_store_matrix():
+    assert ImageStore().matrix().shape == (0, 768)
+    assert ImageStore(shape=(1,)).matrix(np.empty((0,), dtype=np.intp)).shape == (0, 1)
@@ -0,0 +1,24 @@
+from gui.layout import TITLE, GroupLayout
+
+
+def test_group_layout():
+    # Titles are 10 high, images 20 wide and 30 high, in rows of 2
+    layout = GroupLayout([3, 1, 4], columns=2, cell_width=20, cell_height=30, title_height=10)
+    assert layout.tops.tolist() == [0, 70, 110, 180]
+    assert layout.height == 180
+
+    cells = [(cell.group, cell.index, cell.x, cell.y) for cell in layout.visible(0, 180)]
+    assert cells == [(0, TITLE, 0, 0), (0, 0, 0, 10), (0, 1, 20, 10), (0, 2, 0, 40),
+                     (1, TITLE, 0, 70), (1, 0, 0, 80),
+                     (2, TITLE, 0, 110), (2, 0, 0, 120), (2, 1, 20, 120), (2, 2, 0, 150), (2, 3, 20, 150)]
+    # Only the second row of the first group and the title of the second group
+    assert [(cell.group, cell.index) for cell in layout.visible(45, 75)] == [(0, 2), (1, TITLE)]
+    assert list(GroupLayout([], 3, 1, 1, 1).visible(0, 100)) == []
+
+
+def test_visible_cells_of_many_groups():
+    layout = GroupLayout([2, 5, 3] * 100_000, columns=4, cell_width=136, cell_height=160, title_height=28)
+    top = layout.height // 2
+    cells = list(layout.visible(top, top + 800))
+    assert 0 < len(cells) <= 5 * 5 + 5
+    assert all(top - 160 < cell.y < top + 800 for cell in cells)
@@ -0,0 +1,71 @@
+import shutil
+
+import pytest
+
+from finder import CompareMode, DuplicateFinder
+from metrics import ProgressSnapshot, ProgressTracker, Stage, format_duration
+from test_scan_state import write_corpus
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_snapshots_are_rate_limited():
+    clock = FakeClock()
+    snapshots = []
+    tracker = ProgressTracker(snapshots.append, interval=0.5, clock=clock)
+    tracker.start(Stage.analyze, "Analyzing images...", 1_000)
+    for _ in range(1_000):
+        clock.now += 1 / 64
+        tracker.advance(1, 2_000_000)
+    tracker.finish()
+    # One at the start, one per half second and the final one
+    assert len(snapshots) == 1 + 31 + 1
+    last = snapshots[-1]
+    assert (last.done, last.percent, last.stage) == (1_000, 100, Stage.analyze)
+    assert last.items_per_second == pytest.approx(64)
+    assert last.bytes_per_second == pytest.approx(128e6)
+    assert last.eta == 0
+
+    middle = snapshots[10]
+    assert middle.eta == pytest.approx((1_000 - middle.done) / 64)
+    assert middle.describe() == f"Analyzing images... {middle.percent}%, 64 images/s, 128.0 MB/s, " \
+                                f"ETA {format_duration(middle.eta)}"
+
+
+def test_snapshot_without_progress():
+    snapshot = ProgressSnapshot(Stage.compare, "Comparing files...", done=0, total=0, bytes_done=0, elapsed=0)
+    assert snapshot.percent == 0
+    assert snapshot.eta is None
+    assert snapshot.describe() == "Comparing files... 0%"
+    assert format_duration(3_725) == "1:02:05"
+
+
+def test_find_reports_stages(tmp_path):
+    write_corpus(tmp_path, 12)
+    snapshots = []
+    finder = DuplicateFinder(mode=CompareMode.exact, progress_interval=60)
+    finder.find(str(tmp_path), progress_handler=snapshots.append)
+    # Only the start and the end of each stage are reported within the interval
+    assert [snapshot.stage for snapshot in snapshots] == [Stage.analyze, Stage.analyze, Stage.compare, Stage.compare]
+    assert snapshots[1].done == snapshots[1].total == 12 + 4
+    assert snapshots[1].bytes_done > 0
+    assert snapshots[3].percent == 100
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_analyze_stage_completes_with_exact_duplicates(tmp_path, streaming):
+    write_corpus(tmp_path, 10)
+    for k in range(5):
+        shutil.copy(tmp_path / f"{k}.jpg", tmp_path / f"{k}_exact.jpg")
+    snapshots = []
+    finder = DuplicateFinder(exact_duplicates=True, streaming=streaming, progress_interval=60)
+    finder.find(str(tmp_path), progress_handler=snapshots.append)
+    analyzed = [snapshot for snapshot in snapshots if snapshot.stage == Stage.analyze]
+    # The copies are not decoded, so they are not part of the total
+    assert analyzed[-1].done == analyzed[-1].total == 10 + 4
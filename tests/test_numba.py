@@ -1,6 +1,8 @@
 import numpy as np
 import numba
 
+from finder import rgb_histogram
+
 num_iterations = 6_000_000
 num_bins = 256
 
@@ -58,3 +60,37 @@ def numba_histogram(a, bins):
             hist[int(bin)] += 1
 
     return hist, bin_edges
+
+
+image_shape = (2_000, 3_000, 3)
+
+
+def image_generator():
+    return np.random.default_rng(0).integers(0, 256, size=image_shape, dtype=np.uint8)
+
+
+def per_channel_numba_histogram(image):
+    return [numba_histogram(image[:, :, channel], num_bins) for channel in range(3)]
+
+
+def per_channel_bincount(image):
+    pixels = image.reshape(-1, 3)
+    return [np.bincount(pixels[:, channel], minlength=num_bins) for channel in range(3)]
+
+
+def test_rgb_histogram_matches_bincount():
+    image = image_generator()
+    expected = np.stack(per_channel_bincount(image))
+    assert np.array_equal(rgb_histogram(image.reshape(-1, 3)), expected)
+
+
+def test_image_numba_histogram(benchmark):
+    benchmark(per_channel_numba_histogram, image_generator())
+
+
+def test_image_bincount(benchmark):
+    benchmark(per_channel_bincount, image_generator())
+
+
+def test_image_rgb_histogram(benchmark):
+    benchmark(rgb_histogram, image_generator().reshape(-1, 3))
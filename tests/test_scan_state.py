@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from finder import CompareMode, DuplicateFinder
+from scan_state import ScanState
+
+threshold = 0.1
+
+
+def write_corpus(path, count):
+    rng = np.random.default_rng(2)
+    for k in range(count):
+        image = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize((160, 120), Image.BILINEAR)
+        image.save(path / f"{k}.jpg", quality=95)
+        if k % 3 == 0:
+            image.save(path / f"{k}_copy.jpg", quality=85)
+
+
+def group_names(groups):
+    return sorted(sorted(image.path.name for image in group) for group in groups)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_incremental_scan_matches_full_scan(tmp_path, streaming):
+    write_corpus(tmp_path, 30)
+    finder = DuplicateFinder()
+    finder.find(str(tmp_path), threshold=threshold)
+    finder.state.save(tmp_path.parent / "state.npz")
+
+    # Add, remove and change images
+    shutil.copy(tmp_path / "3.jpg", tmp_path / "new.jpg")
+    os.remove(tmp_path / "6_copy.jpg")
+    shutil.copy(tmp_path / "1.jpg", tmp_path / "2.jpg")
+
+    state = ScanState.load(tmp_path.parent / "state.npz")
+    incremental = DuplicateFinder(state=state, streaming=streaming)
+    (groups, failed) = incremental.find(str(tmp_path), threshold=threshold)
+    (full_groups, full_failed) = DuplicateFinder().find(str(tmp_path), threshold=threshold)
+
+    assert failed == full_failed == []
+    assert group_names(groups) == group_names(full_groups)
+    assert ["3.jpg", "3_copy.jpg", "new.jpg"] in group_names(groups)
+    assert len(incremental.state.paths) == len(state.paths)
+
+
+@pytest.mark.parametrize("mode", list(CompareMode))
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("exact_duplicates", [False, True])
+def test_find_in_empty_directory(tmp_path, mode, streaming, exact_duplicates):
+    finder = DuplicateFinder(mode=mode, streaming=streaming, exact_duplicates=exact_duplicates)
+    assert finder.find(str(tmp_path), threshold=threshold) == ([], [])
+    assert finder.state.paths == []
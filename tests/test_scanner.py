@@ -0,0 +1,62 @@
+import os
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import scanner as scanner_module
+from scanner import Scanner
+
+
+def test_scanner_walks_each_file_once(tmp_path):
+    (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+    (tmp_path / "skip").mkdir()
+    for name in ["1.jpg", "a/2.JPEG", "a/b/3.jpg", "a/b/c/4.jpg", "a/b/c/5.png", "a/b/c/7.txt", "skip/6.jpg"]:
+        (tmp_path / name).write_bytes(b"")
+    os.link(tmp_path / "1.jpg", tmp_path / "a" / "hardlink.jpg")
+    os.symlink(tmp_path / "a", tmp_path / "a" / "b" / "loop")
+
+    scanner = Scanner(exclude=["skip"])
+    found = sorted(path.relative_to(tmp_path).as_posix() for path in scanner.scan(tmp_path))
+    assert found == ["1.jpg", "a/2.JPEG", "a/b/3.jpg", "a/b/c/4.jpg", "a/b/c/5.png"]
+    assert scanner.found == 5
+
+    # Following the link to a parent directory must not loop
+    found = list(Scanner(follow_symlinks=True).scan(tmp_path))
+    assert len(found) == 6
+
+
+def test_scanner_cancel(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "1.jpg").write_bytes(b"")
+    assert list(Scanner().scan(tmp_path, lambda: True)) == []
+
+
+class WindowsEntry:
+    """DirEntry as on Windows, whose stat has no device and file id"""
+
+    def __init__(self, entry):
+        self._entry = entry
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def stat(self):
+        stat = self._entry.stat()
+        return SimpleNamespace(st_dev=0, st_ino=0, st_size=stat.st_size, st_mtime_ns=stat.st_mtime_ns)
+
+
+def test_scanner_without_file_ids_in_directory_entries(tmp_path, monkeypatch):
+    (tmp_path / "a").mkdir()
+    for name in ["1.jpg", "2.jpg", "a/3.jpg"]:
+        (tmp_path / name).write_bytes(b"")
+    os.link(tmp_path / "1.jpg", tmp_path / "a" / "hardlink.jpg")
+    scandir = os.scandir
+
+    @contextmanager
+    def windows_scandir(path):
+        with scandir(path) as entries:
+            yield [WindowsEntry(entry) for entry in entries]
+
+    monkeypatch.setattr(scanner_module.os, "scandir", windows_scandir)
+    found = sorted(path.name for path in Scanner().scan(tmp_path))
+    # Every file is found and the hard link is still recognized
+    assert len(found) == 3 and {"2.jpg", "3.jpg"} <= set(found)
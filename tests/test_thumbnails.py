@@ -0,0 +1,139 @@
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from gui.graphics import (ORIENTATION_TAG, DiskThumbnailStore, LruCache, SizeClass, ThumbnailCache,
+                          decode_thumbnail)
+from gui.thumbnails import PRIORITY_PREFETCH, ThumbnailLoader
+
+
+def write_photo(path, size=(800, 600), orientation=None):
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize(size)
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION_TAG] = orientation
+    image.save(path, exif=exif)
+
+
+def wait_for(loader, count, timeout=10):
+    done = []
+    deadline = time.monotonic() + timeout
+    while len(done) < count and time.monotonic() < deadline:
+        done.extend(loader.poll())
+        time.sleep(0.01)
+    return done
+
+
+def test_decode_thumbnail(tmp_path):
+    write_photo(tmp_path / "landscape.jpg")
+    write_photo(tmp_path / "rotated.jpg", orientation=6)
+    image = decode_thumbnail(tmp_path / "landscape.jpg", (128, 128))
+    assert (image.mode, image.size) == ('RGB', (128, 96))
+    # Rotated by the EXIF orientation
+    assert decode_thumbnail(tmp_path / "rotated.jpg", (128, 128)).size == (96, 128)
+    assert decode_thumbnail(tmp_path / "landscape.jpg").size == (800, 600)
+
+
+def test_loader(tmp_path):
+    paths = []
+    for k in range(6):
+        write_photo(tmp_path / f"{k}.jpg")
+        paths.append(tmp_path / f"{k}.jpg")
+    (tmp_path / "broken.jpg").write_bytes(b'\xff\xd8\xff')
+    loader = ThumbnailLoader(ThumbnailCache(), workers=2)
+    try:
+        for path in paths[:3] + [tmp_path / "broken.jpg"]:
+            assert loader.request((path, (64, 64)))
+        assert not loader.request((paths[0], (64, 64)))
+        for path in paths[3:]:
+            loader.request((path, (64, 64)), PRIORITY_PREFETCH)
+        done = dict(wait_for(loader, 6))
+        assert sorted(done) == sorted((path, (64, 64)) for path in paths)
+        (data, size) = done[(paths[0], (64, 64))]
+        assert size == (64, 48) and len(data) == 64 * 48 * 3
+
+        # Prefetched thumbnails are reported again from the cache when they are requested
+        assert not loader.request((paths[5], (64, 64)))
+        assert wait_for(loader, 1) == [((paths[5], (64, 64)), done[(paths[5], (64, 64))])]
+    finally:
+        loader.close()
+
+
+class BlockingCache:
+    """Cache whose first load waits until it is released, so requests pile up behind it"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.loaded = []
+
+    def __contains__(self, key):
+        return False
+
+    def load(self, key):
+        if len(self.loaded) == 0:
+            self.started.set()
+            self.release.wait(10)
+        self.loaded.append(key)
+        return (b'', (1, 1))
+
+
+def test_loader_skips_discarded_requests():
+    cache = BlockingCache()
+    loader = ThumbnailLoader(cache, workers=1)
+    try:
+        keys = [(f"{k}.jpg", (64, 64)) for k in range(5)]
+        loader.request(keys[0])
+        assert cache.started.wait(10)
+        for key in keys[1:]:
+            loader.request(key)
+        # Scrolled out of view while the first image was decoded
+        loader.discard(keys[1])
+        loader.discard(keys[3])
+        cache.release.set()
+        assert sorted(key for key, _ in wait_for(loader, 3)) == [keys[0], keys[2], keys[4]]
+        assert cache.loaded == [keys[0], keys[2], keys[4]]
+        # Discarded images are decoded when they are requested again
+        assert loader.request(keys[1])
+        assert wait_for(loader, 1)[0][0] == keys[1]
+    finally:
+        loader.close()
+
+
+def test_lru_cache():
+    cache = LruCache(max_bytes=300)
+    for key in "abc":
+        cache.put(key, key.upper(), 100)
+    # A hit keeps "a" from being evicted next
+    assert cache.get("a") == "A"
+    cache.put("d", "D", 100)
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    cache.put("e", "E", 1_000)
+    assert cache.get("e") is None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.entries, stats.bytes) == (4, 2, 1, 3, 300)
+
+
+def test_thumbnail_cache(tmp_path):
+    write_photo(tmp_path / "image.jpg")
+    disk = DiskThumbnailStore(tmp_path / "thumbnails")
+    cache = ThumbnailCache({'thumbnail': 64 * 48 * 3, 'preview': 10 ** 7}, disk)
+    small = cache.load((tmp_path / "image.jpg", (64, 64)))
+    # Previews have their own pool, so they do not evict the list thumbnails
+    cache.load((tmp_path / "image.jpg", (512, 512)))
+    assert cache.load((tmp_path / "image.jpg", (64, 64))) is small
+    stats = cache.stats()
+    assert (stats[SizeClass.thumbnail].hits, stats[SizeClass.thumbnail].entries) == (1, 1)
+    assert stats[SizeClass.preview].bytes == 512 * 384 * 3
+
+    # A new session shows the stored thumbnails without decoding
+    reopened = ThumbnailCache(disk=DiskThumbnailStore(tmp_path / "thumbnails"))
+    assert reopened.load((tmp_path / "image.jpg", (64, 64)))[1] == (64, 48)
+    assert reopened.disk.hits == 1
+    # Changed images get new thumbnails
+    write_photo(tmp_path / "image.jpg", size=(400, 400))
+    assert reopened.load((tmp_path / "image.jpg", (128, 128)))[1] == (128, 128)
+    assert DiskThumbnailStore(tmp_path / "thumbnails", max_bytes=0).prune() == 3